@@ -0,0 +1,504 @@
+"""HTTP API tổng hợp giọng nói cho các client tự động, chạy chung process với model.
+
+    python api.py --host 0.0.0.0 --port 8600
+
+Server asyncio chỉ dùng thư viện chuẩn; model (synthesis.get_tts), database.py, kho mẫu
+giọng và lịch sử dùng chung với app.py. Xác thực bằng HTTP Basic với bảng users
+(mật khẩu bcrypt như khi đăng nhập trên UI).
+
+    POST /v1/voices?ext=wav      body: file mẫu giọng            -> {"voice_id": ...}
+    POST /v1/synthesize          body: {"text", "lang", "voice_id", "format"?, "device"?, "precision"?}
+                                 -> audio/wav gửi theo chunk ngay trong lúc tổng hợp
+    GET  /v1/history/export?format=json&from=YYYY-MM-DD&to=YYYY-MM-DD&ids=<id>,<id>
+                                 -> application/zip theo chunk; đăng nhập bằng HTTP Basic hoặc
+                                    token=<export.link_token> (nút "Tải file ZIP" trên UI)
+    GET  /healthz
+
+Audio trả về luôn là WAV PCM 16-bit mono, kể cả khi lấy từ cache kết quả (bản lưu được
+chuyển sang WAV một lần rồi giữ lại như khi tải về trên UI). Mỗi yêu cầu được ghi vào lịch sử
+(db.add_history_item); "format" là định dạng file lưu trong lịch sử khi phải tổng hợp mới,
+còn khi cache trúng thì mục lịch sử dùng lại file đã lưu của lần tổng hợp trước (như UI).
+"""
+import argparse
+import asyncio
+import base64
+import binascii
+import datetime
+import hashlib
+import json
+import struct
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import audio_formats
+import credentials
+import database as db
+import export
+import metrics
+import synthesis
+import voice_store
+from settings import (
+    API_HOST,
+    API_MAX_BODY_BYTES,
+    API_PORT,
+    API_READ_TIMEOUT,
+    API_SYNTH_THREADS,
+    CREDENTIAL_CACHE_TTL,
+    EXPORT_LINK_MAX_IDS,
+    LANGUAGES,
+    OUTPUT_DIR,
+    PRELOAD_DEVICES,
+)
+
+VOICE_EXTS = ("wav", "flac", "mp3")
+MAX_HEADERS = 100
+FILE_CHUNK_SIZE = 256 * 1024
+
+# các luồng tổng hợp; model vẫn chỉ chạy một batch/một luồng streaming tại một thời điểm (batching.py)
+_synth_pool = ThreadPoolExecutor(max_workers=API_SYNTH_THREADS, thread_name_prefix="api-synth")
+
+# (username, sha256(mật khẩu)) -> (hash trong DB lúc kiểm tra, thời điểm): bcrypt chậm có chủ ý,
+# không nên chạy lại ở mỗi request của cùng một client
+_verified = {}
+_verified_lock = threading.Lock()
+
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: str = None):
+        super().__init__(message or status.phrase)
+        self.status = status
+        self.message = message or status.phrase
+
+
+class Request:
+    __slots__ = ("method", "path", "query", "headers", "body", "username")
+
+    def __init__(self, method: str, target: str, headers: dict, body: bytes):
+        parts = urlsplit(target)
+        self.method = method
+        self.path = parts.path
+        self.query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        self.headers = headers
+        self.body = body
+        self.username = None
+
+    def json(self) -> dict:
+        try:
+            data = json.loads(self.body or b"{}")
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Body không phải JSON hợp lệ.")
+        if not isinstance(data, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Body phải là một object JSON.")
+        return data
+
+
+# --- Xác thực ---
+
+def check_password(username: str, password: str) -> bool:
+    """So mật khẩu với hash bcrypt của user trong bảng users (qua cache của credentials.py)."""
+    import bcrypt
+
+    entry = credentials.get_entry(username)
+    if not entry or not entry['password']:
+        return False
+    key = (username, hashlib.sha256(password.encode()).hexdigest())
+    now = time.monotonic()
+    with _verified_lock:
+        hit = _verified.get(key)
+    if hit and hit[0] == entry['password'] and now - hit[1] < CREDENTIAL_CACHE_TTL:
+        return True
+    try:
+        ok = bcrypt.checkpw(password.encode(), entry['password'].encode())
+    except ValueError:
+        return False
+    if ok:
+        with _verified_lock:
+            _verified[key] = (entry['password'], now)
+    return ok
+
+
+async def authenticate(request: Request) -> str:
+    """Username từ header Authorization: Basic; HTTPError 401 nếu sai."""
+    scheme, _, value = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "basic":
+        try:
+            username, _, password = base64.b64decode(value).decode("utf-8").partition(":")
+        except (binascii.Error, UnicodeDecodeError):
+            username, password = "", ""
+        username = username.lower().strip()
+        if username and await asyncio.to_thread(check_password, username, password):
+            return username
+    raise HTTPError(HTTPStatus.UNAUTHORIZED, "Sai tên đăng nhập hoặc mật khẩu.")
+
+
+# --- Ghi phản hồi ---
+
+async def send(writer, status: HTTPStatus, body: bytes = b"", content_type: str = "application/json",
+               headers: dict = None) -> None:
+    head = [f"HTTP/1.1 {status.value} {status.phrase}", f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}"]
+    head += [f"{k}: {v}" for k, v in (headers or {}).items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+
+
+async def send_json(writer, data, status: HTTPStatus = HTTPStatus.OK, headers: dict = None) -> None:
+    await send(writer, status, json.dumps(data, ensure_ascii=False).encode("utf-8"), headers=headers)
+
+
+async def start_chunked(writer, content_type: str, headers: dict = None) -> None:
+    head = ["HTTP/1.1 200 OK", f"Content-Type: {content_type}", "Transfer-Encoding: chunked"]
+    head += [f"{k}: {v}" for k, v in (headers or {}).items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+    await writer.drain()
+
+
+async def write_chunk(writer, data: bytes) -> None:
+    if data:
+        writer.write(b"%X\r\n%s\r\n" % (len(data), data))
+        await writer.drain()
+
+
+async def end_chunked(writer) -> None:
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+
+async def stream_file(writer, path, content_type: str) -> None:
+    await start_chunked(writer, content_type)
+    with open(path, "rb") as f:
+        while True:
+            data = await asyncio.to_thread(f.read, FILE_CHUNK_SIZE)
+            if not data:
+                break
+            await write_chunk(writer, data)
+    await end_chunked(writer)
+
+
+def wav_header(sample_rate: int) -> bytes:
+    """Header WAV PCM 16-bit mono khi chưa biết độ dài: kích thước để tối đa như ffmpeg khi ghi ra pipe."""
+    return (b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE"
+            + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16)
+            + b"data" + struct.pack("<I", 0xFFFFFFFF))
+
+
+# --- Tổng hợp ---
+
+def _synthesize_job(loop, queue: asyncio.Queue, cancelled: threading.Event, username: str, params: dict) -> None:
+    """Chạy trong luồng của _synth_pool: như chế độ streaming của app.py (ghi dần file WAV, rồi
+    chuyển định dạng, cache và ghi lịch sử), đẩy header + từng khối PCM vào queue.
+
+    Queue không giới hạn để luồng này không bao giờ phải chờ client chậm;
+    None đánh dấu hết audio, một Exception là lỗi trước khi có audio.
+    """
+    def emit(item):
+        loop.call_soon_threadsafe(queue.put_nowait, item)
+
+    text, lang, voice_id = params["text"], params["lang"], params["voice_id"]
+    out_path = OUTPUT_DIR / f"xtts_output_{uuid.uuid4().hex}.wav"
+    timer = metrics.RequestTimer(lang, synthesis.resolve_device(params["device"]))
+    total_samples = 0
+    try:
+        with timer.activate():
+            tts = synthesis.get_tts(params["device"], params["precision"])
+            sr = tts.synthesizer.output_sample_rate
+            # tính latent giọng trước khi gửi header để lỗi mẫu giọng còn trả được mã 500
+            latents = synthesis.get_conditioning_latents(tts, str(params["voice_path"]))
+            emit(wav_header(sr))
+            chunks = synthesis.stream_to_file(tts, text, str(params["voice_path"]), lang, str(out_path),
+                                              latents=latents)
+            try:
+                for chunk in chunks:
+                    if cancelled.is_set():
+                        break
+                    total_samples += len(chunk)
+                    emit(synthesis._to_pcm16(chunk))
+            finally:
+                # đóng generator ngay để dừng sinh audio khi client ngắt giữa chừng
+                chunks.close()
+            emit(None)
+            if cancelled.is_set():
+                out_path.unlink(missing_ok=True)
+                return
+            with metrics.span("wav_write"):
+                out_path = audio_formats.finalize_output(out_path, params["format"])
+    except Exception as err:
+        traceback.print_exc()
+        print(f"Lỗi khi tổng hợp qua API: {err}")
+        out_path.unlink(missing_ok=True)
+        emit(err)
+        return
+    db.put_cached_result(params["cache_key"], str(out_path))
+    timer.finish(total_samples / sr)
+    with metrics.observe("db_insert", lang):
+        db.add_history_item(
+            username=username,
+            text=text,
+            lang=lang,
+            voice_id=voice_id,
+            output_path=str(out_path),
+            metrics=timer.to_dict(),
+        )
+
+
+def _synthesis_params(data: dict) -> dict:
+    text = str(data.get("text") or "").strip()
+    lang = data.get("lang") or "vi"
+    fmt = data.get("format") or audio_formats.DEFAULT_FORMAT
+    precision = data.get("precision") or "fp32"
+    if not text:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Thiếu text.")
+    if not data.get("voice_id"):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Thiếu voice_id (tải mẫu giọng qua POST /v1/voices).")
+    if lang not in LANGUAGES:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"lang phải là một trong {', '.join(LANGUAGES)}.")
+    if fmt not in audio_formats.FORMATS:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"format phải là một trong {', '.join(audio_formats.FORMATS)}.")
+    if precision not in synthesis.PRECISIONS:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"precision phải là một trong {', '.join(synthesis.PRECISIONS)}.")
+    return {
+        "text": text,
+        "lang": lang,
+        "voice_id": str(data["voice_id"]),
+        "format": fmt,
+        "precision": precision,
+        # int8 luôn chạy trên CPU, như lựa chọn "CPU nhanh" của UI
+        "device": "cpu" if precision == "int8" else (data.get("device") or "auto"),
+    }
+
+
+async def handle_synthesize(request: Request, writer) -> None:
+    params = _synthesis_params(request.json())
+    params["voice_path"] = await asyncio.to_thread(voice_store.voice_path, params["voice_id"])
+    if not params["voice_path"]:
+        raise HTTPError(HTTPStatus.NOT_FOUND, "Không tìm thấy mẫu giọng với voice_id này.")
+
+    # cùng văn bản + ngôn ngữ + giọng + model -> trả lại file đã có, không tổng hợp lại
+    params["cache_key"] = synthesis.result_cache_key(params["text"], params["lang"], params["voice_id"],
+                                                     params["precision"])
+    cached_path = await asyncio.to_thread(db.get_cached_result, params["cache_key"])
+    if cached_path:
+        wav_path = await asyncio.to_thread(audio_formats.get_variant, cached_path, "wav")
+        if not wav_path:
+            raise HTTPError(HTTPStatus.INTERNAL_SERVER_ERROR, "Không đọc được bản thu đã lưu.")
+        await asyncio.to_thread(lambda: db.add_history_item(
+            username=request.username,
+            text=params["text"],
+            lang=params["lang"],
+            voice_id=params["voice_id"],
+            output_path=cached_path,
+        ))
+        await stream_file(writer, wav_path, "audio/wav")
+        return
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    cancelled = threading.Event()
+    loop.run_in_executor(_synth_pool, _synthesize_job, loop, queue, cancelled, request.username, params)
+    finished = False
+    try:
+        item = await queue.get()
+        if isinstance(item, Exception):
+            raise HTTPError(HTTPStatus.INTERNAL_SERVER_ERROR, f"Tổng hợp thất bại: {item}")
+        await start_chunked(writer, "audio/wav")
+        while item is not None:
+            if isinstance(item, Exception):
+                # lỗi giữa chừng: đóng kết nối không gửi chunk kết thúc để client biết audio bị cắt
+                raise ConnectionAbortedError(str(item))
+            await write_chunk(writer, item)
+            item = await queue.get()
+        finished = True
+        await end_chunked(writer)
+    finally:
+        if not finished:
+            # client ngắt kết nối hoặc lỗi: dừng tổng hợp, không ghi lịch sử
+            cancelled.set()
+
+
+async def handle_voice_upload(request: Request, writer) -> None:
+    ext = request.query.get("ext", "wav").lower().lstrip(".")
+    if ext not in VOICE_EXTS:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"ext phải là một trong {', '.join(VOICE_EXTS)}.")
+    if not request.body:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Body rỗng: gửi nội dung file mẫu giọng.")
+    with metrics.observe("upload_write"):
+        voice_id = await asyncio.to_thread(voice_store.save_voice, request.body, ext)
+    if not voice_id:
+        raise HTTPError(HTTPStatus.INTERNAL_SERVER_ERROR, "Không thể lưu mẫu giọng.")
+    await send_json(writer, {"voice_id": voice_id}, HTTPStatus.CREATED)
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.datetime.combine(datetime.date.fromisoformat(value), datetime.time())
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"Ngày không hợp lệ: {value} (YYYY-MM-DD).")
+
+
+def _selected_items(username: str, ids: list, start, end) -> list:
+    """Các mục trong ids thuộc về username, trong khoảng [start, end) nếu có."""
+    return [
+        it for it in db.get_history_items(ids)
+        if it["username"] == username
+        and (start is None or it["created_at"] >= start)
+        and (end is None or it["created_at"] < end)
+    ]
+
+
+async def handle_export(request: Request, writer) -> None:
+    token = request.query.get("token")
+    if token:
+        # link ký sẵn từ UI: trình duyệt mở thẳng, không có header Authorization
+        request.username = export.verify_link_token(token, db.config["cookies"]["key"])
+        if not request.username:
+            raise HTTPError(HTTPStatus.FORBIDDEN, "Link tải đã hết hạn hoặc không hợp lệ, hãy tạo lại trên UI.")
+    else:
+        request.username = await authenticate(request)
+    fmt = request.query.get("format", "json")
+    if fmt not in export.MANIFEST_FORMATS:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"format phải là một trong {', '.join(export.MANIFEST_FORMATS)}.")
+    start = _parse_date(request.query.get("from"))
+    end = _parse_date(request.query.get("to"))
+    if end:
+        end += datetime.timedelta(days=1)
+    ids = [i for i in request.query.get("ids", "").split(",") if i]
+    if len(ids) > EXPORT_LINK_MAX_IDS:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"Tối đa {EXPORT_LINK_MAX_IDS} mục trong ids.")
+    if ids:
+        items = await asyncio.to_thread(_selected_items, request.username, ids, start, end)
+    else:
+        items = await asyncio.to_thread(db.load_history, request.username, start, end)
+    # ZIP sinh dần từ các file trên đĩa (export.iter_zip), không ghi file tạm
+    chunks = export.iter_zip(items, fmt)
+    await start_chunked(writer, "application/zip",
+                        {"Content-Disposition": f'attachment; filename="lich_su_{request.username}.zip"'})
+    while True:
+        data = await asyncio.to_thread(next, chunks, None)
+        if data is None:
+            break
+        await write_chunk(writer, data)
+    await end_chunked(writer)
+
+
+async def handle_health(request: Request, writer) -> None:
+    await send_json(writer, {"status": "ok"})
+
+
+# (method, path) -> (handler, cần đăng nhập)
+ROUTES = {
+    ("GET", "/healthz"): (handle_health, False),
+    ("POST", "/v1/voices"): (handle_voice_upload, True),
+    ("POST", "/v1/synthesize"): (handle_synthesize, True),
+    # tự xác thực: HTTP Basic hoặc token của link tải trên UI
+    ("GET", "/v1/history/export"): (handle_export, False),
+}
+
+
+# --- Kết nối ---
+
+async def read_request(reader):
+    """Đọc một request HTTP/1.1; None khi client đã đóng kết nối."""
+    line = await asyncio.wait_for(reader.readline(), API_READ_TIMEOUT)
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST)
+    headers = {"http-version": version}
+    for _ in range(MAX_HEADERS):
+        line = await asyncio.wait_for(reader.readline(), API_READ_TIMEOUT)
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HTTPError(HTTPStatus.LENGTH_REQUIRED, "Gửi body kèm Content-Length.")
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Content-Length không hợp lệ.")
+    if length > API_MAX_BODY_BYTES:
+        raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+    body = await asyncio.wait_for(reader.readexactly(length), API_READ_TIMEOUT) if length else b""
+    return Request(method.upper(), target, headers, body)
+
+
+def _keep_alive(request: Request) -> bool:
+    connection = request.headers.get("connection", "").lower()
+    if request.headers["http-version"] == "HTTP/1.0":
+        return connection == "keep-alive"
+    return connection != "close"
+
+
+async def handle_connection(reader, writer) -> None:
+    """Phục vụ các request nối tiếp trên một kết nối (keep-alive) tới khi client đóng hoặc lỗi."""
+    try:
+        while True:
+            request = None
+            try:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                route = ROUTES.get((request.method, request.path))
+                if not route:
+                    allowed = any(path == request.path for _, path in ROUTES)
+                    raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED if allowed else HTTPStatus.NOT_FOUND)
+                handler, needs_auth = route
+                if needs_auth:
+                    request.username = await authenticate(request)
+                await handler(request, writer)
+            except HTTPError as err:
+                headers = {"WWW-Authenticate": 'Basic realm="xtts"'} if err.status == HTTPStatus.UNAUTHORIZED else None
+                await send_json(writer, {"error": err.message}, err.status, headers)
+                if request is None:
+                    break
+            if not _keep_alive(request):
+                break
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+        pass
+    except Exception as err:
+        traceback.print_exc()
+        print(f"Lỗi khi xử lý request API: {err}")
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int) -> None:
+    server = await asyncio.start_server(handle_connection, host, port)
+    print(f"XTTS API đang chạy tại http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP API tổng hợp giọng nói XTTS.")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--no-preload", action="store_true", help="không nạp sẵn model lúc khởi động")
+    args = parser.parse_args()
+
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    db.init_db()
+    credentials.migrate_plaintext_passwords()
+    if not args.no_preload:
+        for device in PRELOAD_DEVICES:
+            synthesis.preload(device)
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
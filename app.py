@@ -1,12 +1,28 @@
 import streamlit as st
+import streamlit.components.v1 as components
 from pathlib import Path
 import uuid
-import os
+import base64
+import datetime
+import json
+from urllib.parse import urlencode
+import numpy as np
 import yaml 
 import streamlit_authenticator as stauth 
-from streamlit_authenticator.utilities.hasher import Hasher
 from yaml.loader import SafeLoader 
 import database as db 
+import synthesis
+import voice_store
+import history_store
+import jobs
+import audio_formats
+import credentials
+import documents
+import export
+import metrics
+import segments
+from settings import (API_PUBLIC_URL, EXPORT_LINK_MAX_IDS, LANGUAGES, MODEL_CACHE_ROOT, OUTPUT_DIR,
+                      POSTPROCESS_DEFAULTS, PRELOAD_DEVICES)
 
 # Khởi tạo database
 db.init_db()
@@ -41,15 +57,26 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
-PROJECT_ROOT = Path(__file__).resolve().parent
-MODEL_CACHE_ROOT = PROJECT_ROOT.parent / "xtts_model_cache"
-OUTPUT_DIR = PROJECT_ROOT / "outputs"
 # HISTORY_FILE = OUTPUT_DIR 
+# streaming: gom ít nhất chừng này giây audio rồi mới gửi xuống trình duyệt
+STREAM_PLAYBACK_SECONDS = 1.0
+# số mục lịch sử mỗi trang
+HISTORY_PAGE_SIZE = 20
 
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 MODEL_CACHE_ROOT.mkdir(parents=True, exist_ok=True)
 
 
+# nạp + warm-up model ở luồng nền ngay lần chạy đầu tiên của process,
+# để người dùng đầu tiên sau deploy không phải chờ tải model và JIT
+@st.cache_resource(show_spinner=False)
+def preload_models():
+    return [synthesis.preload(device) for device in PRELOAD_DEVICES]
+
+
+preload_models()
+
+
 # --- PHẦN XÁC THỰC ---
 with open('config.yaml') as file:
     config = yaml.load(file, Loader=SafeLoader)
@@ -61,36 +88,10 @@ authenticator = stauth.Authenticate(
     config['cookies']['cookie_expiry_days'],
 )
 
-# Load users from MySQL into the authenticator's in-memory credentials so login works
-try:
-    model = authenticator.authentication_controller.authentication_model
-    users = db.list_users()
-    for u in users:
-        uname = u.get('username')
-        if not uname:
-            continue
-        # normalise key (authenticator uses lowercase keys)
-        uname_key = uname.lower().strip()
-        if uname_key in model.credentials.get('usernames', {}):
-            continue
-        pw = u.get('password') or ''
-        first_name = u.get('first_name') or uname_key
-        last_name = u.get('last_name') or uname_key
-        email = u.get('email') or f"{uname_key}@example.com"
-        # If password in DB looks like a hash, insert it directly; otherwise register to hash it.
-        if Hasher.is_hash(pw):
-            model.credentials['usernames'][uname_key] = {
-                'email': email,
-                'logged_in': False,
-                'first_name': first_name,
-                'last_name': last_name,
-                'password': pw,
-            }
-        else:
-            # _register_credentials will hash the password and persist to model.credentials
-            model._register_credentials(uname_key, first_name, last_name, pw, email, "", None)
-except Exception:
-    pass
+# User trong MySQL được tải theo yêu cầu lúc đăng nhập (và cache trong process)
+# thay vì nạp cả bảng users ở mỗi lần chạy lại script
+credentials.migrate_plaintext_passwords()
+credentials.install(authenticator)
 
 # - Tab 1: login form 
 # - Tab 2: register form 
@@ -159,6 +160,7 @@ if not authentication_status:
                             st.warning('Đã tạo user nhưng không lấy được hash mật khẩu để lưu DB.')
                         else:
                             saved = db.add_user(username_key, pw_hash, first_name, last_name, reg_email)
+                            credentials.invalidate(username_key)
                             if not saved:
                                 st.warning('Đã tạo user trong bộ nhớ nhưng không lưu vào DB.')
 
@@ -186,21 +188,97 @@ if authentication_status:
         authenticator.logout('Đăng xuất', 'main')
     # ---- Sidebar ----
     
-    # load model 
+    # load model (registry theo thiết bị trong synthesis.get_tts)
     @st.cache_resource(show_spinner=True)
-    def load_model():
-        os.environ["COQUI_TTS_HOME"] = str(MODEL_CACHE_ROOT)
-        from TTS.api import TTS
-        return TTS("tts_models/multilingual/multi-dataset/xtts_v2")
-
-    def pick_device(opt: str):
-        if opt == "auto":
-            try:
-                import torch
-                return "cuda" if torch.cuda.is_available() else "cpu"
-            except Exception:
-                return "cpu"
-        return opt
+    def load_model(device: str = "auto", precision: str = "fp32"):
+        return synthesis.get_tts(device, precision)
+
+    # worker nền giữ model và xử lý hàng đợi job, sống theo process chứ không theo session
+    @st.cache_resource
+    def start_job_worker():
+        return jobs.JobWorker().start()
+
+    start_job_worker()
+
+    # Streamlit >= 1.37 có st.fragment, bản cũ hơn dùng st.experimental_fragment
+    _fragment = getattr(st, "fragment", None) or st.experimental_fragment
+
+    @_fragment(run_every=2)
+    def show_job_status(job_id: str):
+        """Theo dõi job đang chạy; khi xong thì chạy lại cả trang để hiển thị kết quả."""
+        job = db.get_job(job_id)
+        if not job:
+            st.session_state['current_job_id'] = None
+            return
+        if job['status'] == "queued":
+            st.info("⏳ Đang chờ trong hàng đợi...")
+        elif job['status'] == "running":
+            st.progress(float(job['progress'] or 0), text="🔊 Đang tổng hợp...")
+        elif job['status'] == "failed":
+            st.error(f"Tổng hợp thất bại: {job['error']}")
+            st.session_state['current_job_id'] = None
+        else:
+            st.session_state['current_job_id'] = None
+            st.session_state['last_output_path'] = job['output_path']
+            st.success(f"Đã lưu: {Path(job['output_path']).name} và ghi vào lịch sử.")
+            do_rerun()
+
+    def play_audio_chunk(wav: bytes):
+        """Đưa một đoạn WAV vào hàng đợi phát (Web Audio) của trang; các đoạn phát nối tiếp nhau."""
+        b64 = base64.b64encode(wav).decode()
+        components.html(
+            f"""
+            <script>
+            const w = window.parent;
+            const q = w.__xttsStream = w.__xttsStream || {{ ctx: new w.AudioContext(), t: 0, p: Promise.resolve() }};
+            const data = Uint8Array.from(atob("{b64}"), c => c.charCodeAt(0)).buffer;
+            q.p = q.p.then(() => q.ctx.resume()).then(() => q.ctx.decodeAudioData(data)).then(buf => {{
+                const src = q.ctx.createBufferSource();
+                src.buffer = buf;
+                src.connect(q.ctx.destination);
+                const start = Math.max(q.ctx.currentTime + 0.05, q.t);
+                src.start(start);
+                q.t = start + buf.duration;
+            }});
+            </script>
+            """,
+            height=0,
+        )
+
+    def download_in_format(out_path: Path, audio_bytes: bytes, key: str):
+        """Nút tải với lựa chọn định dạng; bản khác định dạng lưu được chuyển đổi lần đầu rồi cache."""
+        formats = list(audio_formats.FORMATS)
+        fmt = st.selectbox(
+            "Định dạng tải",
+            formats,
+            index=formats.index(audio_formats.format_of(out_path)),
+            format_func=audio_formats.FORMAT_LABELS.get,
+            key=f"{key}_fmt",
+            label_visibility="collapsed",
+        )
+        if fmt == audio_formats.format_of(out_path):
+            path, data = out_path, audio_bytes
+        else:
+            path = audio_formats.get_variant(out_path, fmt)
+            if not path:
+                st.error("Không chuyển được định dạng (cần cài ffmpeg).")
+                return
+            data = path.read_bytes()
+        st.download_button("Tải", data=data, file_name=path.name, mime=audio_formats.mime_type(path), key=key)
+
+    def play_with_chapters(out_path: Path, audio_bytes: bytes, chapters, key: str):
+        """st.audio; với tài liệu dài có thêm ô chọn chương để phát từ đầu chương đó."""
+        start = 0
+        if chapters:
+            idx = st.selectbox(
+                "Chương",
+                range(len(chapters)),
+                format_func=lambda i: f"{datetime.timedelta(seconds=int(chapters[i]['start']))} — "
+                                      f"{chapters[i]['title'] or 'Mở đầu'}",
+                key=f"{key}_chapter",
+            )
+            start = int(chapters[idx]["start"])
+        st.audio(audio_bytes, format=audio_formats.mime_type(out_path), start_time=start)
 
     # edit
     if "edit_item_id" not in st.session_state:
@@ -214,10 +292,14 @@ if authentication_status:
     # (needed so the "Sửa" button can jump back to the create view).
     if 'active_tab' not in st.session_state:
         st.session_state['active_tab'] = "Tạo bản thu âm"
+    tabs = ["Tạo bản thu âm", "Lịch sử"]
+    # trang thống kê độ trễ chỉ dành cho các user khai báo trong config.yaml (admins: [...])
+    if username in config.get('admins', []):
+        tabs.append("Thống kê")
     active_tab = st.radio(
         "",
-        ["Tạo bản thu âm", "Lịch sử"],
-        index=0 if st.session_state.get('active_tab') == "Tạo bản thu âm" else 1,
+        tabs,
+        index=tabs.index(st.session_state['active_tab']) if st.session_state['active_tab'] in tabs else 0,
         horizontal=True,
     )
 
@@ -230,97 +312,291 @@ if authentication_status:
                 """
                 1. **Tải mẫu giọng** của bạn (WAV/FLAC/MP3, ~30–60s).
                 2. Nhập **văn bản tiếng Việt** cần đọc.
-                3. Nhấn **Tạo giọng nói** → nhận file WAV và được lưu vào **Lịch sử**.
+                3. Nhấn **Tạo giọng nói** → nhận file âm thanh (Opus/MP3/FLAC/WAV) và được lưu vào **Lịch sử**.
                 """
             )
 
         # nếu đang edit từ lịch sử thì đổ dữ liệu vào form
         default_text = "Xin chào, đây là giọng nói được clone bằng XTTS v2."
         default_lang = "vi"
+        edit_voice_id = None
         
         if st.session_state.edit_item_id:
             item_to_edit = db.get_history_item(st.session_state.edit_item_id)
             if item_to_edit:
                 default_text = item_to_edit.get("text", default_text)
                 default_lang = item_to_edit.get("lang", default_lang)
+                edit_voice_id = item_to_edit.get("voice_id")
                 st.info(f"Đang sửa mục: {item_to_edit['text'][:50]}...")
 
 
         ref = st.file_uploader(
             "Tải mẫu giọng của bạn (WAV/FLAC/MP3)", type=["wav", "flac", "mp3"]
         )
-        text = st.text_area("Nhập văn bản", default_text, height=140)
+        long_form = st.toggle(
+            "Tài liệu dài (.txt/.md)",
+            help="Đọc cả tài liệu: chia theo chương (tiêu đề #) và đoạn, tổng hợp song song bằng nhiều process CPU. "
+                 "Bị gián đoạn thì tạo lại với cùng tài liệu sẽ chạy tiếp từ đoạn đã xong.",
+        )
+        if long_form:
+            doc = st.file_uploader("Tải tài liệu (.txt/.md, UTF-8)", type=list(documents.DOCUMENT_EXTS))
+            text = documents.decode_upload(doc.getvalue()) if doc else ""
+            if text:
+                doc_chunks, doc_chapters = documents.plan_chunks(text)
+                st.caption(f"{len(doc_chapters)} chương • {len(doc_chunks)} đoạn • {len(text):,} ký tự")
+        else:
+            text = st.text_area("Nhập văn bản", default_text, height=140)
 
         col1, col2 = st.columns(2)
         with col1:
             lang = st.selectbox(
                 "Ngôn ngữ",
-                ["vi", "en", "ja", "ko", "fr", "de", "es"],
-                index=["vi", "en", "ja", "ko", "fr", "de", "es"].index(default_lang)
-                if default_lang in ["vi", "en", "ja", "ko", "fr", "de", "es"]
-                else 0,
+                LANGUAGES,
+                index=LANGUAGES.index(default_lang) if default_lang in LANGUAGES else 0,
             )
         with col2:
             device_opt = st.selectbox("Thiết bị", ["auto", "cuda", "cpu"], index=0)
+        output_format = st.selectbox(
+            "Định dạng lưu",
+            list(audio_formats.FORMATS),
+            index=list(audio_formats.FORMATS).index(audio_formats.DEFAULT_FORMAT),
+            format_func=audio_formats.FORMAT_LABELS.get,
+        )
+        fast_cpu_mode = st.checkbox(
+            "CPU nhanh (int8)",
+            help="Lượng tử hoá int8 phần GPT của XTTS để chạy nhanh hơn trên CPU; chất lượng có thể giảm nhẹ. Luôn chạy trên CPU.",
+        )
+        precision = "int8" if fast_cpu_mode else "fp32"
+        if fast_cpu_mode:
+            device_opt = "cpu"
+        with st.expander("Hậu kỳ âm thanh", expanded=False):
+            post_enabled = st.checkbox(
+                "Bật hậu kỳ",
+                value=True,
+                help="Xử lý ngay trên waveform trước khi lưu. Không áp dụng cho streaming và tài liệu dài.",
+            )
+            pp1, pp2 = st.columns(2)
+            with pp1:
+                post_trim = st.checkbox("Cắt khoảng lặng đầu/cuối mỗi câu", value=POSTPROCESS_DEFAULTS["trim"])
+                post_gap = st.slider("Nghỉ giữa các câu (ms)", 0, 1500, POSTPROCESS_DEFAULTS["gap_ms"] or 0, step=50)
+            with pp2:
+                post_crossfade = st.slider("Fade ở mối nối (ms)", 0, 50, POSTPROCESS_DEFAULTS["crossfade_ms"])
+                loudness_options = [None, -14.0, -16.0, -19.0, -23.0]
+                post_loudness = st.selectbox(
+                    "Độ to (LUFS)",
+                    loudness_options,
+                    index=loudness_options.index(POSTPROCESS_DEFAULTS["loudness_lufs"]),
+                    format_func=lambda v: "Giữ nguyên" if v is None else f"{v:g} LUFS",
+                )
+        post = {
+            "trim": post_trim,
+            "gap_ms": post_gap,
+            "crossfade_ms": post_crossfade,
+            "loudness_lufs": post_loudness,
+        } if post_enabled else None
+
+        stream_mode = st.checkbox(
+            "Nghe ngay khi đang tạo (streaming)",
+            help="Phát từng đoạn ngay khi tổng hợp xong thay vì chờ cả bài. Chạy trực tiếp trong phiên này, không qua hàng đợi.",
+            disabled=long_form,
+        ) and not long_form
+
+        # khi sửa mà không tải mẫu mới thì dùng lại mẫu giọng của mục đang sửa
+        if edit_voice_id and not ref:
+            st.caption("Không tải mẫu mới: sẽ dùng lại mẫu giọng của mục đang sửa.")
 
         btn = st.button("Tạo giọng nói", type="primary")
 
         if btn:
-            if not ref:
+            if not ref and not edit_voice_id:
                 st.warning("Vui lòng tải lên một mẫu giọng (30–60s, càng sạch càng tốt).")
             elif not text.strip():
-                st.warning("Vui lòng nhập văn bản.")
+                st.warning("Vui lòng tải tài liệu có nội dung." if long_form else "Vui lòng nhập văn bản.")
             else:
-                device = pick_device(device_opt)
-                st.info(f"⏳ Đang tải model (nếu cần) và tổng hợp trên **{device.upper()}**...")
-
-                # lưu file mẫu giọng vào outputs/voices/ để lịch sử còn dùng lại
-                voices_dir = OUTPUT_DIR / "voices"
-                voices_dir.mkdir(parents=True, exist_ok=True)
-                voice_ext = ref.name.split(".")[-1].lower()
-                voice_path = voices_dir / f"voice_{uuid.uuid4().hex}.{voice_ext}"
-                with open(voice_path, "wb") as vf:
-                    vf.write(ref.getbuffer())
-
-                # synth
-                tts = load_model()
-                out_path = OUTPUT_DIR / f"xtts_output_{uuid.uuid4().hex}.wav"
-
-                tts.tts_to_file(
-                    text=text,
-                    speaker_wav=str(voice_path),
-                    language=lang,
-                    file_path=str(out_path),
-                    split_sentences=True,
-                )
-
-                # lưu vào lịch sử 
-                # Dùng username từ st.session_state
-                db.add_history_item(
-                    username=username, 
-                    text=text,
-                    lang=lang,
-                    voice_path=str(voice_path),
-                    output_path=str(out_path),
-                )
-                # hiển thị
-                audio_bytes = open(out_path, "rb").read()
-                st.success(f"Đã lưu: {out_path.name} và ghi vào lịch sử.")
-                st.audio(audio_bytes, format="audio/wav")
-                st.download_button(
-                    "Tải file WAV", data=audio_bytes, file_name=out_path.name
-                )
+                # lưu mẫu giọng vào kho theo nội dung (trùng file thì dùng lại) để lịch sử còn dùng lại
+                if ref:
+                    voice_ext = ref.name.split(".")[-1].lower()
+                    with metrics.observe("upload_write", lang):
+                        voice_id = voice_store.save_voice(ref.getbuffer(), voice_ext)
+                else:
+                    voice_id = edit_voice_id
+                voice_path = voice_store.voice_path(voice_id) if voice_id else None
+                if not voice_path:
+                    st.error("Không thể lưu mẫu giọng. Vui lòng thử lại.")
+                    st.stop()
+
+                # cùng văn bản + ngôn ngữ + giọng + model -> trả lại file đã có, không tổng hợp lại
+                if long_form:
+                    cache_key = documents.document_key(text, lang, voice_id, precision)
+                else:
+                    cache_key = synthesis.result_cache_key(text, lang, voice_id, precision,
+                                                           None if stream_mode else post)
+                cached_path = db.get_cached_result(cache_key)
+                if cached_path:
+                    # lưu vào lịch sử 
+                    # Dùng username từ st.session_state
+                    db.add_history_item(
+                        username=username, 
+                        text=text,
+                        lang=lang,
+                        voice_id=voice_id,
+                        output_path=cached_path,
+                        chapters=(segments.read_manifest(cached_path) or {}).get("chapters"),
+                    )
+                    st.session_state['last_output_path'] = cached_path
+                    st.success(f"Đã có sẵn bản thu giống hệt: {Path(cached_path).name}. Đã ghi vào lịch sử.")
+                elif stream_mode:
+                    timer = metrics.RequestTimer(lang, synthesis.resolve_device(device_opt))
+                    with timer.activate():
+                        tts = load_model(device_opt, precision)
+                        out_path = OUTPUT_DIR / f"xtts_output_{uuid.uuid4().hex}.wav"
+                        sr = tts.synthesizer.output_sample_rate
+                        pending = []
+                        total_samples = 0
+                        with st.spinner("🔊 Đang tổng hợp và phát trực tiếp..."):
+                            # file WAV được ghi dần trong lúc các đoạn được phát
+                            for chunk in synthesis.stream_to_file(tts, text, str(voice_path), lang, str(out_path)):
+                                pending.append(chunk)
+                                total_samples += len(chunk)
+                                if sum(len(c) for c in pending) >= sr * STREAM_PLAYBACK_SECONDS:
+                                    play_audio_chunk(synthesis.wav_bytes(np.concatenate(pending), sr))
+                                    pending = []
+                            if pending:
+                                play_audio_chunk(synthesis.wav_bytes(np.concatenate(pending), sr))
+                        with metrics.span("wav_write"):
+                            out_path = audio_formats.finalize_output(out_path, output_format)
+                    db.put_cached_result(cache_key, str(out_path))
+                    timer.finish(total_samples / sr)
+                    with metrics.observe("db_insert", lang):
+                        db.add_history_item(
+                            username=username,
+                            text=text,
+                            lang=lang,
+                            voice_id=voice_id,
+                            output_path=str(out_path),
+                            metrics=timer.to_dict(),
+                        )
+                    st.session_state['last_output_path'] = str(out_path)
+                    st.success(f"Đã lưu: {out_path.name} và ghi vào lịch sử.")
+                else:
+                    # tổng hợp chạy nền trong worker (jobs.py); tab này chỉ theo dõi trạng thái
+                    job_id = db.enqueue_job(username, text, lang, voice_id, output_format, device_opt, precision,
+                                            mode="document" if long_form else "text",
+                                            post=None if long_form else post)
+                    if not job_id:
+                        st.error("Không thể tạo job tổng hợp. Vui lòng thử lại.")
+                        st.stop()
+                    st.session_state['current_job_id'] = job_id
+                    st.session_state['last_output_path'] = None
                 # sau khi tạo xong thì bỏ trạng thái edit
                 st.session_state.edit_item_id = None
 
+        if st.session_state.get('current_job_id'):
+            show_job_status(st.session_state['current_job_id'])
+
+        # hiển thị
+        if st.session_state.get('last_output_path'):
+            out_path = Path(st.session_state['last_output_path'])
+            if out_path.exists():
+                with metrics.observe("playback_read"):
+                    audio_bytes = out_path.read_bytes()
+                chapters = (segments.read_manifest(out_path) or {}).get("chapters")
+                play_with_chapters(out_path, audio_bytes, chapters, key="last_output")
+                download_in_format(out_path, audio_bytes, key="last_output")
+
     # tab 2: lich su
     if active_tab == "Lịch sử":
         st.subheader(f"Lịch sử của {name}")
-        # Tải lịch sử cho user hiện tại 
-        items = db.load_history(username) 
+        # job đang chờ / đang chạy của user
+        for job in db.list_active_jobs(username):
+            label = "Đang chờ" if job['status'] == "queued" else f"Đang tổng hợp {int((job['progress'] or 0) * 100)}%"
+            st.markdown(
+                f"<div class='small'>⏳ {label} • Lang: {job['lang']} • {job['text'][:80]}</div>",
+                unsafe_allow_html=True,
+            )
+        # tìm kiếm phía database (FULLTEXT / FTS5), lọc theo ngôn ngữ và ngày
+        s1, s2, s3, s4 = st.columns([3, 1, 1, 1])
+        with s1:
+            search_query = st.text_input("Tìm trong lịch sử", placeholder="Nhập từ cần tìm...")
+        with s2:
+            search_lang = st.selectbox("Ngôn ngữ", ["Tất cả"] + LANGUAGES, key="search_lang")
+        with s3:
+            search_from = st.date_input("Từ ngày", value=None, format="DD/MM/YYYY", key="search_from")
+        with s4:
+            search_to = st.date_input("Đến ngày", value=None, format="DD/MM/YYYY", key="search_to")
+        searching = bool(search_query.strip()) or search_lang != "Tất cả" or search_from or search_to
+
+        if searching:
+            # kết quả xếp theo độ liên quan nên phân trang theo offset; đổi bộ lọc thì về trang đầu
+            search_key = (search_query, search_lang, search_from, search_to)
+            if st.session_state.get('search_key') != search_key:
+                st.session_state['search_key'] = search_key
+                st.session_state['search_page'] = 0
+            page = st.session_state['search_page']
+            items, has_next = db.search_history(
+                username,
+                search_query,
+                lang=None if search_lang == "Tất cả" else search_lang,
+                start=datetime.datetime.combine(search_from, datetime.time()) if search_from else None,
+                end=datetime.datetime.combine(search_to + datetime.timedelta(days=1), datetime.time()) if search_to else None,
+                page_size=HISTORY_PAGE_SIZE,
+                offset=page * HISTORY_PAGE_SIZE,
+            )
+            page_number = page + 1
+        else:
+            # Tải lịch sử cho user hiện tại theo từng trang (keyset); history_cursors là
+            # chồng các mốc (created_at, id) của những trang đã đi qua
+            if 'history_cursors' not in st.session_state:
+                st.session_state['history_cursors'] = [None]
+            cursors = st.session_state['history_cursors']
+            items, next_before = db.load_history_page(username, HISTORY_PAGE_SIZE, before=cursors[-1])
+            has_next = next_before is not None
+            page_number = len(cursors)
+
+        # xuất ZIP: tất cả (lọc theo ngày) hoặc các mục đã tick "Chọn" ở các trang
+        if 'export_selected' not in st.session_state:
+            st.session_state['export_selected'] = set()
+        selected = st.session_state['export_selected']
+
+        def toggle_selected(item_id: str):
+            selected.symmetric_difference_update({item_id})
+
+        with st.expander("Xuất ZIP", expanded=False):
+            scope = st.radio("Phạm vi", ["Tất cả", f"Các mục đã chọn ({len(selected)})"], horizontal=True)
+            d1, d2, d3 = st.columns(3)
+            with d1:
+                date_from = st.date_input("Từ ngày", value=None, format="DD/MM/YYYY")
+            with d2:
+                date_to = st.date_input("Đến ngày", value=None, format="DD/MM/YYYY")
+            with d3:
+                manifest_format = st.selectbox("Manifest", export.MANIFEST_FORMATS)
+            # ZIP do api.py đóng gói và gửi dần theo chunk thẳng tới trình duyệt: app không đọc file
+            # audio nào, kể cả khi xuất hàng nghìn mục (link ký sẵn, hết hạn sau EXPORT_LINK_TTL)
+            params = {"format": manifest_format, "token": export.link_token(username, config['cookies']['key'])}
+            if date_from:
+                params["from"] = date_from.isoformat()
+            if date_to:
+                params["to"] = date_to.isoformat()
+            link = None
+            if scope == "Tất cả":
+                link = f"{API_PUBLIC_URL}/v1/history/export?{urlencode(params)}"
+            elif not selected:
+                st.warning("Không có mục nào để xuất.")
+            elif len(selected) > EXPORT_LINK_MAX_IDS:
+                st.warning(f"Chỉ xuất được tối đa {EXPORT_LINK_MAX_IDS} mục đã chọn mỗi lần; "
+                           "hãy bỏ chọn bớt hoặc xuất theo khoảng ngày.")
+            else:
+                params["ids"] = ",".join(sorted(selected))
+                link = f"{API_PUBLIC_URL}/v1/history/export?{urlencode(params)}"
+            if link:
+                st.link_button("Tải file ZIP", link)
+            st.caption(f"Cần HTTP API (`python api.py`) chạy tại {API_PUBLIC_URL}.")
         
-        if not items:
-            st.info("Chưa có bản thu âm nào. Hãy sang tab **Tạo bản thu âm** để tạo.")
+        if not items and page_number == 1:
+            if searching:
+                st.info("Không tìm thấy mục nào phù hợp.")
+            else:
+                st.info("Chưa có bản thu âm nào. Hãy sang tab **Tạo bản thu âm** để tạo.")
         else:
             # hiển thị từng bản
             for item in items:
@@ -328,8 +604,10 @@ if authentication_status:
                     st.markdown('<div class="history-row">', unsafe_allow_html=True)
                     c1, c2, c3, c4 = st.columns([4, 2, 1, 1])
                     with c1:
+                        st.checkbox("Chọn", value=item['id'] in selected, key=f"sel_{item['id']}",
+                                    on_change=toggle_selected, args=(item['id'],))
                         st.markdown(
-                            f"<div class='history-title'>{item['text'][:80]}{'...' if len(item['text'])>80 else ''}</div>",
+                            f"<div class='history-title'>{item['text'][:80]}{'...' if item['text_len']>80 else ''}</div>",
                             unsafe_allow_html=True,
                         )
                         st.markdown(
@@ -337,14 +615,17 @@ if authentication_status:
                             unsafe_allow_html=True,
                         )
 
-                    # nghe lại
+                    # nghe lại / tải: chỉ đọc file khi người dùng mở mục này
                     with c2:
                         out_path = Path(item["output_path"])
-                        if out_path.exists():
-                            audio_bytes = out_path.read_bytes()
-                            st.audio(audio_bytes, format="audio/wav")
-                        else:
+                        if not out_path.exists():
                             st.warning("File âm thanh đã bị xoá.")
+                        elif st.toggle("Nghe / Tải", key=f"open_{item['id']}"):
+                            with metrics.observe("playback_read", item['lang']):
+                                audio_bytes = out_path.read_bytes()
+                            chapters = json.loads(item['chapters']) if item.get('chapters') else None
+                            play_with_chapters(out_path, audio_bytes, chapters, key=f"play_{item['id']}")
+                            download_in_format(out_path, audio_bytes, key=f"dl_{item['id']}")
 
                     # nút sửa (nạp lên tab 1)
                     with c3:
@@ -359,20 +640,51 @@ if authentication_status:
                     with c4:
                         if st.button("Xoá", key=f"del_{item['id']}"):
                             # Xoá khỏi DB và xoá file vật lý (ĐÃ THAY ĐỔI)
-                            deleted = db.delete_history_item(username, item['id'])
+                            deleted = history_store.delete_item(username, item['id'])
+                            selected.discard(item['id'])
                             if deleted:
                                 st.success("Đã xoá mục lịch sử.")
                             else:
                                 st.error("Không thể xoá mục. Vui lòng thử lại.")
                             do_rerun()
 
-                    # nút download riêng
-                    if Path(item["output_path"]).exists():
-                        st.download_button(
-                            "Tải",
-                            data=Path(item["output_path"]).read_bytes(),
-                            file_name=Path(item["output_path"]).name,
-                            key=f"dl_{item['id']}",
-                        )
-
                     st.markdown("</div>", unsafe_allow_html=True)
+
+            # phân trang
+            p1, p2, p3 = st.columns([1, 2, 1])
+            with p1:
+                if page_number > 1 and st.button("← Trang trước"):
+                    if searching:
+                        st.session_state['search_page'] -= 1
+                    else:
+                        cursors.pop()
+                    do_rerun()
+            with p2:
+                st.markdown(f"<div class='small'>Trang {page_number}</div>", unsafe_allow_html=True)
+            with p3:
+                if has_next and st.button("Trang sau →"):
+                    if searching:
+                        st.session_state['search_page'] += 1
+                    else:
+                        cursors.append(next_before)
+                    do_rerun()
+
+    # tab 3: thong ke do tre (admin)
+    if active_tab == "Thống kê":
+        st.subheader("Độ trễ theo giai đoạn")
+        st.caption(
+            "p50/p95/p99 (giây) từ các mục lịch sử gần nhất; upload, ghi DB và đọc file để phát "
+            "chỉ tính trong process web hiện tại. rtf = thời gian tổng hợp / độ dài audio."
+        )
+        samples = metrics.collect(db.load_recent_metrics())
+        rows = metrics.summarize(samples)
+        if not rows:
+            st.info("Chưa có số liệu.")
+        else:
+            st.dataframe(rows, use_container_width=True, hide_index=True)
+        st.download_button(
+            "Xuất Prometheus",
+            data=metrics.prometheus_text(samples),
+            file_name="tts_metrics.prom",
+            mime="text/plain",
+        )
@@ -0,0 +1,92 @@
+import uuid
+from pathlib import Path
+
+# định dạng -> (đuôi file, MIME, tham số ffmpeg)
+FORMATS = {
+    "ogg": (".ogg", "audio/ogg", {"acodec": "libopus", "audio_bitrate": "32k"}),
+    "mp3": (".mp3", "audio/mpeg", {"acodec": "libmp3lame", "audio_bitrate": "64k"}),
+    "flac": (".flac", "audio/flac", {"acodec": "flac"}),
+    "wav": (".wav", "audio/wav", {"acodec": "pcm_s16le"}),
+}
+FORMAT_LABELS = {
+    "ogg": "Opus (OGG)",
+    "mp3": "MP3",
+    "flac": "FLAC",
+    "wav": "WAV",
+}
+DEFAULT_FORMAT = "ogg"
+
+
+def format_of(path) -> str:
+    """Định dạng của file theo đuôi (mặc định wav)."""
+    suffix = Path(path).suffix.lower()
+    for fmt, (ext, _, _) in FORMATS.items():
+        if ext == suffix:
+            return fmt
+    return "wav"
+
+
+def mime_type(path) -> str:
+    return FORMATS[format_of(path)][1]
+
+
+def transcode(src, dst, fmt: str) -> bool:
+    """Chuyển src sang định dạng fmt bằng ffmpeg (ghi file tạm rồi rename)."""
+    import ffmpeg
+
+    dst = Path(dst)
+    tmp = dst.with_name(f".{dst.stem}.{uuid.uuid4().hex}{dst.suffix}")
+    try:
+        (
+            ffmpeg.input(str(src))
+            .output(str(tmp), **FORMATS[fmt][2])
+            .overwrite_output()
+            .run(quiet=True)
+        )
+        tmp.replace(dst)
+        return True
+    except (ffmpeg.Error, OSError) as err:
+        stderr = getattr(err, "stderr", b"") or b""
+        print(f"Lỗi ffmpeg khi chuyển {Path(src).name} sang {fmt}: {stderr.decode(errors='ignore')[-300:] or err}")
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+        return False
+
+
+def finalize_output(wav_path, fmt: str):
+    """Chuyển file WAV vừa tổng hợp sang định dạng lưu trữ fmt và xoá bản WAV.
+
+    Nếu ffmpeg lỗi thì giữ nguyên WAV. Trả về đường dẫn bản lưu chính thức.
+    """
+    wav_path = Path(wav_path)
+    if fmt not in FORMATS or fmt == "wav":
+        return wav_path
+    dst = wav_path.with_suffix(FORMATS[fmt][0])
+    if not transcode(wav_path, dst, fmt):
+        return wav_path
+    wav_path.unlink()
+    return dst
+
+
+def variant_path(path, fmt: str) -> Path:
+    """Đường dẫn bản chuyển đổi (cache) của file sang định dạng fmt: cùng tên, khác đuôi."""
+    return Path(path).with_suffix(FORMATS[fmt][0])
+
+
+def get_variant(path, fmt: str):
+    """Trả về file ở định dạng fmt, chuyển đổi và lưu cache ở lần tải đầu tiên; None nếu lỗi."""
+    path = Path(path)
+    if format_of(path) == fmt:
+        return path
+    dst = variant_path(path, fmt)
+    if dst.exists() or transcode(path, dst, fmt):
+        return dst
+    return None
+
+
+def all_variants(path) -> list:
+    """Tất cả các bản chuyển đổi đang có của file (không gồm chính nó)."""
+    path = Path(path)
+    return [p for p in (variant_path(path, fmt) for fmt in FORMATS) if p != path and p.exists()]
@@ -0,0 +1,235 @@
+"""Tổng hợp hàng loạt từ file JSONL, không cần giao diện Streamlit.
+
+Mỗi dòng là một JSON: {"username": ..., "text": ..., "lang": ..., "voice": "<đường dẫn file mẫu giọng>"}.
+
+    python batch.py input.jsonl --summary summary.json
+
+Các dòng đã xong được ghi vào file checkpoint (mặc định <input>.checkpoint),
+chạy lại cùng lệnh sẽ bỏ qua chúng.
+"""
+import argparse
+import json
+import statistics
+import time
+import uuid
+from itertools import groupby
+from pathlib import Path
+
+import audio_formats
+import database as db
+import synthesis
+import voice_store
+from settings import OUTPUT_DIR
+
+
+def read_records(path: Path, done: set):
+    """Đọc lần lượt (số dòng, record) từ file JSONL, bỏ các dòng trống, lỗi hoặc đã xong."""
+    with open(path, encoding="utf-8") as f:
+        for lineno, line in enumerate(f, start=1):
+            if lineno in done or not line.strip():
+                continue
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError as err:
+                print(f"Dòng {lineno}: JSON không hợp lệ ({err}), bỏ qua.")
+                continue
+            missing = [k for k in ("username", "text", "lang", "voice") if not rec.get(k)]
+            if missing:
+                print(f"Dòng {lineno}: thiếu {', '.join(missing)}, bỏ qua.")
+                continue
+            yield lineno, rec
+
+
+def windows(iterable, size: int):
+    """Chia luồng record thành các cửa sổ tối đa size phần tử (không đọc cả file vào RAM)."""
+    window = []
+    for item in iterable:
+        window.append(item)
+        if len(window) >= size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+def load_checkpoint(path: Path) -> set:
+    if not path.exists():
+        return set()
+    with open(path, encoding="utf-8") as f:
+        return {int(line) for line in f if line.strip()}
+
+
+def append_checkpoint(path: Path, linenos) -> None:
+    with open(path, "a", encoding="utf-8") as f:
+        f.writelines(f"{n}\n" for n in linenos)
+
+
+class Batch:
+    """Gom các mục đã tổng hợp rồi ghi lịch sử + checkpoint theo từng lô (một transaction)."""
+
+    def __init__(self, checkpoint: Path, commit_every: int):
+        self.checkpoint = checkpoint
+        self.commit_every = commit_every
+        self.pending = []  # (lineno, history item)
+
+    def add(self, lineno: int, item: dict) -> None:
+        self.pending.append((lineno, item))
+        if len(self.pending) >= self.commit_every:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        ids = db.add_history_items([item for _, item in self.pending])
+        if not ids:
+            raise RuntimeError("Không ghi được lịch sử vào database, dừng để có thể chạy lại.")
+        append_checkpoint(self.checkpoint, [lineno for lineno, _ in self.pending])
+        self.pending = []
+
+
+def register_voice(path: str):
+    """Đưa file mẫu giọng vào kho (theo nội dung) và giữ một tham chiếu tới nó.
+
+    Trả về (voice_id, đường dẫn trong kho). Một nhóm có thể chạy lâu hơn VOICE_GRACE_SECONDS
+    trước khi mục lịch sử đầu tiên được ghi: tham chiếu giữ mẫu giọng khỏi bị voice_store.prune()
+    (worker của app) xoá giữa chừng; bỏ bằng db.release_voice() sau khi nhóm đã ghi lịch sử.
+    """
+    src = Path(path)
+    voice_id = voice_store.save_voice(src.read_bytes(), src.suffix)
+    if not voice_id or not db.acquire_voice(voice_id):
+        raise RuntimeError(f"Không thể lưu mẫu giọng {path}")
+    stored = voice_store.voice_path(voice_id)
+    if not stored:
+        db.release_voice(voice_id)
+        raise RuntimeError(f"Không thể lưu mẫu giọng {path}")
+    return voice_id, stored
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def summarize(stats: list) -> dict:
+    synthesized = [s for s in stats if not s["cached"]]
+    latencies = [s["latency"] for s in synthesized]
+    total_audio = sum(s["audio_seconds"] for s in synthesized)
+    total_time = sum(latencies)
+    return {
+        "items": len(stats),
+        "cached": len(stats) - len(synthesized),
+        "synthesized": len(synthesized),
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_mean": statistics.fmean(latencies) if latencies else 0.0,
+        "audio_seconds": total_audio,
+        "rtf": total_time / total_audio if total_audio else 0.0,
+        "per_item": stats,
+    }
+
+
+def run(input_path: Path, checkpoint: Path, window_size: int, commit_every: int,
+        output_format: str = audio_formats.DEFAULT_FORMAT) -> list:
+    done = load_checkpoint(checkpoint)
+    if done:
+        print(f"Bỏ qua {len(done)} dòng đã xong theo checkpoint {checkpoint}.")
+
+    tts = synthesis.get_tts()
+    sr = tts.synthesizer.output_sample_rate
+    batch = Batch(checkpoint, commit_every)
+    stats = []
+
+    for window in windows(read_records(input_path, done), window_size):
+        # gom theo giọng để latent chỉ tính một lần cho mỗi giọng trong cửa sổ
+        window.sort(key=lambda r: r[1]["voice"])
+        for voice, group in groupby(window, key=lambda r: r[1]["voice"]):
+            group = list(group)
+            try:
+                voice_id, voice_path = register_voice(voice)
+            except Exception as err:
+                print(f"Giọng {voice}: {err}; bỏ qua {len(group)} mục.")
+                continue
+            try:
+                _run_group(tts, sr, batch, stats, voice_id, voice_path, group, output_format)
+                # ghi lịch sử của nhóm (mục lịch sử giữ tham chiếu riêng) trước khi bỏ tham chiếu của nhóm
+                batch.flush()
+            finally:
+                db.release_voice(voice_id)
+    return stats
+
+
+def _run_group(tts, sr: int, batch: Batch, stats: list, voice_id: str, voice_path, group: list,
+               output_format: str) -> None:
+    """Tổng hợp các record cùng một mẫu giọng, thêm vào batch và stats."""
+    latents = None
+    for lineno, rec in group:
+        started = time.perf_counter()
+        cache_key = synthesis.result_cache_key(rec["text"], rec["lang"], voice_id)
+        out_path = db.get_cached_result(cache_key)
+        cached = out_path is not None
+        audio_seconds = 0.0
+        if not cached:
+            if latents is None:
+                latents = synthesis.get_conditioning_latents(tts, voice_path)
+            out_path = OUTPUT_DIR / f"xtts_output_{uuid.uuid4().hex}.wav"
+            try:
+                wav = synthesis.synthesize_to_file(tts, rec["text"], str(voice_path), rec["lang"],
+                                                   str(out_path), latents=latents)
+            except Exception as err:
+                print(f"Dòng {lineno}: lỗi tổng hợp ({err}), bỏ qua.")
+                continue
+            audio_seconds = len(wav) / sr
+            out_path = audio_formats.finalize_output(out_path, output_format)
+            db.put_cached_result(cache_key, str(out_path))
+        latency = time.perf_counter() - started
+
+        stats.append({
+            "line": lineno,
+            "lang": rec["lang"],
+            "cached": cached,
+            "latency": latency,
+            "audio_seconds": audio_seconds,
+            "rtf": latency / audio_seconds if audio_seconds else 0.0,
+        })
+        batch.add(lineno, {
+            "username": rec["username"],
+            "text": rec["text"],
+            "lang": rec["lang"],
+            "voice_id": voice_id,
+            "output_path": str(out_path),
+        })
+        print(f"Dòng {lineno}: {latency:.2f}s" + (f", RTF {latency / audio_seconds:.2f}" if audio_seconds else " (cache)"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tổng hợp XTTS hàng loạt từ file JSONL.")
+    parser.add_argument("input", type=Path, help="file JSONL (username, text, lang, voice)")
+    parser.add_argument("--checkpoint", type=Path, help="file checkpoint (mặc định <input>.checkpoint)")
+    parser.add_argument("--window", type=int, default=1000, help="số dòng đọc mỗi lần để gom theo giọng")
+    parser.add_argument("--commit-every", type=int, default=50, help="số mục mỗi transaction ghi lịch sử")
+    parser.add_argument("--format", choices=list(audio_formats.FORMATS), default=audio_formats.DEFAULT_FORMAT,
+                        help="định dạng lưu file kết quả")
+    parser.add_argument("--summary", type=Path, help="ghi thống kê (JSON) ra file này")
+    args = parser.parse_args()
+
+    checkpoint = args.checkpoint or args.input.with_name(args.input.name + ".checkpoint")
+    db.init_db()
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+
+    stats = run(args.input, checkpoint, args.window, args.commit_every, args.format)
+    summary = summarize(stats)
+    print(
+        f"Xong {summary['items']} mục ({summary['cached']} từ cache). "
+        f"Độ trễ p50 {summary['latency_p50']:.2f}s, p95 {summary['latency_p95']:.2f}s, "
+        f"RTF tổng {summary['rtf']:.2f}"
+    )
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""Gom các câu cần tổng hợp từ mọi phiên/luồng dùng chung một model thành batch.
+
+Mỗi model (synthesis.get_tts) có một BatchScheduler với một luồng riêng: câu được gửi
+vào hàng đợi (submit), luồng này chờ thêm tối đa BATCH_WINDOW_SECONDS để gom tới
+BATCH_MAX_SIZE câu có cùng tham số sinh, rồi chạy một lượt GPT (left-padding + attention
+mask) và một lượt HiFi-GAN cho cả batch, trả waveform riêng cho từng câu qua Future.
+Kèm theo là các mốc thời gian (perf_counter) của câu: lúc gửi, lúc luồng này bắt đầu chạy nó,
+lúc bắt đầu HiFi-GAN và lúc xong, để bên chờ tách thời gian xếp hàng khỏi GPT và vocoder.
+
+Mọi lời gọi vào model đều đi qua scheduler (hoặc giữ scheduler.lock như streaming),
+nên các phiên Streamlit không còn gọi model cùng lúc mà không phối hợp.
+"""
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+
+import numpy as np
+
+import metrics
+from settings import BATCH_MAX_SIZE, BATCH_WINDOW_SECONDS
+
+
+class _Request:
+    __slots__ = ("text", "language", "gpt_cond_latent", "speaker_embedding", "settings", "future", "submitted")
+
+    def __init__(self, text, language, gpt_cond_latent, speaker_embedding, settings):
+        self.text = text
+        self.language = language
+        self.gpt_cond_latent = gpt_cond_latent
+        self.speaker_embedding = speaker_embedding
+        self.settings = settings
+        self.future = Future()
+        self.submitted = time.perf_counter()
+
+
+class BatchScheduler:
+    """Hàng đợi câu cho một model XTTS.
+
+    Kết quả mỗi câu là (waveform float32, (lúc gửi, lúc bắt đầu chạy, lúc bắt đầu vocoder, lúc xong)).
+    """
+
+    def __init__(self, tts, max_batch: int = BATCH_MAX_SIZE, window: float = BATCH_WINDOW_SECONDS):
+        self.tts = tts
+        self.max_batch = max_batch
+        self.window = window
+        # giữ khi model đang chạy; streaming (inference_stream) cũng lấy khoá này
+        self.lock = threading.RLock()
+        # chỉ XTTS thật (có GPT) chạy được theo batch; model giả của benchmark chạy từng câu
+        self.batched = max_batch > 1 and hasattr(tts.synthesizer.tts_model, "gpt")
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="xtts-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str, language: str, latents, settings: dict) -> Future:
+        gpt_cond_latent, speaker_embedding = latents
+        request = _Request(text, language, gpt_cond_latent, speaker_embedding, settings)
+        self._queue.put(request)
+        return request.future
+
+    def _collect(self) -> list:
+        """Chờ câu đầu tiên rồi gom thêm trong cửa sổ thời gian (hoặc tới khi đủ max_batch)."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            pending = self._collect()
+            # chỉ gộp các câu có cùng tham số sinh (temperature, top_k...)
+            groups = {}
+            for request in pending:
+                groups.setdefault(tuple(sorted(request.settings.items())), []).append(request)
+            for group in groups.values():
+                with self.lock:
+                    self._run(group)
+
+    def _run(self, group: list) -> None:
+        xtts = self.tts.synthesizer.tts_model
+        if len(group) > 1 and self.batched:
+            try:
+                started = time.perf_counter()
+                wavs, vocoder_started = _infer_batch(xtts, group)
+                finished = time.perf_counter()
+                # mỗi câu chờ trọn lượt chạy của cả batch
+                for request, wav in zip(group, wavs):
+                    request.future.set_result((wav, (request.submitted, started, vocoder_started, finished)))
+                return
+            except ValueError:
+                # có câu quá dài: chạy lại từng câu để lỗi chỉ rơi vào câu đó
+                pass
+            except Exception:
+                traceback.print_exc()
+                print("Model không chạy được theo batch, chuyển sang tổng hợp từng câu.")
+                self.batched = False
+        for request in group:
+            try:
+                request.future.set_result(_infer_one(xtts, request))
+            except Exception as err:
+                request.future.set_exception(err)
+
+
+def _infer_one(xtts, request: _Request):
+    """Một câu qua xtts.inference như trước; thời gian vocoder lấy từ hook của metrics."""
+    timer = metrics.RequestTimer()
+    started = time.perf_counter()
+    with timer.activate():
+        outputs = xtts.inference(request.text, request.language, request.gpt_cond_latent,
+                                 request.speaker_embedding, **request.settings)
+    finished = time.perf_counter()
+    # HiFi-GAN chạy sau cùng trong xtts.inference
+    vocoder_started = finished - timer.stages.get("vocoder", 0.0)
+    wav = np.asarray(outputs["wav"], dtype=np.float32).squeeze()
+    return wav, (request.submitted, started, vocoder_started, finished)
+
+
+def _infer_batch(xtts, group: list) -> tuple:
+    """Như xtts.inference() cho nhiều câu cùng lúc. Trả về (waveform từng câu, lúc bắt đầu HiFi-GAN).
+
+    GPT: prefix (latent giọng + token văn bản) của từng câu được căn phải và đệm 0 bên trái,
+    attention_mask che phần đệm (GPT của XTTS không dùng position embedding của GPT-2 nên
+    đệm không làm lệch vị trí). HiFi-GAN: latent được đệm 0 bên phải rồi cắt lại theo độ dài.
+    """
+    import torch
+    import torch.nn.functional as F
+
+    gpt = xtts.gpt
+    device = xtts.device
+    settings = group[0].settings
+
+    generate_kwargs = dict(do_sample=True, num_beams=1, output_attentions=False)
+    generate_kwargs.update(settings)
+    with torch.no_grad():
+        text_tokens, cond_latents, speaker_embeddings, prefixes = [], [], [], []
+        for request in group:
+            language = request.language.split("-")[0]
+            tokens = torch.IntTensor(xtts.tokenizer.encode(request.text.strip().lower(), lang=language))
+            tokens = tokens.unsqueeze(0).to(device)
+            if tokens.shape[-1] >= xtts.args.gpt_max_text_tokens:
+                raise ValueError("XTTS chỉ tổng hợp được câu tối đa 400 token.")
+            cond = request.gpt_cond_latent.to(device)
+            padded = F.pad(F.pad(tokens, (0, 1), value=gpt.stop_text_token), (1, 0), value=gpt.start_text_token)
+            prefixes.append(torch.cat([cond, gpt.text_embedding(padded) + gpt.text_pos_embedding(padded)], dim=1))
+            text_tokens.append(tokens)
+            cond_latents.append(cond)
+            speaker_embeddings.append(request.speaker_embedding.to(device))
+
+        prefix_len = max(p.shape[1] for p in prefixes)
+        prefix = torch.cat([F.pad(p, (0, 0, prefix_len - p.shape[1], 0)) for p in prefixes], dim=0)
+        attention_mask = torch.ones((len(group), prefix_len + 1), dtype=torch.long, device=device)
+        for i, p in enumerate(prefixes):
+            attention_mask[i, : prefix_len - p.shape[1]] = 0
+        gpt_inputs = torch.full((len(group), prefix_len + 1), fill_value=1, dtype=torch.long, device=device)
+        gpt_inputs[:, -1] = gpt.start_audio_token
+
+        gpt.gpt_inference.store_prefix_emb(prefix)
+        generated = gpt.gpt_inference.generate(
+            gpt_inputs,
+            attention_mask=attention_mask,
+            bos_token_id=gpt.start_audio_token,
+            pad_token_id=gpt.stop_audio_token,
+            eos_token_id=gpt.stop_audio_token,
+            max_length=gpt.max_gen_mel_tokens + gpt_inputs.shape[-1],
+            num_return_sequences=1,
+            **generate_kwargs,
+        )[:, gpt_inputs.shape[1]:]
+
+        latents = []
+        for i in range(len(group)):
+            codes = generated[i:i + 1]
+            # câu xong sớm được đệm stop token: giữ tới stop token đầu tiên như khi chạy riêng
+            stops = (codes[0] == gpt.stop_audio_token).nonzero()
+            if len(stops):
+                codes = codes[:, : int(stops[0]) + 1]
+            latents.append(gpt(
+                text_tokens[i],
+                torch.tensor([text_tokens[i].shape[-1]], device=device),
+                codes,
+                torch.tensor([codes.shape[-1] * gpt.code_stride_len], device=device),
+                cond_latents=cond_latents[i],
+                return_attentions=False,
+                return_latent=True,
+            ))
+
+        started = time.perf_counter()
+        frames = max(lat.shape[1] for lat in latents)
+        batch = torch.cat([F.pad(lat, (0, 0, 0, frames - lat.shape[1])) for lat in latents], dim=0)
+        wavs = xtts.hifigan_decoder(batch, g=torch.cat(speaker_embeddings, dim=0)).cpu()
+
+    samples_per_frame = wavs.shape[-1] / frames
+    return [
+        wavs[i].reshape(-1)[: round(lat.shape[1] * samples_per_frame)].numpy().astype(np.float32)
+        for i, lat in enumerate(latents)
+    ], started
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def scheduler(tts) -> BatchScheduler:
+    """Scheduler dùng chung của model tts (tạo ở lần gọi đầu tiên)."""
+    with _schedulers_lock:
+        if id(tts) not in _schedulers:
+            _schedulers[id(tts)] = BatchScheduler(tts)
+        return _schedulers[id(tts)]
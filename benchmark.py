@@ -0,0 +1,306 @@
+"""Đo hiệu năng đường tổng hợp và các thao tác database, xuất JSON để so sánh giữa các commit.
+
+    python benchmark.py --voice mau_giong.wav --output bench.json      # model XTTS thật
+    python benchmark.py --stub --db --output bench.json                # không cần trọng số model
+    python benchmark.py --stub --compare bench_truoc.json              # so với lần đo trước
+
+Chế độ --stub thay XTTS bằng model giả trả về khoảng lặng ngay lập tức, nên số đo chỉ còn
+chi phí điều phối (tách câu, ghép waveform, ghi WAV, streaming). --db đo các hàm của
+database.py trên database đang cấu hình trong config.yaml, với user và dữ liệu tạm được xoá
+sau khi đo.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+import metrics
+import synthesis
+from settings import LANGUAGES
+
+SAMPLE_SENTENCES = {
+    "vi": "Hôm nay trời đẹp nên chúng tôi đi dạo quanh hồ và nói chuyện rất lâu.",
+    "en": "The weather was lovely today, so we took a long walk around the lake and talked.",
+    "ja": "今日は天気が良かったので、私たちは湖の周りを散歩して長い間話しました。",
+    "ko": "오늘은 날씨가 좋아서 우리는 호수 주변을 산책하며 오랫동안 이야기를 나눴습니다.",
+    "fr": "Il faisait beau aujourd'hui, alors nous avons fait le tour du lac en discutant longuement.",
+    "de": "Heute war schönes Wetter, also sind wir lange um den See spaziert und haben geredet.",
+    "es": "Hoy hizo buen tiempo, así que dimos un largo paseo alrededor del lago charlando.",
+}
+# độ dài văn bản -> số câu
+TEXT_LENGTHS = {"short": 1, "medium": 4, "long": 12}
+STUB_SAMPLE_RATE = 24000
+STUB_SECONDS_PER_CHAR = 0.06
+
+
+class _StubChunk:
+    """Giả lập tensor chunk của inference_stream (chỉ cần .detach().cpu())."""
+
+    def __init__(self, samples: np.ndarray):
+        self.samples = samples
+
+    def detach(self):
+        return self
+
+    def cpu(self):
+        return self.samples
+
+
+class _StubXtts:
+    def inference(self, text, language, gpt_cond_latent, speaker_embedding, **kwargs):
+        return {"wav": np.zeros(int(len(text) * STUB_SECONDS_PER_CHAR * STUB_SAMPLE_RATE), dtype=np.float32)}
+
+    def inference_stream(self, text, language, gpt_cond_latent, speaker_embedding, stream_chunk_size=20, **kwargs):
+        wav = self.inference(text, language, gpt_cond_latent, speaker_embedding)["wav"]
+        step = STUB_SAMPLE_RATE // 5
+        for start in range(0, len(wav), step):
+            yield _StubChunk(wav[start:start + step])
+
+
+def stub_tts():
+    """Đối tượng có cùng giao diện tts.synthesizer mà synthesis.py dùng, không cần trọng số."""
+    import re
+
+    def split_into_sentences(text):
+        return [s for s in re.split(r"(?<=[.!?。])\s*", text) if s.strip()]
+
+    def save_wav(wav, path):
+        Path(path).write_bytes(synthesis.wav_bytes(wav, STUB_SAMPLE_RATE))
+
+    config = SimpleNamespace(temperature=0.75, length_penalty=1.0, repetition_penalty=10.0, top_k=50, top_p=0.85)
+    synthesizer = SimpleNamespace(
+        tts_model=_StubXtts(),
+        tts_config=config,
+        output_sample_rate=STUB_SAMPLE_RATE,
+        split_into_sentences=split_into_sentences,
+        save_wav=save_wav,
+    )
+    return SimpleNamespace(synthesizer=synthesizer)
+
+
+def peak_rss_mb():
+    """RSS cao nhất của process tới thời điểm gọi (MB), None nếu hệ điều hành không hỗ trợ."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux trả về KB, macOS trả về byte
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def make_text(lang: str, length: str) -> str:
+    return " ".join([SAMPLE_SENTENCES[lang]] * TEXT_LENGTHS[length])
+
+
+def stats(values) -> dict:
+    return {
+        "p50": round(metrics.quantile(values, 0.5), 5),
+        "p95": round(metrics.quantile(values, 0.95), 5),
+        "mean": round(sum(values) / len(values), 5) if values else 0.0,
+    }
+
+
+def bench_synthesis(tts, voice: str, langs, lengths, repeat: int, latents=None) -> list:
+    """Với mỗi (ngôn ngữ, độ dài): RTF end-to-end (synthesize_to_file), thời gian tới chunk đầu (streaming)."""
+    sr = tts.synthesizer.output_sample_rate
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        out_path = Path(tmp) / "bench.wav"
+        # lần chạy đầu tính latent giọng / khởi tạo kernel, không tính vào kết quả
+        synthesis.synthesize_to_file(tts, make_text(langs[0], "short"), voice, langs[0], str(out_path),
+                                     latents=latents)
+        for lang in langs:
+            for length in lengths:
+                text = make_text(lang, length)
+                walls, rtfs, ttfas = [], [], []
+                audio_seconds = 0.0
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    wav = synthesis.synthesize_to_file(tts, text, voice, lang, str(out_path), latents=latents)
+                    wall = time.perf_counter() - started
+                    audio_seconds = len(wav) / sr
+                    walls.append(wall)
+                    rtfs.append(wall / audio_seconds if audio_seconds else 0.0)
+
+                    started = time.perf_counter()
+                    first = None
+                    for _chunk in synthesis.stream_to_file(tts, text, voice, lang, str(out_path), latents=latents):
+                        if first is None:
+                            first = time.perf_counter() - started
+                    ttfas.append(first or 0.0)
+                results.append({
+                    "lang": lang,
+                    "length": length,
+                    "chars": len(text),
+                    "audio_seconds": round(audio_seconds, 3),
+                    "wall": stats(walls),
+                    "rtf": stats(rtfs),
+                    "ttfa": stats(ttfas),
+                    "peak_rss_mb": peak_rss_mb(),
+                })
+                print(f"{lang}/{length}: RTF p50 {results[-1]['rtf']['p50']:.3f}, "
+                      f"TTFA p50 {results[-1]['ttfa']['p50'] * 1000:.1f} ms")
+    return results
+
+
+def bench_database(n: int) -> list:
+    """Đo các hàm của database.py với n mục lịch sử tạm của một user riêng, xoá hết sau khi đo."""
+    import database as db
+    import history_store
+
+    db.init_db()
+    username = f"__bench_{uuid.uuid4().hex[:8]}"
+    timings = {}
+
+    def timed(op, fn, *args, **kwargs):
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        timings.setdefault(op, []).append(time.perf_counter() - started)
+        return result
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        voice_id = f"bench{uuid.uuid4().hex}"
+        voice_file = tmp / f"{voice_id}.wav"
+        voice_file.write_bytes(b"")
+        if not db.add_voice(voice_id, str(voice_file), "wav", 0):
+            raise RuntimeError("Không ghi được vào database (xem lỗi ở trên).")
+
+        ids = []
+        for i in range(n):
+            out_path = tmp / f"out_{i}.wav"
+            out_path.write_bytes(b"")
+            item_id = timed("add_history_item", db.add_history_item, username, make_text("vi", "short"), "vi",
+                            voice_id, str(out_path))
+            ids.append(item_id)
+            timed("put_cached_result", db.put_cached_result, f"bench-{username}-{i}", str(out_path))
+        for i in range(n):
+            timed("get_cached_result", db.get_cached_result, f"bench-{username}-{i}")
+            timed("get_history_item", db.get_history_item, ids[i])
+
+        before = None
+        while True:
+            items, before = timed("load_history_page", db.load_history_page, username, 20, before=before)
+            if not before:
+                break
+        for start in range(0, n, 20):
+            timed("get_history_items", db.get_history_items, ids[start:start + 20])
+        for start in range(0, n, 20):
+            timed("delete_history_items", history_store.delete_items, username, ids[start:start + 20])
+
+    results = []
+    for op, values in timings.items():
+        results.append({"op": op, "calls": len(values), **stats(values)})
+        print(f"{op}: p50 {results[-1]['p50'] * 1000:.2f} ms ({len(values)} lần)")
+    return results
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=Path(__file__).parent, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """Các chỉ số p50 chậm hơn lần đo trước quá threshold (tỉ lệ), kèm in bảng so sánh."""
+    regressions = []
+
+    def check(name, new, old):
+        if not old:
+            return
+        change = (new - old) / old
+        flag = " <-- chậm hơn" if change > threshold else ""
+        print(f"{name}: {old:.5f} -> {new:.5f} ({change:+.1%}){flag}")
+        if flag:
+            regressions.append(name)
+
+    old_synth = {(r["lang"], r["length"]): r for r in baseline.get("synthesis", [])}
+    for r in current.get("synthesis", []):
+        old = old_synth.get((r["lang"], r["length"]))
+        if old:
+            check(f"{r['lang']}/{r['length']} rtf", r["rtf"]["p50"], old["rtf"]["p50"])
+            check(f"{r['lang']}/{r['length']} ttfa", r["ttfa"]["p50"], old["ttfa"]["p50"])
+    old_db = {r["op"]: r for r in baseline.get("database", [])}
+    for r in current.get("database", []):
+        if r["op"] in old_db:
+            check(f"db {r['op']}", r["p50"], old_db[r["op"]]["p50"])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tổng hợp XTTS và database.")
+    parser.add_argument("--stub", action="store_true", help="dùng model giả (không cần trọng số) để đo chi phí điều phối")
+    parser.add_argument("--voice", help="file mẫu giọng (bắt buộc khi không dùng --stub)")
+    parser.add_argument("--device", default="auto", help="auto/cuda/cpu")
+    parser.add_argument("--precision", default="fp32", choices=synthesis.PRECISIONS)
+    parser.add_argument("--langs", default=",".join(LANGUAGES), help="danh sách ngôn ngữ, phân tách bởi dấu phẩy")
+    parser.add_argument("--lengths", default=",".join(TEXT_LENGTHS), help="short,medium,long")
+    parser.add_argument("--repeat", type=int, default=3, help="số lần đo mỗi trường hợp")
+    parser.add_argument("--no-synthesis", action="store_true", help="bỏ qua phần tổng hợp")
+    parser.add_argument("--db", action="store_true", help="đo thêm các thao tác database")
+    parser.add_argument("--db-items", type=int, default=200, help="số mục lịch sử tạm khi đo database")
+    parser.add_argument("--output", type=Path, help="ghi kết quả JSON ra file này")
+    parser.add_argument("--compare", type=Path, help="file JSON của lần đo trước để so sánh")
+    parser.add_argument("--threshold", type=float, default=0.10, help="mức chậm hơn (tỉ lệ) coi là hồi quy")
+    args = parser.parse_args()
+
+    langs = [l for l in args.langs.split(",") if l]
+    lengths = [l for l in args.lengths.split(",") if l]
+    unknown = [l for l in langs if l not in SAMPLE_SENTENCES] + [l for l in lengths if l not in TEXT_LENGTHS]
+    if unknown:
+        parser.error(f"không hỗ trợ: {', '.join(unknown)}")
+    if not args.stub and not args.no_synthesis and not args.voice:
+        parser.error("cần --voice khi chạy với model thật (hoặc dùng --stub)")
+
+    result = {
+        "meta": {
+            "commit": git_commit(),
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mode": "stub" if args.stub else "xtts",
+            "device": "stub" if args.stub else synthesis.resolve_device(args.device),
+            "precision": args.precision,
+            "repeat": args.repeat,
+        },
+    }
+
+    if not args.no_synthesis:
+        if args.stub:
+            tts, latents, voice = stub_tts(), (None, None), args.voice or ""
+        else:
+            started = time.perf_counter()
+            tts = synthesis.get_tts(args.device, args.precision)
+            result["meta"]["model_load_seconds"] = round(time.perf_counter() - started, 3)
+            latents, voice = None, args.voice
+        result["synthesis"] = bench_synthesis(tts, voice, langs, lengths, args.repeat, latents=latents)
+    if args.db:
+        result["database"] = bench_database(args.db_items)
+    result["peak_rss_mb"] = peak_rss_mb()
+
+    if args.output:
+        args.output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Đã ghi kết quả vào {args.output}")
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        regressions = compare(result, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} chỉ số chậm hơn quá {args.threshold:.0%}.")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import threading
+import time
+
+from streamlit_authenticator.utilities.hasher import Hasher
+
+import database as db
+from settings import CREDENTIAL_CACHE_TTL
+
+# username -> (entry, thời điểm tải); dùng chung cho mọi session trong process
+_cache = {}
+_lock = threading.Lock()
+_migrated = False
+
+
+def _entry_from_row(u: dict) -> dict:
+    uname_key = u['username'].lower().strip()
+    return {
+        'email': u.get('email') or f"{uname_key}@example.com",
+        'logged_in': False,
+        'first_name': u.get('first_name') or uname_key,
+        'last_name': u.get('last_name') or uname_key,
+        'password': u.get('password') or '',
+    }
+
+
+def get_entry(username: str):
+    """Thông tin đăng nhập của user dạng authenticator cần; tải từ DB khi chưa có hoặc đã hết hạn."""
+    key = username.lower().strip()
+    now = time.monotonic()
+    with _lock:
+        cached = _cache.get(key)
+        if cached and now - cached[1] < CREDENTIAL_CACHE_TTL:
+            return cached[0]
+
+    u = db.get_user(key)
+    if not u:
+        return None
+    entry = _entry_from_row(u)
+    if not Hasher.is_hash(entry['password']):
+        # mật khẩu thô còn sót (vd. thêm tay vào DB sau lần migrate): hash một lần và lưu lại
+        entry['password'] = Hasher.hash(entry['password'])
+        db.update_user_password(u['username'], entry['password'])
+    with _lock:
+        _cache[key] = (entry, now)
+    return entry
+
+
+def invalidate(username: str = None) -> None:
+    """Bỏ cache của một user (vd. sau khi đăng ký/đổi mật khẩu), hoặc toàn bộ nếu không truyền."""
+    with _lock:
+        if username is None:
+            _cache.clear()
+        else:
+            _cache.pop(username.lower().strip(), None)
+
+
+class LazyCredentials(dict):
+    """credentials['usernames'] cho authenticator: chỉ tải user từ DB khi được hỏi tới (lúc đăng nhập)."""
+
+    def _load(self, key) -> bool:
+        if not isinstance(key, str):
+            return False
+        entry = get_entry(key)
+        if not entry:
+            return False
+        # bản sao riêng cho mỗi lần chạy script: authenticator ghi logged_in... vào entry
+        dict.__setitem__(self, key, dict(entry))
+        return True
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or self._load(key)
+
+    def __missing__(self, key):
+        if self._load(key):
+            return dict.__getitem__(self, key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+
+def install(authenticator) -> None:
+    """Thay danh sách user của authenticator bằng LazyCredentials (giữ các user khai báo trong config.yaml)."""
+    model = authenticator.authentication_controller.authentication_model
+    model.credentials['usernames'] = LazyCredentials(model.credentials.get('usernames') or {})
+
+
+def migrate_plaintext_passwords() -> None:
+    """Hash các mật khẩu thô còn trong bảng users (chạy một lần mỗi process)."""
+    global _migrated
+    with _lock:
+        if _migrated:
+            return
+        _migrated = True
+    for u in db.list_plaintext_password_users():
+        pw = u.get('password') or ''
+        if pw and not Hasher.is_hash(pw):
+            db.update_user_password(u['username'], Hasher.hash(pw))
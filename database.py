@@ -1,66 +1,38 @@
-import mysql.connector
 import uuid
 import datetime
+import json
+import re
 import yaml 
 from pathlib import Path
 from yaml.loader import SafeLoader
+import storage
+from settings import JOB_RETENTION_SECONDS, VOICE_GRACE_SECONDS
 
 # Tải cấu hình từ file config.yaml
 with open('config.yaml') as file:
     config = yaml.load(file, Loader=SafeLoader)
 
-MYSQL_CONFIG = config['mysql']
+# MySQL hoặc SQLite nhúng, chọn bằng database.backend trong config.yaml (xem storage.py)
+backend = storage.from_config(config)
+DBError = backend.Error
+
 
 def get_db_connection():
-    """Tạo kết nối mới tới database MySQL."""
-    try:
-        conn = mysql.connector.connect(
-            host=MYSQL_CONFIG['host'],
-            user=MYSQL_CONFIG['user'],
-            password=MYSQL_CONFIG['password'],
-            database=MYSQL_CONFIG['database']
-        )
-        return conn
-    except mysql.connector.Error as err:
-        print(f"Lỗi kết nối MySQL: {err}")
-        return None
+    """Lấy kết nối tới database; conn.close() trả kết nối về pool. None nếu không kết nối được."""
+    return backend.connect()
 
 # --- Hết Cấu hình ---
 
+_initialized = False
+
+
 def init_db():
-    """Khởi tạo bảng trong MySQL nếu chưa tồn tại."""
-    conn = get_db_connection()
-    if not conn:
+    """Đưa schema database lên phiên bản mới nhất (chỉ chạy một lần mỗi process, xem migrations.py)."""
+    global _initialized
+    if _initialized:
         return
-    
-    cursor = conn.cursor()
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS history (
-        id VARCHAR(36) PRIMARY KEY,
-        username VARCHAR(255) NOT NULL,
-        text TEXT,
-        lang VARCHAR(10),
-        voice_path TEXT,
-        output_path TEXT,
-        created_at VARCHAR(50),
-        INDEX(username)
-    )
-    """)
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id VARCHAR(36) PRIMARY KEY,
-        username VARCHAR(255) NOT NULL UNIQUE,
-        password VARCHAR(255) NOT NULL,
-        first_name VARCHAR(255),
-        last_name VARCHAR(255),
-        email VARCHAR(255),
-        created_at VARCHAR(50),
-        INDEX(username)
-    )
-    """)
-    conn.commit()
-    cursor.close()
-    conn.close()
+    import migrations
+    _initialized = migrations.migrate()
 
 
 def add_user(username: str, password_hash: str, first_name: str = None, last_name: str = None, email: str = None):
@@ -79,7 +51,7 @@ def add_user(username: str, password_hash: str, first_name: str = None, last_nam
         cursor.execute(sql, (uid, username, password_hash, first_name, last_name, email, created_at))
         conn.commit()
         return True
-    except mysql.connector.Error as err:
+    except DBError as err:
         print(f"Lỗi khi INSERT user: {err}")
         conn.rollback()
         return False
@@ -99,7 +71,7 @@ def get_user(username: str):
         cursor.execute(sql, (username,))
         user = cursor.fetchone()
         return user
-    except mysql.connector.Error as err:
+    except DBError as err:
         print(f"Lỗi khi SELECT user: {err}")
         return None
     finally:
@@ -118,7 +90,7 @@ def list_users() -> list:
         cursor.execute(sql)
         rows = cursor.fetchall()
         return rows
-    except mysql.connector.Error as err:
+    except DBError as err:
         print(f"Lỗi khi liệt kê users: {err}")
         return []
     finally:
@@ -126,14 +98,57 @@ def list_users() -> list:
         conn.close()
 
 
+def update_user_password(username: str, password_hash: str) -> bool:
+    """Cập nhật mật khẩu (đã hash) của user."""
+    conn = get_db_connection()
+    if not conn:
+        return False
+    cursor = conn.cursor()
+    sql = "UPDATE users SET password = %s WHERE username = %s"
+    try:
+        cursor.execute(sql, (password_hash, username))
+        conn.commit()
+        return True
+    except DBError as err:
+        print(f"Lỗi khi UPDATE password: {err}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def list_plaintext_password_users() -> list:
+    """Các user có mật khẩu chưa phải bcrypt hash (không bắt đầu bằng '$2')."""
+    conn = get_db_connection()
+    if not conn:
+        return []
+    cursor = conn.cursor(dictionary=True)
+    sql = "SELECT username, password FROM users WHERE password NOT LIKE '$2%'"
+    try:
+        cursor.execute(sql)
+        return cursor.fetchall()
+    except DBError as err:
+        print(f"Lỗi khi SELECT users: {err}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+
 if __name__ == '__main__':
     # When run directly, create tables
     print('Initializing database tables...')
     init_db()
     print('Done.')
 
-def add_history_item(username: str, text: str, lang: str, voice_path: str, output_path: str):
-    """Thêm một mục lịch sử mới cho user vào MySQL."""
+def add_history_item(username: str, text: str, lang: str, voice_id: str, output_path: str, metrics: dict = None,
+                     chapters: list = None):
+    """Thêm một mục lịch sử mới cho user vào database và tăng ref_count của mẫu giọng.
+
+    metrics: thời gian từng giai đoạn (metrics.RequestTimer.to_dict()), lưu dạng JSON.
+    chapters: mốc chương của tài liệu dài ([{"title", "start"}], documents.py), lưu dạng JSON.
+    """
     conn = get_db_connection()
     if not conn:
         return
@@ -144,33 +159,79 @@ def add_history_item(username: str, text: str, lang: str, voice_path: str, outpu
         "username": username,
         "text": text,
         "lang": lang,
-        "voice_path": str(voice_path),
+        "voice_id": voice_id,
         "output_path": str(output_path),
-        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "created_at": datetime.datetime.now().replace(microsecond=0),
+        "metrics": json.dumps(metrics) if metrics else None,
+        "chapters": json.dumps(chapters, ensure_ascii=False) if chapters else None,
     }
     
     sql = """
-    INSERT INTO history (id, username, text, lang, voice_path, output_path, created_at)
-    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    INSERT INTO history (id, username, text, lang, voice_id, output_path, created_at, metrics, chapters)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
     """
     # MySQL connector dùng %s làm placeholder
     values = (
         item["id"], item["username"], item["text"], item["lang"],
-        item["voice_path"], item["output_path"], item["created_at"]
+        item["voice_id"], item["output_path"], item["created_at"], item["metrics"], item["chapters"]
     )
     
     try:
         cursor.execute(sql, values)
+        cursor.execute("UPDATE voices SET ref_count = ref_count + 1 WHERE id = %s", (voice_id,))
         conn.commit()
-    except mysql.connector.Error as err:
+        return item["id"]
+    except DBError as err:
         print(f"Lỗi khi INSERT: {err}")
         conn.rollback() # Hoàn tác nếu có lỗi
     finally:
         cursor.close()
         conn.close()
 
-def load_history(username: str) -> list:
-    """Tải lịch sử của user từ MySQL."""
+def add_history_items(items: list) -> list:
+    """Thêm nhiều mục lịch sử trong một transaction (dùng cho batch.py).
+
+    Mỗi phần tử là dict có username, text, lang, voice_id, output_path (tuỳ chọn metrics).
+    Trả về danh sách id đã thêm, hoặc [] nếu lỗi (không mục nào được ghi).
+    """
+    if not items:
+        return []
+    conn = get_db_connection()
+    if not conn:
+        return []
+    cursor = conn.cursor()
+    created_at = datetime.datetime.now().replace(microsecond=0)
+    rows = [
+        (str(uuid.uuid4()), it["username"], it["text"], it["lang"], it["voice_id"], str(it["output_path"]), created_at,
+         json.dumps(it["metrics"]) if it.get("metrics") else None)
+        for it in items
+    ]
+    sql = """
+    INSERT INTO history (id, username, text, lang, voice_id, output_path, created_at, metrics)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """
+    # số mục mới cho mỗi mẫu giọng
+    voice_counts = {}
+    for it in items:
+        voice_counts[it["voice_id"]] = voice_counts.get(it["voice_id"], 0) + 1
+    try:
+        cursor.executemany(sql, rows)
+        cursor.executemany(
+            "UPDATE voices SET ref_count = ref_count + %s WHERE id = %s",
+            [(n, vid) for vid, n in voice_counts.items()],
+        )
+        conn.commit()
+        return [r[0] for r in rows]
+    except DBError as err:
+        print(f"Lỗi khi INSERT nhiều mục: {err}")
+        conn.rollback()
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+def load_history(username: str, start: datetime.datetime = None, end: datetime.datetime = None) -> list:
+    """Tải lịch sử của user từ database, tuỳ chọn chỉ trong khoảng [start, end)."""
     conn = get_db_connection()
     if not conn:
         return []
@@ -178,73 +239,204 @@ def load_history(username: str) -> list:
     # Nó giúp trả về kết quả dạng dict
     cursor = conn.cursor(dictionary=True) 
     
-    sql = "SELECT * FROM history WHERE username = %s ORDER BY created_at DESC"
+    sql = "SELECT * FROM history WHERE username = %s"
+    params = [username]
+    if start is not None:
+        sql += " AND created_at >= %s"
+        params.append(start)
+    if end is not None:
+        sql += " AND created_at < %s"
+        params.append(end)
+    sql += " ORDER BY created_at DESC"
     
     try:
-        cursor.execute(sql, (username,))
+        cursor.execute(sql, tuple(params))
         items = cursor.fetchall()
         return items
-    except mysql.connector.Error as err:
+    except DBError as err:
         print(f"Lỗi khi SELECT: {err}")
         return []
     finally:
         cursor.close()
         conn.close()
 
-def delete_history_item(username: str, item_id: str):
-    """Xoá một mục lịch sử của user trong MySQL."""
+def load_history_page(username: str, page_size: int = 20, before: tuple = None):
+    """Tải một trang lịch sử (mới nhất trước) theo keyset (created_at, id).
+
+    before là (created_at, id) của mục cuối trang trước; None để lấy trang đầu.
+    Chỉ lấy các cột hiển thị trong danh sách (text rút gọn còn 120 ký tự).
+    Trả về (items, next_before) với next_before = None nếu không còn trang sau.
+    """
     conn = get_db_connection()
     if not conn:
-        return
+        return [], None
+    cursor = conn.cursor(dictionary=True)
+    columns = (f"id, SUBSTR(text, 1, 120) AS text, {backend.char_length}(text) AS text_len, lang, output_path, "
+               "created_at, chapters")
+    if before:
+        sql = f"""
+        SELECT {columns} FROM history
+        WHERE username = %s AND (created_at < %s OR (created_at = %s AND id < %s))
+        ORDER BY created_at DESC, id DESC LIMIT %s
+        """
+        params = (username, before[0], before[0], before[1], page_size + 1)
+    else:
+        sql = f"""
+        SELECT {columns} FROM history
+        WHERE username = %s
+        ORDER BY created_at DESC, id DESC LIMIT %s
+        """
+        params = (username, page_size + 1)
     try:
-        # Ensure the item exists and belongs to the given user before deleting.
-        cursor_select = conn.cursor(dictionary=True)
-        sql_select = "SELECT voice_path, output_path, username FROM history WHERE id = %s LIMIT 1"
-        cursor_select.execute(sql_select, (item_id,))
-        result = cursor_select.fetchone()
-        cursor_select.close()
-
-        if not result:
+        cursor.execute(sql, params)
+        items = cursor.fetchall()
+        # lấy dư một dòng để biết còn trang sau hay không
+        if len(items) > page_size:
+            items = items[:page_size]
+            last = items[-1]
+            return items, (last["created_at"], last["id"])
+        return items, None
+    except DBError as err:
+        print(f"Lỗi khi SELECT trang lịch sử: {err}")
+        return [], None
+    finally:
+        cursor.close()
+        conn.close()
+
+# số từ tối đa lấy từ chuỗi tìm kiếm
+SEARCH_MAX_TERMS = 10
+
+
+def _search_terms(query: str) -> list:
+    """Các từ trong chuỗi tìm kiếm (chỉ ký tự chữ/số, nên không cần escape cú pháp MATCH)."""
+    return re.findall(r"\w+", (query or "").lower())[:SEARCH_MAX_TERMS]
+
+
+def search_history(username: str, query: str, lang: str = None, start: datetime.datetime = None,
+                   end: datetime.datetime = None, page_size: int = 20, offset: int = 0):
+    """Tìm trong history.text của user, lọc theo ngôn ngữ và khoảng [start, end).
+
+    Mọi từ phải xuất hiện (từ cuối cùng khớp theo tiền tố); kết quả xếp theo độ liên quan
+    rồi mới nhất trước. Dùng index FULLTEXT (MySQL) hoặc bảng FTS5 history_fts (SQLite),
+    không quét bảng. query rỗng thì chỉ lọc. Cột trả về như load_history_page() thêm score.
+    Trả về (items, has_more).
+    """
+    terms = _search_terms(query)
+    conn = get_db_connection()
+    if not conn:
+        return [], False
+    cursor = conn.cursor(dictionary=True)
+    columns = (f"h.id, SUBSTR(h.text, 1, 120) AS text, {backend.char_length}(h.text) AS text_len, "
+               "h.lang, h.output_path, h.created_at, h.chapters")
+    if not terms:
+        sql = f"SELECT {columns}, 0 AS score FROM history h WHERE h.username = %s"
+        params = [username]
+    elif backend.name == "sqlite":
+        # bm25() càng nhỏ càng liên quan
+        sql = f"""
+        SELECT {columns}, -bm25(history_fts) AS score
+        FROM history_fts JOIN history h ON h.rowid = history_fts.rowid
+        WHERE history_fts MATCH %s AND h.username = %s
+        """
+        params = [" ".join(f'"{t}"' for t in terms[:-1]) + f' "{terms[-1]}"*', username]
+    else:
+        match = "MATCH(h.text) AGAINST (%s IN BOOLEAN MODE)"
+        sql = f"SELECT {columns}, {match} AS score FROM history h WHERE h.username = %s AND {match}"
+        against = " ".join(f"+{t}" for t in terms[:-1]) + f" +{terms[-1]}*"
+        params = [against, username, against]
+    if lang:
+        sql += " AND h.lang = %s"
+        params.append(lang)
+    if start is not None:
+        sql += " AND h.created_at >= %s"
+        params.append(start)
+    if end is not None:
+        sql += " AND h.created_at < %s"
+        params.append(end)
+    sql += " ORDER BY score DESC, h.created_at DESC, h.id DESC LIMIT %s OFFSET %s"
+    # lấy dư một dòng để biết còn trang sau hay không
+    params += [page_size + 1, offset]
+    try:
+        cursor.execute(sql, tuple(params))
+        items = cursor.fetchall()
+        return items[:page_size], len(items) > page_size
+    except DBError as err:
+        print(f"Lỗi khi tìm lịch sử: {err}")
+        return [], False
+    finally:
+        cursor.close()
+        conn.close()
+
+def delete_history_items(username: str, item_ids: list):
+    """Xoá nhiều mục lịch sử của user trong một transaction.
+
+    Chỉ xoá các mục thuộc về user. Trả về (số mục đã xoá, file kết quả không còn mục nào
+    dùng chung, file mẫu giọng riêng của các mục cũ); xoá các file đó là việc của
+    history_store.delete_items. Mẫu giọng trong kho được prune_unused_voices() xoá sau khi
+    ref_count về 0.
+    """
+    if not item_ids:
+        return 0, [], []
+    conn = get_db_connection()
+    if not conn:
+        return 0, [], []
+    placeholders = ", ".join(["%s"] * len(item_ids))
+    try:
+        # Ensure the items exist and belong to the given user before deleting.
+        cursor = conn.cursor(dictionary=True)
+        sql_select = f"SELECT id, voice_path, voice_id, output_path FROM history WHERE id IN ({placeholders}) AND username = %s"
+        cursor.execute(sql_select, (*item_ids, username))
+        rows = cursor.fetchall()
+        cursor.close()
+
+        if not rows:
             # nothing to delete
             conn.close()
-            return False
+            return 0, [], []
 
-        # check ownership
-        row_user = result.get('username')
-        if row_user != username:
-            # don't delete if usernames don't match
-            conn.close()
-            return False
+        cursor = conn.cursor()
+        found_ids = [r["id"] for r in rows]
+        cursor.execute(
+            f"DELETE FROM history WHERE id IN ({', '.join(['%s'] * len(found_ids))})", found_ids
+        )
 
-        # delete physical files if present
-        try:
-            if result.get("output_path") and Path(result["output_path"]).exists():
-                Path(result["output_path"]).unlink()
-        except Exception:
-            pass
-        try:
-            if result.get("voice_path") and Path(result["voice_path"]).exists():
-                Path(result["voice_path"]).unlink()
-        except Exception:
-            pass
+        voice_counts = {}
+        for r in rows:
+            if r.get("voice_id"):
+                voice_counts[r["voice_id"]] = voice_counts.get(r["voice_id"], 0) + 1
+        for voice_id, count in voice_counts.items():
+            _release_voice(cursor, voice_id, count)
 
-        # delete the record by id (safe, single-row)
-        cursor_delete = conn.cursor()
-        sql_delete = "DELETE FROM history WHERE id = %s"
-        cursor_delete.execute(sql_delete, (item_id,))
+        # file kết quả có thể được nhiều mục dùng chung qua cache (tra theo index idx_history_output)
+        output_paths = list({r["output_path"] for r in rows if r.get("output_path")})
+        if output_paths:
+            in_paths = ", ".join(["%s"] * len(output_paths))
+            cursor.execute(f"SELECT DISTINCT output_path FROM history WHERE output_path IN ({in_paths})", output_paths)
+            still_used = {r[0] for r in cursor.fetchall()}
+            orphan_outputs = [p for p in output_paths if p not in still_used]
+        else:
+            orphan_outputs = []
+        if orphan_outputs:
+            cursor.execute(
+                f"DELETE FROM synthesis_cache WHERE output_path IN ({', '.join(['%s'] * len(orphan_outputs))})",
+                orphan_outputs,
+            )
         conn.commit()
-        cursor_delete.close()
+        cursor.close()
         conn.close()
-        return True
 
-    except mysql.connector.Error as err:
+        # các mục cũ (chỉ có voice_path) vẫn có file mẫu giọng riêng như trước
+        voice_paths = [r["voice_path"] for r in rows if r.get("voice_path") and not r.get("voice_id")]
+        return len(rows), orphan_outputs, voice_paths
+
+    except DBError as err:
         print(f"Lỗi khi DELETE: {err}")
         try:
             conn.rollback()
         except Exception:
             pass
         conn.close()
-        return False
+        return 0, [], []
 
 def get_history_item(item_id: str) -> dict:
     """Lấy một mục lịch sử cụ thể bằng ID (dùng cho chức năng Sửa)."""
@@ -253,15 +445,469 @@ def get_history_item(item_id: str) -> dict:
         return None
         
     cursor = conn.cursor(dictionary=True)
-    sql = "SELECT * FROM history WHERE id = %s"
+    # voice_path lấy từ kho mẫu giọng nếu có voice_id, nếu không thì dùng cột cũ
+    sql = """
+    SELECT h.id, h.username, h.text, h.lang, h.voice_id, h.output_path, h.created_at,
+           COALESCE(v.path, h.voice_path) AS voice_path
+    FROM history h LEFT JOIN voices v ON v.id = h.voice_id
+    WHERE h.id = %s
+    """
     
     try:
         cursor.execute(sql, (item_id,))
         item = cursor.fetchone()
         return item if item else None
-    except mysql.connector.Error as err:
+    except DBError as err:
         print(f"Lỗi khi GET: {err}")
         return None
     finally:
         cursor.close()
         conn.close()
+
+
+def get_history_items(item_ids: list) -> list:
+    """Lấy nhiều mục lịch sử theo danh sách ID trong một truy vấn."""
+    if not item_ids:
+        return []
+    conn = get_db_connection()
+    if not conn:
+        return []
+    cursor = conn.cursor(dictionary=True)
+    placeholders = ", ".join(["%s"] * len(item_ids))
+    sql = f"""
+    SELECT h.id, h.username, h.text, h.lang, h.voice_id, h.output_path, h.created_at,
+           COALESCE(v.path, h.voice_path) AS voice_path
+    FROM history h LEFT JOIN voices v ON v.id = h.voice_id
+    WHERE h.id IN ({placeholders})
+    """
+    try:
+        cursor.execute(sql, tuple(item_ids))
+        return cursor.fetchall()
+    except DBError as err:
+        print(f"Lỗi khi GET nhiều mục: {err}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def load_recent_metrics(limit: int = 2000) -> list:
+    """metrics của các mục lịch sử gần nhất (mọi user): [{lang, metrics: dict}], mới nhất trước.
+
+    Đọc ngược theo index idx_history_created, dừng sau limit dòng (không sắp xếp cả bảng).
+    """
+    conn = get_db_connection()
+    if not conn:
+        return []
+    cursor = conn.cursor(dictionary=True)
+    sql = """
+    SELECT lang, metrics FROM history
+    WHERE metrics IS NOT NULL
+    ORDER BY created_at DESC
+    LIMIT %s
+    """
+    try:
+        cursor.execute(sql, (limit,))
+        rows = []
+        for row in cursor.fetchall():
+            try:
+                rows.append({"lang": row["lang"], "metrics": json.loads(row["metrics"])})
+            except ValueError:
+                continue
+        return rows
+    except DBError as err:
+        print(f"Lỗi khi đọc metrics: {err}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def add_voice(voice_id: str, path: str, ext: str, size_bytes: int) -> bool:
+    """Đăng ký một mẫu giọng vào bảng voices; nếu đã tồn tại thì chỉ cập nhật last_used_at.
+
+    Mẫu giọng chưa có tham chiếu (ref_count = 0) được giữ lại ít nhất VOICE_GRACE_SECONDS
+    kể từ last_used_at để kịp tạo job/mục lịch sử, sau đó prune_unused_voices() mới xoá.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return False
+    cursor = conn.cursor()
+    now = _now()
+    sql = f"""
+    {backend.insert_ignore} INTO voices (id, path, ext, size_bytes, ref_count, created_at, last_used_at)
+    VALUES (%s, %s, %s, %s, 0, %s, %s)
+    """
+    try:
+        cursor.execute(sql, (voice_id, str(path), ext, size_bytes, now, now))
+        cursor.execute("UPDATE voices SET last_used_at = %s WHERE id = %s", (now, voice_id))
+        conn.commit()
+        return True
+    except DBError as err:
+        print(f"Lỗi khi INSERT voice: {err}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def get_voice(voice_id: str) -> dict:
+    """Lấy thông tin mẫu giọng theo id (SHA-256), trả về dict hoặc None."""
+    conn = get_db_connection()
+    if not conn:
+        return None
+    cursor = conn.cursor(dictionary=True)
+    sql = "SELECT * FROM voices WHERE id = %s"
+    try:
+        cursor.execute(sql, (voice_id,))
+        return cursor.fetchone()
+    except DBError as err:
+        print(f"Lỗi khi SELECT voice: {err}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _acquire_voice(cursor, voice_id: str) -> bool:
+    """Tăng ref_count của mẫu giọng; False nếu mẫu giọng đã bị prune_unused_voices() dọn."""
+    cursor.execute("UPDATE voices SET ref_count = ref_count + 1, last_used_at = %s WHERE id = %s",
+                   (_now(), voice_id))
+    return cursor.rowcount > 0
+
+
+def acquire_voice(voice_id: str) -> bool:
+    """Giữ một tham chiếu tới mẫu giọng (vd. batch.py trong lúc tổng hợp); bỏ bằng release_voice()."""
+    conn = get_db_connection()
+    if not conn:
+        return False
+    cursor = conn.cursor()
+    try:
+        if not _acquire_voice(cursor, voice_id):
+            print(f"Lỗi khi giữ voice: mẫu giọng {voice_id} không còn")
+            conn.rollback()
+            return False
+        conn.commit()
+        return True
+    except DBError as err:
+        print(f"Lỗi khi giữ voice: {err}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def _release_voice(cursor, voice_id: str, count: int = 1):
+    """Giảm ref_count của mẫu giọng.
+
+    Bản ghi và file không bị xoá ngay khi về 0 (có thể đang có người tải lên lại cùng mẫu giọng
+    để tạo job), mà để prune_unused_voices() xoá sau VOICE_GRACE_SECONDS.
+    """
+    cursor.execute(
+        "UPDATE voices SET ref_count = CASE WHEN ref_count > %s THEN ref_count - %s ELSE 0 END, "
+        "last_used_at = %s WHERE id = %s",
+        (count, count, _now(), voice_id),
+    )
+
+
+def prune_unused_voices(grace_seconds: int = VOICE_GRACE_SECONDS) -> list:
+    """Xoá các mẫu giọng không còn job/mục lịch sử nào dùng quá grace_seconds.
+
+    Trả về đường dẫn file của các mẫu giọng đã xoá khỏi bảng (voice_store.prune xoá file).
+    """
+    conn = get_db_connection()
+    if not conn:
+        return []
+    cursor = conn.cursor()
+    cutoff = (datetime.datetime.now() - datetime.timedelta(seconds=grace_seconds)).isoformat(timespec="seconds")
+    removed = []
+    try:
+        cursor.execute(
+            "SELECT id, path FROM voices WHERE ref_count = 0 AND last_used_at < %s", (cutoff,)
+        )
+        for voice_id, path in cursor.fetchall():
+            # kiểm tra lại trong cùng câu lệnh: job vừa tạo (ref_count > 0) hoặc vừa tải lên thì giữ
+            cursor.execute(
+                "DELETE FROM voices WHERE id = %s AND ref_count = 0 AND last_used_at < %s", (voice_id, cutoff)
+            )
+            if cursor.rowcount == 1:
+                removed.append(path)
+        conn.commit()
+        return removed
+    except DBError as err:
+        print(f"Lỗi khi dọn voices: {err}")
+        conn.rollback()
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def get_cached_result(cache_key: str):
+    """Tìm file kết quả đã tổng hợp cho cache_key; trả về output_path hoặc None."""
+    conn = get_db_connection()
+    if not conn:
+        return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT output_path FROM synthesis_cache WHERE cache_key = %s", (cache_key,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        if not Path(row[0]).exists():
+            # file đã mất -> bỏ bản ghi để lần sau tổng hợp lại
+            cursor.execute("DELETE FROM synthesis_cache WHERE cache_key = %s", (cache_key,))
+            conn.commit()
+            return None
+        cursor.execute("UPDATE synthesis_cache SET hits = hits + 1 WHERE cache_key = %s", (cache_key,))
+        conn.commit()
+        return row[0]
+    except DBError as err:
+        print(f"Lỗi khi SELECT synthesis_cache: {err}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def put_cached_result(cache_key: str, output_path: str) -> bool:
+    """Ghi (hoặc thay) file kết quả cho cache_key."""
+    conn = get_db_connection()
+    if not conn:
+        return False
+    cursor = conn.cursor()
+    created_at = datetime.datetime.now().isoformat(timespec="seconds")
+    sql = f"""
+    INSERT INTO synthesis_cache (cache_key, output_path, hits, created_at)
+    VALUES (%s, %s, 0, %s)
+    {backend.upsert("cache_key", ("output_path", "created_at"))}
+    """
+    try:
+        cursor.execute(sql, (cache_key, str(output_path), created_at))
+        conn.commit()
+        return True
+    except DBError as err:
+        print(f"Lỗi khi INSERT synthesis_cache: {err}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def release_voice(voice_id: str) -> bool:
+    """Bỏ một tham chiếu tới mẫu giọng (vd. job đã xong hoặc bị lỗi)."""
+    conn = get_db_connection()
+    if not conn:
+        return False
+    cursor = conn.cursor()
+    try:
+        _release_voice(cursor, voice_id)
+        conn.commit()
+        return True
+    except DBError as err:
+        print(f"Lỗi khi release voice: {err}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# --- Hàng đợi job ---
+
+def _now() -> str:
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+def enqueue_job(username: str, text: str, lang: str, voice_id: str, output_format: str = "wav",
+                device: str = "auto", precision: str = "fp32", mode: str = "text", post: dict = None):
+    """Thêm job tổng hợp vào hàng đợi; job giữ một tham chiếu tới mẫu giọng. Trả về job id.
+
+    mode: "text" (văn bản thường) hoặc "document" (tài liệu dài, documents.py).
+    post: tuỳ chọn hậu kỳ (postprocess.py), lưu dạng JSON.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None
+    cursor = conn.cursor()
+    job_id = str(uuid.uuid4())
+    now = _now()
+    sql = """
+    INSERT INTO jobs (id, username, text, lang, voice_id, output_format, device, `precision`, mode, postprocess,
+                      status, progress, created_at, updated_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 'queued', 0, %s, %s)
+    """
+    try:
+        if not _acquire_voice(cursor, voice_id):
+            # mẫu giọng đã bị dọn (prune_unused_voices) trước khi job kịp giữ tham chiếu
+            print(f"Lỗi khi INSERT job: mẫu giọng {voice_id} không còn")
+            conn.rollback()
+            return None
+        cursor.execute(sql, (job_id, username, text, lang, voice_id, output_format, device, precision, mode,
+                             json.dumps(post) if post is not None else None, now, now))
+        conn.commit()
+        return job_id
+    except DBError as err:
+        print(f"Lỗi khi INSERT job: {err}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def claim_next_job():
+    """Nhận job 'queued' cũ nhất (nguyên tử) và chuyển sang 'running'; trả về dict hoặc None.
+
+    Job được chọn và đọc lại theo id (khoá chính), dùng index (status, created_at) để tìm.
+    Cột claim_token của dict là mã của lần nhận này: truyền cho update_job để chỉ worker
+    đang giữ job (chưa bị requeue_stale_jobs đưa về hàng đợi) mới cập nhật được nó.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None
+    cursor = conn.cursor(dictionary=True)
+    token = str(uuid.uuid4())
+    if backend.name == "sqlite":
+        # giữ khoá ghi từ lúc chọn tới lúc commit: worker khác chờ (busy_timeout) rồi chọn job kế tiếp
+        lock = ""
+    else:
+        # job đang được worker khác nhận thì bỏ qua thay vì chờ khoá dòng
+        lock = " FOR UPDATE SKIP LOCKED"
+    try:
+        if backend.name == "sqlite":
+            cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(f"SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at ASC LIMIT 1{lock}")
+        row = cursor.fetchone()
+        if row is None:
+            conn.rollback()
+            return None
+        cursor.execute(
+            "UPDATE jobs SET status = 'running', claim_token = %s, updated_at = %s WHERE id = %s",
+            (token, _now(), row["id"]),
+        )
+        conn.commit()
+        cursor.execute("SELECT * FROM jobs WHERE id = %s", (row["id"],))
+        return cursor.fetchone()
+    except DBError as err:
+        print(f"Lỗi khi nhận job: {err}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def update_job(job_id: str, claim_token: str = None, **fields) -> bool:
+    """Cập nhật các cột của job (status, progress, error, output_path, history_id).
+
+    Có claim_token (từ claim_next_job) thì chỉ cập nhật khi job vẫn thuộc lần nhận đó.
+    Trả về False nếu lỗi hoặc không có job nào khớp (vd. job đã được requeue cho worker khác).
+    """
+    allowed = {"status", "progress", "error", "output_path", "history_id"}
+    fields = {k: v for k, v in fields.items() if k in allowed}
+    conn = get_db_connection()
+    if not conn:
+        return False
+    cursor = conn.cursor()
+    assignments = ", ".join(f"{k} = %s" for k in fields)
+    sql = f"UPDATE jobs SET {assignments}{', ' if assignments else ''}updated_at = %s WHERE id = %s"
+    params = [*fields.values(), _now(), job_id]
+    if claim_token is not None:
+        sql += " AND claim_token = %s"
+        params.append(claim_token)
+    try:
+        cursor.execute(sql, params)
+        conn.commit()
+        return cursor.rowcount > 0
+    except DBError as err:
+        print(f"Lỗi khi UPDATE job: {err}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def get_job(job_id: str) -> dict:
+    """Lấy một job theo id."""
+    conn = get_db_connection()
+    if not conn:
+        return None
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT * FROM jobs WHERE id = %s", (job_id,))
+        return cursor.fetchone()
+    except DBError as err:
+        print(f"Lỗi khi SELECT job: {err}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def list_active_jobs(username: str) -> list:
+    """Các job đang chờ hoặc đang chạy của user (cũ nhất trước)."""
+    conn = get_db_connection()
+    if not conn:
+        return []
+    cursor = conn.cursor(dictionary=True)
+    sql = """
+    SELECT id, text, lang, status, progress, created_at FROM jobs
+    WHERE username = %s AND status IN ('queued', 'running')
+    ORDER BY created_at ASC
+    """
+    try:
+        cursor.execute(sql, (username,))
+        return cursor.fetchall()
+    except DBError as err:
+        print(f"Lỗi khi liệt kê jobs: {err}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def requeue_stale_jobs(stale_seconds: int) -> int:
+    """Đưa các job 'running' không cập nhật quá stale_seconds (worker chết) về lại 'queued'."""
+    conn = get_db_connection()
+    if not conn:
+        return 0
+    cursor = conn.cursor()
+    cutoff = (datetime.datetime.now() - datetime.timedelta(seconds=stale_seconds)).isoformat(timespec="seconds")
+    sql = "UPDATE jobs SET status = 'queued', progress = 0, claim_token = NULL WHERE status = 'running' AND updated_at < %s"
+    try:
+        cursor.execute(sql, (cutoff,))
+        conn.commit()
+        return cursor.rowcount
+    except DBError as err:
+        print(f"Lỗi khi requeue jobs: {err}")
+        conn.rollback()
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def prune_finished_jobs(max_age: int = JOB_RETENTION_SECONDS) -> int:
+    """Xoá các job 'done'/'failed' cập nhật lần cuối quá max_age giây trước (kết quả đã nằm trong lịch sử)."""
+    conn = get_db_connection()
+    if not conn:
+        return 0
+    cursor = conn.cursor()
+    cutoff = (datetime.datetime.now() - datetime.timedelta(seconds=max_age)).isoformat(timespec="seconds")
+    sql = "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < %s"
+    try:
+        cursor.execute(sql, (cutoff,))
+        conn.commit()
+        return cursor.rowcount
+    except DBError as err:
+        print(f"Lỗi khi dọn jobs: {err}")
+        conn.rollback()
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
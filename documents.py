@@ -0,0 +1,431 @@
+"""Tổng hợp tài liệu dài (.txt/.md) bằng nhiều process model trên CPU, có checkpoint.
+
+Tài liệu được chia thành chương (tiêu đề Markdown #) và đoạn (đoạn văn, đoạn quá dài
+thì gom theo câu tới DOC_CHUNK_CHARS ký tự). Các đoạn được tổng hợp song song trong một
+pool process (mỗi process một model CPU), mỗi đoạn xong được ghi ngay ra
+outputs/documents/<khoá tài liệu>/chunk_XXXXX.npy. Chạy lại cùng tài liệu (cùng giọng,
+ngôn ngữ, model) sẽ bỏ qua các đoạn đã có; cuối cùng ghép theo thứ tự thành một file WAV
+kèm mốc thời gian từng chương.
+
+Process con đo từng giai đoạn (nạp model, latents, queue_wait, gpt_decode, vocoder) của mỗi
+đoạn và trả về cùng kết quả; thời gian chờ pool của yêu cầu được chia theo tỉ lệ đó.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+import wave
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+import segments
+import synthesis
+from settings import (
+    DOC_CHAPTER_PAUSE,
+    DOC_CHUNK_CHARS,
+    DOC_LOCK_STALE_SECONDS,
+    DOC_PARAGRAPH_PAUSE,
+    DOC_POOL_IDLE_SECONDS,
+    DOC_THREADS_PER_WORKER,
+    DOC_WORKERS,
+    DOCUMENTS_DIR,
+)
+
+DOCUMENT_EXTS = ("txt", "md")
+
+_HEADING_RE = re.compile(r"^\s{0,3}(#{1,6})\s+(.*?)\s*#*\s*$")
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…。！？])\s+")
+# cú pháp Markdown bỏ đi khi đọc (giữ lại chữ)
+_MARKDOWN_SUBS = [
+    (re.compile(r"!\[([^\]]*)\]\([^)]*\)"), r"\1"),  # ảnh
+    (re.compile(r"\[([^\]]*)\]\([^)]*\)"), r"\1"),  # link
+    (re.compile(r"<[^>]+>"), ""),  # thẻ HTML
+    (re.compile(r"^\s*(?:[-*+]|\d+[.)])\s+"), ""),  # gạch đầu dòng
+    (re.compile(r"^\s*>+\s?"), ""),  # trích dẫn
+    (re.compile(r"[*_`~]{1,3}"), ""),  # nhấn mạnh, code
+]
+
+# precision -> pool; số tài liệu đang dùng pool và hẹn giờ đóng pool khi rảnh
+_pools = {}
+_pool_users = {}
+_idle_timers = {}
+_pools_lock = threading.Lock()
+
+
+def decode_upload(data: bytes) -> str:
+    """Nội dung file tài liệu tải lên (UTF-8, có hoặc không BOM; nếu không thì cp1258)."""
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return data.decode("cp1258", errors="replace")
+
+
+def _plain(line: str) -> str:
+    for pattern, repl in _MARKDOWN_SUBS:
+        line = pattern.sub(repl, line)
+    return line.strip()
+
+
+def parse_document(text: str) -> list:
+    """Chia tài liệu thành [(tiêu đề chương, [đoạn văn])]; phần trước tiêu đề đầu tiên là chương không tên."""
+    chapters = [("", [])]
+    paragraph = []
+    in_fence = False
+
+    def flush():
+        if paragraph:
+            chapters[-1][1].append(" ".join(paragraph))
+            paragraph.clear()
+
+    for line in text.splitlines():
+        if _FENCE_RE.match(line):
+            # khối code không đọc thành lời
+            in_fence = not in_fence
+            flush()
+            continue
+        if in_fence:
+            continue
+        heading = _HEADING_RE.match(line)
+        if heading:
+            flush()
+            chapters.append((_plain(heading.group(2)), []))
+            continue
+        if not line.strip() or line.strip().startswith("|") or re.fullmatch(r"\s*([-*_=]\s*){3,}", line):
+            # dòng trống, bảng, đường kẻ ngang: hết đoạn
+            flush()
+            continue
+        plain = _plain(line)
+        if plain:
+            paragraph.append(plain)
+    flush()
+    return [(title, paras) for title, paras in chapters if paras or title]
+
+
+def _split_long(paragraph: str, max_chars: int) -> list:
+    """Gom các câu của đoạn văn thành các phần không quá max_chars ký tự (trừ câu dài hơn thế)."""
+    if len(paragraph) <= max_chars:
+        return [paragraph]
+    parts, current = [], ""
+    for sentence in _SENTENCE_END_RE.split(paragraph):
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            parts.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current:
+        parts.append(current)
+    return parts
+
+
+def plan_chunks(text: str, max_chars: int = DOC_CHUNK_CHARS) -> tuple:
+    """Trả về (chunks, chapters): chunks là [{"chapter", "paragraph_start", "text"}] theo thứ tự đọc,
+    chapters là [{"title", "chunk"}] với chunk = chỉ số đoạn đầu tiên của chương."""
+    chunks, chapters = [], []
+    for chapter_index, (title, paragraphs) in enumerate(parse_document(text)):
+        first = len(chunks)
+        for paragraph in paragraphs:
+            for i, part in enumerate(_split_long(paragraph, max_chars)):
+                chunks.append({"chapter": chapter_index, "paragraph_start": i == 0, "text": part})
+        if len(chunks) > first:
+            chapters.append({"title": title, "chunk": first})
+    return chunks, chapters
+
+
+def document_key(text: str, language: str, voice_id: str, precision: str = "fp32") -> str:
+    """Khoá của tài liệu: thư mục checkpoint và khoá cache kết quả (khác với cùng văn bản ở chế độ thường)."""
+    parts = ["document", synthesis.normalize_text(text), language, voice_id, synthesis.model_version(precision)]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def work_dir(key: str) -> Path:
+    return DOCUMENTS_DIR / key
+
+
+def _chunk_path(directory: Path, index: int) -> Path:
+    return directory / f"chunk_{index:05d}.npy"
+
+
+# --- Process con ---
+
+# trong process con: thời gian khởi động chưa báo về (gộp vào kết quả của đoạn đầu tiên)
+_startup_stages = {}
+
+
+def _init_worker(precision: str, threads: int) -> None:
+    """Chạy một lần trong mỗi process của pool: chia luồng CPU và nạp model trước."""
+    started = time.perf_counter()
+    synthesis.configure_cpu_threads()
+    import torch
+
+    torch.set_num_threads(threads)
+    synthesis.get_tts("cpu", precision)
+    _startup_stages["model_load"] = time.perf_counter() - started
+
+
+def _synthesize_chunk(path: str, text: str, language: str, speaker_wav: str, voice_id: str, precision: str):
+    """Tổng hợp một đoạn trong process con và ghi checkpoint int16.
+
+    Trả về (sample rate, {giai đoạn: giây} của đoạn này trong process con).
+    """
+    timer = metrics.RequestTimer()
+    with timer.activate():
+        tts = synthesis.get_tts("cpu", precision)
+        # câu đã có trong segments (vd. tài liệu sửa vài chỗ) được dùng lại
+        wav, _ = segments.synthesize(tts, text, speaker_wav, language, voice_id, precision)
+    # bỏ khoảng lặng sau câu cuối; khoảng nghỉ giữa các đoạn do bước ghép thêm vào
+    wav = wav[:max(0, len(wav) - synthesis.SENTENCE_PAUSE_SAMPLES)]
+    path = Path(path)
+    tmp = path.with_name(f".{uuid.uuid4().hex}.npy")
+    np.save(tmp, (np.clip(wav, -1.0, 1.0) * 32767).astype(np.int16))
+    os.replace(tmp, path)
+    for stage, seconds in _startup_stages.items():
+        timer.add(stage, seconds)
+    _startup_stages.clear()
+    return tts.synthesizer.output_sample_rate, timer.stages
+
+
+def _add_worker_stages(waited: float, stages: dict) -> None:
+    """Chia thời gian chờ pool (waited giây) vào timer hiện tại theo tỉ lệ các giai đoạn process con báo về.
+
+    Các đoạn chạy song song nên tổng thời gian của process con lớn hơn thời gian chờ thực tế;
+    chia theo tỉ lệ để các giai đoạn của yêu cầu vẫn cộng lại bằng thời gian của nó.
+    """
+    timer = metrics.current()
+    busy = sum(stages.values())
+    if timer is None or busy <= 0:
+        return
+    for stage, seconds in stages.items():
+        timer.add(stage, waited * seconds / busy)
+
+
+def num_workers() -> int:
+    return DOC_WORKERS or max(1, (os.cpu_count() or 1) // DOC_THREADS_PER_WORKER)
+
+
+def acquire_pool(precision: str = "fp32") -> ProcessPoolExecutor:
+    """Pool process dùng chung theo precision (tạo khi cần, model nạp sẵn trong từng process).
+
+    Mỗi lần acquire_pool() phải đi kèm một release_pool(); pool không còn tài liệu nào dùng
+    được đóng sau DOC_POOL_IDLE_SECONDS để trả lại RAM của các model.
+    """
+    with _pools_lock:
+        timer = _idle_timers.pop(precision, None)
+        if timer is not None:
+            timer.cancel()
+        _pool_users[precision] = _pool_users.get(precision, 0) + 1
+        if precision not in _pools:
+            workers = num_workers()
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            # spawn: không fork process đang có nhiều luồng (Streamlit, torch)
+            _pools[precision] = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(precision, threads),
+            )
+        return _pools[precision]
+
+
+def release_pool(precision: str = "fp32") -> None:
+    with _pools_lock:
+        _pool_users[precision] = max(0, _pool_users.get(precision, 0) - 1)
+        pool = _pools.get(precision)
+        if _pool_users[precision] or pool is None:
+            return
+        timer = threading.Timer(DOC_POOL_IDLE_SECONDS, _close_idle_pool, (precision, pool))
+        timer.daemon = True
+        _idle_timers[precision] = timer
+    timer.start()
+
+
+def _close_idle_pool(precision: str, pool: ProcessPoolExecutor) -> None:
+    with _pools_lock:
+        # có tài liệu mới dùng lại pool trong lúc chờ thì giữ
+        if _pool_users.get(precision) or _pools.get(precision) is not pool:
+            return
+        del _pools[precision]
+        _idle_timers.pop(precision, None)
+    pool.shutdown(wait=False)
+
+
+def _drop_pool(precision: str) -> None:
+    with _pools_lock:
+        pool = _pools.pop(precision, None)
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+# --- Process chính ---
+
+LOCK_POLL_SECONDS = 1.0
+
+
+@contextmanager
+def document_lock(key: str):
+    """Khoá liên process cho một tài liệu (file DOCUMENTS_DIR/<key>.lock tạo bằng O_EXCL).
+
+    Hai job cùng tài liệu dùng chung thư mục checkpoint: job sau chờ job trước xong (khi đó
+    kết quả đã nằm trong cache). Bên giữ khoá cập nhật mtime định kỳ; file khoá không được
+    cập nhật quá DOC_LOCK_STALE_SECONDS coi như của process đã chết và bị bỏ.
+    """
+    path = DOCUMENTS_DIR / f"{key}.lock"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    while True:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - path.stat().st_mtime > DOC_LOCK_STALE_SECONDS:
+                    path.unlink(missing_ok=True)
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(LOCK_POLL_SECONDS)
+
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(DOC_LOCK_STALE_SECONDS / 5):
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+    threading.Thread(target=heartbeat, name="document-lock", daemon=True).start()
+    try:
+        yield
+    finally:
+        stop.set()
+        path.unlink(missing_ok=True)
+
+def _load_plan(directory: Path, text: str):
+    try:
+        with open(directory / "plan.json", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    chunks, chapters = plan_chunks(text)
+    plan = {"chunks": chunks, "chapters": chapters, "sample_rate": None}
+    _save_plan(directory, plan)
+    return plan
+
+
+def _save_plan(directory: Path, plan: dict) -> None:
+    directory.mkdir(parents=True, exist_ok=True)
+    tmp = directory / f".{uuid.uuid4().hex}.json"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(plan, f, ensure_ascii=False)
+    os.replace(tmp, directory / "plan.json")
+
+
+def _stitch(directory: Path, plan: dict, file_path) -> tuple:
+    """Ghép các đoạn theo thứ tự vào file WAV (đọc từng đoạn bằng memory-map).
+
+    Trả về (mốc chương [{"title", "start" (giây)}], độ dài audio theo giây).
+    """
+    sr = plan["sample_rate"]
+    paragraph_pause = np.zeros(int(DOC_PARAGRAPH_PAUSE * sr), dtype=np.int16).tobytes()
+    chapter_pause = np.zeros(int(DOC_CHAPTER_PAUSE * sr), dtype=np.int16).tobytes()
+    sentence_pause = np.zeros(synthesis.SENTENCE_PAUSE_SAMPLES, dtype=np.int16).tobytes()
+    chapter_starts = {c["chunk"]: c["title"] for c in plan["chapters"]}
+    markers = []
+    written = 0
+    with wave.open(str(file_path), "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sr)
+        for i, chunk in enumerate(plan["chunks"]):
+            if i > 0:
+                pause = chapter_pause if i in chapter_starts else (
+                    paragraph_pause if chunk["paragraph_start"] else sentence_pause)
+                wf.writeframes(pause)
+                written += len(pause) // 2
+            if i in chapter_starts:
+                markers.append({"title": chapter_starts[i], "start": round(written / sr, 3)})
+            pcm = np.load(_chunk_path(directory, i), mmap_mode="r")
+            wf.writeframes(pcm.tobytes())
+            written += len(pcm)
+    return markers, written / sr
+
+
+def synthesize_document(text: str, speaker_wav: str, language: str, voice_id: str, file_path,
+                        precision: str = "fp32", progress_callback=None) -> dict:
+    """Tổng hợp cả tài liệu vào file WAV file_path; tiếp tục từ checkpoint nếu đã chạy dở.
+
+    Bên gọi giữ document_lock(document_key(...)) để không có hai lần chạy cùng thư mục checkpoint.
+    progress_callback(số đoạn đã xong, tổng số đoạn). Trả về manifest
+    {"chapters": [{"title", "start"}], "audio_seconds", "chunks", ...} (cũng được ghi cạnh file).
+    """
+    directory = work_dir(document_key(text, language, voice_id, precision))
+    plan = _load_plan(directory, text)
+    total = len(plan["chunks"])
+    if total == 0:
+        raise ValueError("Tài liệu không có nội dung để đọc.")
+    pending = [i for i in range(total) if not _chunk_path(directory, i).exists()]
+    if not pending and plan["sample_rate"] is None:
+        # dừng ngay sau khi ghi đoạn cuối: chạy lại đoạn đầu (lấy từ segments) để biết sample rate
+        pending = [0]
+    done = total - len(pending)
+    if progress_callback:
+        progress_callback(done, total)
+
+    if pending:
+        # tính từ lúc lấy pool: process con được tạo và nạp model khi cần
+        worker_stages = {}
+        waited = time.perf_counter()
+        pool = acquire_pool(precision)
+        futures = {
+            pool.submit(_synthesize_chunk, str(_chunk_path(directory, i)), plan["chunks"][i]["text"], language,
+                        str(speaker_wav), voice_id, precision): i
+            for i in pending
+        }
+        try:
+            for future in as_completed(futures):
+                sr, stages = future.result()
+                for stage, seconds in stages.items():
+                    worker_stages[stage] = worker_stages.get(stage, 0.0) + seconds
+                if plan["sample_rate"] is None:
+                    plan["sample_rate"] = sr
+                    _save_plan(directory, plan)
+                done += 1
+                if progress_callback:
+                    progress_callback(done, total)
+        except BrokenProcessPool:
+            # process con chết (vd. hết RAM): tạo pool mới ở lần sau, các đoạn đã xong vẫn giữ
+            _drop_pool(precision)
+            raise
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            release_pool(precision)
+            _add_worker_stages(time.perf_counter() - waited, worker_stages)
+
+    with metrics.span("wav_write"):
+        chapters, audio_seconds = _stitch(directory, plan, file_path)
+    manifest = {
+        "model": synthesis.model_version(precision),
+        "language": language,
+        "voice_id": voice_id,
+        "sample_rate": plan["sample_rate"],
+        "chunks": total,
+        "chapters": chapters,
+        "audio_seconds": audio_seconds,
+    }
+    segments.write_manifest(file_path, manifest)
+    # đã có file hoàn chỉnh: bỏ checkpoint
+    shutil.rmtree(directory, ignore_errors=True)
+    return manifest
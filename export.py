@@ -0,0 +1,140 @@
+"""Xuất lịch sử của user thành file ZIP (các file âm thanh + manifest JSON/CSV).
+
+ZIP được sinh dần theo từng khối bởi iter_zip() từ các file trên đĩa, không giữ cả
+archive trong bộ nhớ: có thể ghi ra file (write_zip) hoặc trả thẳng về HTTP theo chunk.
+UI không tự đóng gói: nút tải là link ký sẵn (link_token) tới GET /v1/history/export của api.py.
+"""
+import base64
+import csv
+import hashlib
+import hmac
+import io
+import json
+import os
+import time
+import uuid
+import zipfile
+from pathlib import Path
+
+from settings import EXPORT_LINK_TTL
+
+CHUNK_SIZE = 1024 * 1024
+MANIFEST_FIELDS = ["file", "id", "text", "lang", "created_at"]
+MANIFEST_FORMATS = ("json", "csv")
+
+
+class _Pipe(io.RawIOBase):
+    """Đích ghi không seek được cho ZipFile; drain() lấy ra phần đã ghi từ lần trước."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _arcname(item: dict) -> str:
+    created_at = item["created_at"]
+    stamp = created_at.strftime("%Y%m%d-%H%M%S") if hasattr(created_at, "strftime") else str(created_at)[:19]
+    return f"audio/{stamp}_{item['id'][:8]}{Path(item['output_path']).suffix}"
+
+
+def _manifest_bytes(rows: list, fmt: str) -> bytes:
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=MANIFEST_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+        # BOM để Excel nhận đúng UTF-8 (tiếng Việt)
+        return ("﻿" + buf.getvalue()).encode("utf-8")
+    return json.dumps(rows, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def iter_zip(items, manifest_format: str = "json"):
+    """Sinh các khối bytes của file ZIP chứa audio của items và manifest.{json,csv}.
+
+    items: các dict lịch sử (id, text, lang, created_at, output_path), vd. từ db.load_history().
+    Audio đã nén (Opus/MP3/FLAC) nên được lưu nguyên (ZIP_STORED); file không còn trên đĩa
+    vẫn có trong manifest với file rỗng.
+    """
+    pipe = _Pipe()
+    rows = []
+    with zipfile.ZipFile(pipe, "w", compression=zipfile.ZIP_STORED) as zf:
+        for item in items:
+            path = Path(item.get("output_path") or "")
+            row = {
+                "file": "",
+                "id": item["id"],
+                "text": item["text"],
+                "lang": item["lang"],
+                "created_at": str(item["created_at"]),
+            }
+            if path.is_file():
+                row["file"] = _arcname(item)
+                info = zipfile.ZipInfo.from_file(path, row["file"])
+                with open(path, "rb") as src, zf.open(info, "w") as dst:
+                    while True:
+                        chunk = src.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        yield pipe.drain()
+            rows.append(row)
+            yield pipe.drain()
+        zf.writestr(f"manifest.{manifest_format}", _manifest_bytes(rows, manifest_format),
+                    compress_type=zipfile.ZIP_DEFLATED)
+    yield pipe.drain()
+
+
+def write_zip(items, dst, manifest_format: str = "json") -> Path:
+    """Ghi ZIP (iter_zip) ra file dst (qua file tạm rồi rename). Trả về dst."""
+    dst = Path(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(f".{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            for chunk in iter_zip(items, manifest_format):
+                if chunk:
+                    f.write(chunk)
+        os.replace(tmp, dst)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return dst
+
+
+def _sign(secret: str, payload: str) -> str:
+    return hmac.new(secret.encode("utf-8"), payload.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def link_token(username: str, secret: str, ttl: float = EXPORT_LINK_TTL) -> str:
+    """Mã cho phép tải ZIP lịch sử của username qua API mà không cần HTTP Basic, hết hạn sau ttl giây.
+
+    secret là khoá cookie đăng nhập trong config.yaml (app.py và api.py cùng đọc).
+    """
+    user = base64.urlsafe_b64encode(username.encode("utf-8")).decode("ascii").rstrip("=")
+    payload = f"{user}.{int(time.time() + ttl)}"
+    return f"{payload}.{_sign(secret, payload)}"
+
+
+def verify_link_token(token: str, secret: str):
+    """Username trong mã của link_token(); None nếu mã sai chữ ký hoặc đã hết hạn."""
+    user, _, rest = token.partition(".")
+    expires, _, signature = rest.partition(".")
+    if not hmac.compare_digest(_sign(secret, f"{user}.{expires}"), signature):
+        return None
+    if not expires.isdigit() or int(expires) < time.time():
+        return None
+    try:
+        return base64.urlsafe_b64decode(user + "=" * (-len(user) % 4)).decode("utf-8")
+    except (ValueError, UnicodeDecodeError):
+        return None
@@ -0,0 +1,117 @@
+"""Chế độ "CPU nhanh" cho XTTS: lượng tử hoá động int8 cho GPT và tối ưu bộ giải mã HiFi-GAN.
+
+Dùng qua synthesis.get_tts(device="cpu", precision="int8"). Kiểm tra chất lượng so với fp32:
+
+    python fast_cpu.py --voice mau_giong.wav --text "Xin chào." --lang vi
+"""
+import argparse
+
+import numpy as np
+
+from settings import FAST_CPU_COMPILE
+
+
+def _conv1d_to_linear(module) -> int:
+    """Thay các lớp transformers Conv1D (GPT-2) bằng nn.Linear tương đương để quantize_dynamic nhận ra.
+
+    Conv1D lưu weight dạng (in, out), nn.Linear dạng (out, in). Trả về số lớp đã thay.
+    """
+    import torch
+    from transformers.pytorch_utils import Conv1D
+
+    replaced = 0
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            in_features, out_features = child.weight.shape
+            linear = torch.nn.Linear(in_features, out_features, bias=child.bias is not None)
+            linear.weight.data.copy_(child.weight.data.t())
+            if child.bias is not None:
+                linear.bias.data.copy_(child.bias.data)
+            setattr(module, name, linear)
+            replaced += 1
+        else:
+            replaced += _conv1d_to_linear(child)
+    return replaced
+
+
+def quantize_gpt(xtts) -> None:
+    """Lượng tử hoá động int8 mọi lớp Linear của GPT (trọng số int8, activation lượng tử hoá lúc chạy)."""
+    import torch
+
+    _conv1d_to_linear(xtts.gpt)
+    torch.ao.quantization.quantize_dynamic(xtts.gpt, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def optimize_decoder(xtts, compile_decoder: bool = False) -> None:
+    """Bỏ weight norm của HiFi-GAN (tính sẵn trọng số) và tuỳ chọn torch.compile bộ giải mã."""
+    decoder = xtts.hifigan_decoder.waveform_decoder
+    try:
+        decoder.remove_weight_norm()
+    except Exception as err:
+        # đã bỏ rồi hoặc phiên bản TTS khác
+        print(f"Bỏ qua remove_weight_norm: {err}")
+    if compile_decoder:
+        import torch
+
+        xtts.hifigan_decoder.waveform_decoder = torch.compile(decoder, dynamic=True)
+
+
+def optimize(tts, compile_decoder: bool = FAST_CPU_COMPILE):
+    """Áp dụng chế độ CPU nhanh lên model TTS (đã ở trên CPU), sửa tại chỗ và trả về chính nó."""
+    xtts = tts.synthesizer.tts_model
+    xtts.eval()
+    quantize_gpt(xtts)
+    optimize_decoder(xtts, compile_decoder=compile_decoder)
+    return tts
+
+
+def _mean_log_mel(wav: np.ndarray, n_fft: int = 1024, hop: int = 256, n_bands: int = 64) -> np.ndarray:
+    """Phổ log trung bình theo thời gian, gom thành n_bands dải (không phụ thuộc căn chỉnh thời gian)."""
+    if len(wav) < n_fft:
+        wav = np.pad(wav, (0, n_fft - len(wav)))
+    frames = np.lib.stride_tricks.sliding_window_view(wav, n_fft)[::hop] * np.hanning(n_fft)
+    power = np.abs(np.fft.rfft(frames, axis=1)) ** 2
+    bands = np.array_split(power, n_bands, axis=1)
+    spec = np.stack([b.mean(axis=1) for b in bands], axis=1)
+    return np.log10(spec + 1e-10).mean(axis=0)
+
+
+def quality_check(reference_tts, fast_tts, text: str, speaker_wav: str, language: str,
+                  max_duration_ratio: float = 0.15, max_spectral_distance: float = 0.35) -> dict:
+    """So sánh đầu ra chế độ nhanh với fp32 (giải mã greedy để hai bên cùng điều kiện).
+
+    Kiểm tra độ lệch thời lượng và khoảng cách phổ log trung bình (dB/10).
+    """
+    import torch
+    import synthesis
+
+    latents = synthesis.get_conditioning_latents(reference_tts, speaker_wav)
+    outputs = []
+    for tts in (reference_tts, fast_tts):
+        torch.manual_seed(0)
+        settings = dict(synthesis._inference_settings(tts), do_sample=False)
+        out = tts.synthesizer.tts_model.inference(text, language, *latents, **settings)
+        outputs.append(np.asarray(out["wav"], dtype=np.float32).reshape(-1))
+
+    ref, fast = outputs
+    duration_ratio = abs(len(fast) - len(ref)) / max(len(ref), 1)
+    spectral_distance = float(np.abs(_mean_log_mel(ref) - _mean_log_mel(fast)).mean())
+    return {
+        "duration_ratio": duration_ratio,
+        "spectral_distance": spectral_distance,
+        "passed": duration_ratio <= max_duration_ratio and spectral_distance <= max_spectral_distance,
+    }
+
+
+if __name__ == "__main__":
+    import synthesis
+
+    parser = argparse.ArgumentParser(description="So sánh chất lượng chế độ CPU nhanh (int8) với fp32.")
+    parser.add_argument("--voice", required=True, help="file mẫu giọng")
+    parser.add_argument("--text", default="Xin chào, đây là giọng nói được clone bằng XTTS v2.")
+    parser.add_argument("--lang", default="vi")
+    args = parser.parse_args()
+
+    result = quality_check(synthesis.get_tts("cpu", "fp32"), synthesis.get_tts("cpu", "int8"),
+                           args.text, args.voice, args.lang)
+    print(result)
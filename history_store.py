@@ -0,0 +1,30 @@
+from pathlib import Path
+
+import audio_formats
+import database as db
+import segments
+
+
+def delete_items(username: str, item_ids: list) -> int:
+    """Xoá nhiều mục lịch sử của user (db.delete_history_items) rồi xoá các file không còn dùng.
+
+    Với mỗi file kết quả không còn mục nào dùng chung: xoá file, các bản chuyển định dạng
+    đã cache khi tải về và manifest phân đoạn. Trả về số mục đã xoá.
+    """
+    deleted, orphan_outputs, voice_paths = db.delete_history_items(username, item_ids)
+    files_to_delete = list(voice_paths)
+    for output_path in orphan_outputs:
+        files_to_delete.append(output_path)
+        files_to_delete += audio_formats.all_variants(output_path)
+        files_to_delete.append(segments.manifest_path(output_path))
+    for fp in files_to_delete:
+        try:
+            Path(fp).unlink(missing_ok=True)
+        except OSError:
+            pass
+    return deleted
+
+
+def delete_item(username: str, item_id: str) -> bool:
+    """Xoá một mục lịch sử của user cùng file không còn dùng."""
+    return delete_items(username, [item_id]) == 1
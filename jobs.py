@@ -0,0 +1,196 @@
+import json
+import threading
+import time
+import traceback
+import uuid
+
+import audio_formats
+import database as db
+import documents
+import metrics
+import segments
+import synthesis
+import voice_store
+from settings import (
+    JOB_POLL_INTERVAL,
+    JOB_STALE_SECONDS,
+    JOB_WORKER_THREADS,
+    OUTPUT_DIR,
+    PRELOAD_DEVICES,
+    SEGMENT_PRUNE_INTERVAL,
+)
+
+
+class JobLost(Exception):
+    """Job đã bị requeue_stale_jobs đưa về hàng đợi và có thể đang chạy ở worker khác."""
+
+
+def run_job(job: dict) -> None:
+    """Chạy một job đã nhận: tổng hợp (hoặc lấy từ cache kết quả), ghi lịch sử, cập nhật trạng thái.
+
+    Mọi cập nhật đi kèm claim_token của lần nhận job: nếu job đã được giao lại cho worker khác
+    thì worker này bỏ kết quả, không ghi lịch sử và không bỏ tham chiếu mẫu giọng lần nữa.
+    """
+    job_id = job["id"]
+    token = job["claim_token"]
+    voice_id = job["voice_id"]
+    device = job.get("device") or "auto"
+    timer = metrics.RequestTimer(job["lang"], synthesis.resolve_device(device))
+    owned = True
+    try:
+        with timer.activate():
+            history_id, out_path = _run_job(job, timer)
+        owned = db.update_job(job_id, token, status="done", progress=1.0, output_path=str(out_path),
+                              history_id=history_id)
+    except JobLost:
+        owned = False
+    except Exception as e:
+        traceback.print_exc()
+        owned = db.update_job(job_id, token, status="failed", error=str(e))
+    finally:
+        if owned:
+            # tham chiếu của job tới mẫu giọng đã được chuyển sang mục lịch sử (hoặc job lỗi)
+            db.release_voice(voice_id)
+        else:
+            print(f"Lỗi khi chạy job {job_id}: job đã được giao lại cho worker khác, bỏ kết quả.")
+
+
+def _keep_claim(job: dict, **fields) -> None:
+    """Cập nhật job (cũng làm mới updated_at); JobLost nếu job không còn thuộc lần nhận này."""
+    if not db.update_job(job["id"], job["claim_token"], **fields):
+        raise JobLost(job["id"])
+
+
+def _cached_or_synthesize(job: dict, cache_key: str, voice_path, precision: str, post: dict):
+    """Kết quả trong cache hoặc tổng hợp mới (rồi ghi cache). Trả về (file kết quả, giây audio mới, chương)."""
+    voice_id = job["voice_id"]
+    out_path = db.get_cached_result(cache_key)
+    audio_seconds = 0.0
+    chapters = None
+    if out_path:
+        manifest = segments.read_manifest(out_path) or {}
+        chapters = manifest.get("chapters")
+    else:
+        out_path = OUTPUT_DIR / f"xtts_output_{uuid.uuid4().hex}.wav"
+
+        def on_progress(done, total):
+            _keep_claim(job, progress=done / total)
+
+        if job.get("mode") == "document":
+            # tài liệu dài: các đoạn chạy song song trong pool process CPU, có checkpoint để chạy tiếp;
+            # các giai đoạn do process con đo và báo về (documents._add_worker_stages)
+            manifest = documents.synthesize_document(
+                job["text"],
+                speaker_wav=str(voice_path),
+                language=job["lang"],
+                voice_id=voice_id,
+                file_path=str(out_path),
+                precision=precision,
+                progress_callback=on_progress,
+            )
+            chapters = manifest["chapters"]
+        else:
+            # các câu đã tổng hợp trước đó (vd. khi "Sửa" một chữ) được dùng lại từ segments
+            manifest = segments.synthesize_to_file(
+                synthesis.get_tts(job.get("device") or "auto", precision),
+                text=job["text"],
+                speaker_wav=str(voice_path),
+                language=job["lang"],
+                voice_id=voice_id,
+                file_path=str(out_path),
+                precision=precision,
+                progress_callback=on_progress,
+                post=post,
+            )
+        # bản lưu chính thức ở định dạng nén người dùng chọn
+        with metrics.span("wav_write"):
+            out_path = audio_formats.finalize_output(out_path, job.get("output_format") or "wav")
+        db.put_cached_result(cache_key, str(out_path))
+        audio_seconds = manifest["audio_seconds"]
+    return out_path, audio_seconds, chapters
+
+
+def _run_job(job: dict, timer: metrics.RequestTimer):
+    """Phần chính của run_job, chạy khi timer đang hoạt động. Trả về (history_id, đường dẫn kết quả)."""
+    voice_id = job["voice_id"]
+    voice_path = voice_store.voice_path(voice_id)
+    if not voice_path:
+        raise FileNotFoundError("Mẫu giọng đã bị xoá.")
+
+    precision = job.get("precision") or "fp32"
+    post = json.loads(job["postprocess"]) if job.get("postprocess") else None
+    if job.get("mode") == "document":
+        cache_key = documents.document_key(job["text"], job["lang"], voice_id, precision)
+        # job trùng (gửi hai lần, job bị requeue trong lúc job cũ vẫn chạy) chờ job kia xong
+        # rồi lấy kết quả của nó từ cache, không ghi chồng vào cùng thư mục checkpoint
+        with documents.document_lock(cache_key):
+            out_path, audio_seconds, chapters = _cached_or_synthesize(job, cache_key, voice_path, precision, post)
+    else:
+        cache_key = synthesis.result_cache_key(job["text"], job["lang"], voice_id, precision, post)
+        out_path, audio_seconds, chapters = _cached_or_synthesize(job, cache_key, voice_path, precision, post)
+
+    timer.finish(audio_seconds)
+    # job bị requeue trong lúc tổng hợp thì mục lịch sử là việc của worker đang giữ job
+    _keep_claim(job)
+    with metrics.observe("db_insert", job["lang"]):
+        history_id = db.add_history_item(
+            username=job["username"],
+            text=job["text"],
+            lang=job["lang"],
+            voice_id=voice_id,
+            output_path=str(out_path),
+            metrics=timer.to_dict(),
+            chapters=chapters,
+        )
+    return history_id, out_path
+
+
+class JobWorker:
+    """Nhóm luồng nền lấy job từ bảng jobs và tổng hợp bằng model dùng chung của process."""
+
+    def __init__(self, num_threads: int = JOB_WORKER_THREADS, poll_interval: float = JOB_POLL_INTERVAL):
+        self.num_threads = num_threads
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        db.requeue_stale_jobs(JOB_STALE_SECONDS)
+        for i in range(self.num_threads):
+            t = threading.Thread(target=self._loop, name=f"xtts-job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        last_prune = 0.0
+        while not self._stop.is_set():
+            job = db.claim_next_job()
+            if job is None:
+                # lúc rảnh thì dọn bớt các đoạn audio theo câu lâu không dùng, mẫu giọng bỏ dở và job cũ
+                if time.monotonic() - last_prune > SEGMENT_PRUNE_INTERVAL:
+                    segments.prune()
+                    voice_store.prune()
+                    db.prune_finished_jobs()
+                    last_prune = time.monotonic()
+                self._stop.wait(self.poll_interval)
+                continue
+            run_job(job)
+
+
+if __name__ == "__main__":
+    # Chạy worker riêng (ngoài Streamlit): python jobs.py
+    print("Đang chạy worker tổng hợp, Ctrl+C để dừng...")
+    db.init_db()
+    for device in PRELOAD_DEVICES:
+        synthesis.preload(device, background=False)
+    worker = JobWorker().start()
+    try:
+        while True:
+            time.sleep(60)
+            db.requeue_stale_jobs(JOB_STALE_SECONDS)
+    except KeyboardInterrupt:
+        worker.stop()
@@ -0,0 +1,79 @@
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+
+class LatentCache:
+    """Cache 2 tầng (LRU trong bộ nhớ + file trên đĩa) cho conditioning latents của XTTS.
+
+    Khoá là SHA-256 của audio mẫu đã giải mã cùng các tham số conditioning,
+    nên cùng một giọng tải lên nhiều lần (khác tên file) vẫn dùng chung latent.
+    """
+
+    def __init__(self, cache_dir, max_items: int = 32):
+        self.cache_dir = Path(cache_dir)
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(audio, settings: dict) -> str:
+        """Tạo khoá cache từ waveform đã giải mã (float32, hoặc int16 của ref_audio) và tham số conditioning."""
+        h = hashlib.sha256()
+        # băm thẳng buffer (vd. memory-map int16), không chép sang float32
+        h.update(np.ascontiguousarray(audio).data)
+        h.update(repr(sorted(settings.items())).encode("utf-8"))
+        return h.hexdigest()
+
+    def _disk_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.pt"
+
+    def get(self, key: str):
+        """Trả về (gpt_cond_latent, speaker_embedding) trên CPU, hoặc None nếu chưa có."""
+        with self._lock:
+            latents = self._items.get(key)
+            if latents is not None:
+                self._items.move_to_end(key)
+                return latents
+
+        path = self._disk_path(key)
+        if not path.exists():
+            return None
+        try:
+            import torch
+
+            data = torch.load(path, map_location="cpu")
+            latents = (data["gpt_cond_latent"], data["speaker_embedding"])
+        except Exception as err:
+            print(f"Lỗi khi đọc latent cache {path.name}: {err}")
+            return None
+        self._remember(key, latents)
+        return latents
+
+    def put(self, key: str, latents) -> None:
+        """Lưu latent vào bộ nhớ và ghi ra đĩa (ghi file tạm rồi rename)."""
+        gpt_cond_latent, speaker_embedding = latents
+        latents = (gpt_cond_latent.detach().cpu(), speaker_embedding.detach().cpu())
+        self._remember(key, latents)
+        try:
+            import torch
+
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            path = self._disk_path(key)
+            tmp_path = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+            torch.save({"gpt_cond_latent": latents[0], "speaker_embedding": latents[1]}, tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as err:
+            print(f"Lỗi khi ghi latent cache: {err}")
+
+    def _remember(self, key: str, latents) -> None:
+        with self._lock:
+            self._items[key] = latents
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
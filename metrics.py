@@ -0,0 +1,237 @@
+"""Đo thời gian từng giai đoạn của một yêu cầu tổng hợp và xuất thống kê (p50/p95/p99).
+
+    timer = metrics.RequestTimer(lang="vi", device="cpu")
+    with timer.activate():
+        with metrics.span("latents"):
+            ...
+    timer.finish(audio_seconds)   # ghi vào registry của process
+    timer.to_dict()               # lưu kèm mục lịch sử
+
+Các hàm trong synthesis.py gọi metrics.span(...) nên tự được đo khi có timer đang hoạt động.
+"""
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+STAGES = (
+    "upload_write",
+    "model_load",
+    "latents",
+    "queue_wait",
+    "gpt_decode",
+    "vocoder",
+    "postprocess",
+    "wav_write",
+    "db_insert",
+    "playback_read",
+)
+# đo ở process web hoặc sau khi mục lịch sử đã được ghi nên không nằm trong history.metrics;
+# chỉ có trong registry (dùng observe() thay vì span())
+UNPERSISTED_STAGES = ("upload_write", "db_insert", "playback_read")
+QUANTILES = (0.5, 0.95, 0.99)
+
+_local = threading.local()
+
+
+class RequestTimer:
+    """Cộng dồn thời gian (giây) theo giai đoạn cho một yêu cầu."""
+
+    def __init__(self, lang: str = "", device: str = ""):
+        self.lang = lang
+        self.device = device
+        self.stages = {}
+        self.audio_seconds = 0.0
+        self._started = time.perf_counter()
+        self.total = None
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def span(self, stage: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - t0)
+
+    @contextmanager
+    def activate(self):
+        """Đặt timer này làm timer hiện tại của luồng để metrics.span() ghi vào."""
+        previous = getattr(_local, "timer", None)
+        _local.timer = self
+        try:
+            yield self
+        finally:
+            _local.timer = previous
+
+    def finish(self, audio_seconds: float = 0.0) -> None:
+        """Chốt tổng thời gian và đưa các giai đoạn vào registry của process."""
+        self.audio_seconds = audio_seconds
+        self.total = time.perf_counter() - self._started
+        for stage, seconds in self.stages.items():
+            registry.observe(stage, self.lang, seconds)
+        registry.observe("total", self.lang, self.total)
+
+    def to_dict(self) -> dict:
+        total = self.total if self.total is not None else time.perf_counter() - self._started
+        return {
+            "device": self.device,
+            "duration": round(total, 4),
+            "audio_seconds": round(self.audio_seconds, 3),
+            "rtf": round(total / self.audio_seconds, 4) if self.audio_seconds else None,
+            "stages": {k: round(v, 4) for k, v in self.stages.items()},
+        }
+
+
+def current():
+    return getattr(_local, "timer", None)
+
+
+@contextmanager
+def span(stage: str):
+    """Đo một giai đoạn vào timer hiện tại của luồng (không làm gì nếu không có)."""
+    timer = current()
+    if timer is None:
+        yield
+        return
+    with timer.span(stage):
+        yield
+
+
+def add_overlap(timer: RequestTimer, start: float, end: float, phases) -> None:
+    """Chia khoảng [start, end] (perf_counter) vào các giai đoạn theo phần giao với từng (stage, bắt đầu, kết thúc).
+
+    Dùng khi một luồng khác làm việc (vd. luồng batching): bên chờ chỉ tính phần thời gian nó thực sự chờ,
+    nên các câu cùng batch không bị cộng trùng.
+    """
+    for stage, phase_start, phase_end in phases:
+        seconds = min(end, phase_end) - max(start, phase_start)
+        if seconds > 0:
+            timer.add(stage, seconds)
+
+
+@contextmanager
+def observe(stage: str, lang: str = ""):
+    """Đo một giai đoạn và ghi thẳng vào registry (không gắn với yêu cầu nào)."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(stage, lang, time.perf_counter() - t0)
+
+
+def install_vocoder_hooks(xtts) -> None:
+    """Tách thời gian HiFi-GAN khỏi thời gian giải mã GPT bằng forward hook trên hifigan_decoder.
+
+    Khi đo cả xtts.inference/inference_stream là gpt_decode, phần vocoder được chuyển sang giai đoạn
+    riêng (batching._infer_one dùng nó để biết lúc bắt đầu vocoder).
+    """
+    def pre_hook(module, args):
+        _local.vocoder_started = time.perf_counter()
+
+    def post_hook(module, args, output):
+        timer = current()
+        started = getattr(_local, "vocoder_started", None)
+        if timer is None or started is None:
+            return
+        dt = time.perf_counter() - started
+        timer.add("vocoder", dt)
+        timer.add("gpt_decode", -dt)
+
+    xtts.hifigan_decoder.register_forward_pre_hook(pre_hook)
+    xtts.hifigan_decoder.register_forward_hook(post_hook)
+
+
+class Registry:
+    """Các quan sát gần nhất theo (giai đoạn, ngôn ngữ), giữ tối đa max_samples mỗi nhóm."""
+
+    def __init__(self, max_samples: int = 2000):
+        self._samples = defaultdict(lambda: deque(maxlen=max_samples))
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, lang: str, seconds: float) -> None:
+        with self._lock:
+            self._samples[(stage, lang or "")].append(seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {k: list(v) for k, v in self._samples.items()}
+
+
+registry = Registry()
+
+
+def quantile(values, q: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    idx = min(len(values) - 1, max(0, round(q * (len(values) - 1))))
+    return values[idx]
+
+
+def samples_from_history(rows) -> dict:
+    """Gom metrics đã lưu trong các mục lịch sử thành {(giai đoạn, ngôn ngữ): [giây, ...]}."""
+    samples = defaultdict(list)
+    for row in rows:
+        m = row["metrics"]
+        for stage, seconds in m.get("stages", {}).items():
+            samples[(stage, row["lang"] or "")].append(seconds)
+        samples[("total", row["lang"] or "")].append(m.get("duration", 0.0))
+        if m.get("rtf") is not None:
+            samples[("rtf", row["lang"] or "")].append(m["rtf"])
+    return samples
+
+
+def summarize(samples: dict) -> list:
+    """[{stage, lang, count, p50, p95, p99}] sắp theo giai đoạn rồi ngôn ngữ."""
+    order = {s: i for i, s in enumerate(STAGES + ("total", "rtf"))}
+    rows = []
+    for (stage, lang), values in samples.items():
+        row = {"stage": stage, "lang": lang, "count": len(values)}
+        for q in QUANTILES:
+            row[f"p{int(q * 100)}"] = round(quantile(values, q), 4)
+        rows.append(row)
+    rows.sort(key=lambda r: (order.get(r["stage"], len(order)), r["lang"]))
+    return rows
+
+
+def prometheus_text(samples: dict) -> str:
+    """Xuất dạng text của Prometheus (summary với nhãn quantile, stage, lang)."""
+    lines = [
+        "# HELP tts_stage_seconds Thời gian từng giai đoạn của yêu cầu tổng hợp.",
+        "# TYPE tts_stage_seconds summary",
+    ]
+    for (stage, lang), values in sorted(samples.items()):
+        if stage == "rtf":
+            continue
+        labels = f'stage="{stage}",lang="{lang}"'
+        for q in QUANTILES:
+            lines.append(f'tts_stage_seconds{{{labels},quantile="{q}"}} {quantile(values, q):.6f}')
+        lines.append(f"tts_stage_seconds_sum{{{labels}}} {sum(values):.6f}")
+        lines.append(f"tts_stage_seconds_count{{{labels}}} {len(values)}")
+    lines += [
+        "# HELP tts_real_time_factor Thời gian tổng hợp / độ dài audio.",
+        "# TYPE tts_real_time_factor summary",
+    ]
+    for (stage, lang), values in sorted(samples.items()):
+        if stage != "rtf":
+            continue
+        for q in QUANTILES:
+            lines.append(f'tts_real_time_factor{{lang="{lang}",quantile="{q}"}} {quantile(values, q):.6f}')
+        lines.append(f'tts_real_time_factor_count{{lang="{lang}"}} {len(values)}')
+    return "\n".join(lines) + "\n"
+
+
+def collect(history_rows) -> dict:
+    """Số liệu cho trang thống kê / export.
+
+    Các giai đoạn đã lưu kèm lịch sử lấy từ DB (gồm cả worker ở process khác);
+    các giai đoạn xảy ra sau khi ghi lịch sử chỉ có trong registry của process này.
+    """
+    samples = samples_from_history(history_rows)
+    for (stage, lang), values in registry.snapshot().items():
+        if stage in UNPERSISTED_STAGES:
+            samples[(stage, lang)].extend(values)
+    return samples
@@ -0,0 +1,461 @@
+"""Migration schema có đánh số phiên bản (MySQL và SQLite có danh sách riêng).
+
+Mỗi migration chạy đúng một lần cho mỗi database; phiên bản đã áp dụng được ghi
+trong bảng schema_version. database.init_db() gọi migrate() một lần mỗi process,
+khi deploy có thể chạy trước: python migrations.py
+"""
+import datetime
+
+import database as db
+
+# tránh hai process cùng migrate một lúc
+LOCK_NAME = "tts_schema_migration"
+LOCK_TIMEOUT = 60
+
+
+def _column_type(cursor, table: str, column: str):
+    cursor.execute(
+        "SELECT DATA_TYPE FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+        (table, column),
+    )
+    row = cursor.fetchone()
+    return row[0].lower() if row else None
+
+
+def _index_names(cursor, table: str) -> dict:
+    """{tên index: (non_unique, [các cột theo thứ tự])}"""
+    cursor.execute(
+        "SELECT INDEX_NAME, NON_UNIQUE, COLUMN_NAME FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ORDER BY INDEX_NAME, SEQ_IN_INDEX",
+        (table,),
+    )
+    indexes = {}
+    for name, non_unique, column in cursor.fetchall():
+        indexes.setdefault(name, (int(non_unique), []))[1].append(column)
+    return indexes
+
+
+def _v1_baseline(cursor):
+    """Các bảng như init_db() trước đây tạo (an toàn với database đã có sẵn)."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS history (
+        id VARCHAR(36) PRIMARY KEY,
+        username VARCHAR(255) NOT NULL,
+        text TEXT,
+        lang VARCHAR(10),
+        voice_path TEXT,
+        voice_id VARCHAR(64),
+        output_path TEXT,
+        created_at VARCHAR(50),
+        INDEX(username)
+    )
+    """)
+    # bảng cũ chưa có cột voice_id
+    try:
+        cursor.execute("ALTER TABLE history ADD COLUMN voice_id VARCHAR(64)")
+    except db.DBError:
+        pass
+    # kho mẫu giọng theo nội dung: id = SHA-256 của file, ref_count = số mục lịch sử dùng nó
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS voices (
+        id VARCHAR(64) PRIMARY KEY,
+        path TEXT NOT NULL,
+        ext VARCHAR(10),
+        size_bytes BIGINT,
+        ref_count INT NOT NULL DEFAULT 0,
+        created_at VARCHAR(50)
+    )
+    """)
+    # cache kết quả tổng hợp: cùng (văn bản chuẩn hoá, lang, giọng, model) -> dùng lại file WAV
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS synthesis_cache (
+        cache_key VARCHAR(64) PRIMARY KEY,
+        output_path TEXT NOT NULL,
+        hits INT NOT NULL DEFAULT 0,
+        created_at VARCHAR(50)
+    )
+    """)
+    # hàng đợi tổng hợp chạy nền (xem jobs.py)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        id VARCHAR(36) PRIMARY KEY,
+        username VARCHAR(255) NOT NULL,
+        text TEXT,
+        lang VARCHAR(10),
+        voice_id VARCHAR(64),
+        output_format VARCHAR(10) NOT NULL DEFAULT 'wav',
+        status VARCHAR(16) NOT NULL DEFAULT 'queued',
+        progress FLOAT NOT NULL DEFAULT 0,
+        error TEXT,
+        output_path TEXT,
+        history_id VARCHAR(36),
+        claim_token VARCHAR(36),
+        created_at VARCHAR(50),
+        updated_at VARCHAR(50),
+        INDEX(status, created_at),
+        INDEX(username, status)
+    )
+    """)
+    # bảng jobs cũ chưa có cột output_format
+    try:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN output_format VARCHAR(10) NOT NULL DEFAULT 'wav'")
+    except db.DBError:
+        pass
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id VARCHAR(36) PRIMARY KEY,
+        username VARCHAR(255) NOT NULL UNIQUE,
+        password VARCHAR(255) NOT NULL,
+        first_name VARCHAR(255),
+        last_name VARCHAR(255),
+        email VARCHAR(255),
+        created_at VARCHAR(50),
+        INDEX(username)
+    )
+    """)
+
+
+def _v2_history_created_at_datetime(cursor):
+    """history.created_at: VARCHAR (ISO 8601) -> DATETIME."""
+    created_at_type = _column_type(cursor, "history", "created_at")
+    if created_at_type == "datetime":
+        return
+    if created_at_type is not None:
+        if _column_type(cursor, "history", "created_at_dt") is None:
+            cursor.execute("ALTER TABLE history ADD COLUMN created_at_dt DATETIME NULL")
+        cursor.execute(
+            "UPDATE history SET created_at_dt = STR_TO_DATE(LEFT(created_at, 19), '%Y-%m-%dT%H:%i:%s') "
+            "WHERE created_at_dt IS NULL "
+            "AND created_at REGEXP '^[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}'"
+        )
+        # giá trị không đọc được -> thời điểm migrate, để cột có thể NOT NULL
+        cursor.execute("UPDATE history SET created_at_dt = NOW() WHERE created_at_dt IS NULL")
+        cursor.execute("ALTER TABLE history DROP COLUMN created_at")
+    cursor.execute("ALTER TABLE history CHANGE COLUMN created_at_dt created_at DATETIME NOT NULL")
+
+
+def _v3_history_indexes(cursor):
+    """Index (username, created_at) cho lịch sử; bỏ index trùng trên username."""
+    indexes = _index_names(cursor, "history")
+    if "idx_history_user_created" not in indexes:
+        cursor.execute("ALTER TABLE history ADD INDEX idx_history_user_created (username, created_at)")
+    # INDEX(username) cũ đã nằm trong phần đầu của index mới
+    for name, (non_unique, columns) in indexes.items():
+        if non_unique and columns == ["username"]:
+            cursor.execute(f"ALTER TABLE history DROP INDEX `{name}`")
+
+    # users.username có cả UNIQUE lẫn INDEX(username) -> chỉ giữ UNIQUE
+    for name, (non_unique, columns) in _index_names(cursor, "users").items():
+        if non_unique and columns == ["username"]:
+            cursor.execute(f"ALTER TABLE users DROP INDEX `{name}`")
+
+
+def _v4_jobs_device(cursor):
+    """Thiết bị (auto/cuda/cpu) người dùng chọn cho từng job."""
+    if _column_type(cursor, "jobs", "device") is None:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN device VARCHAR(10) NOT NULL DEFAULT 'auto'")
+
+
+def _v5_jobs_precision(cursor):
+    """Chế độ suy luận của job: fp32 hoặc int8 (CPU nhanh)."""
+    if _column_type(cursor, "jobs", "precision") is None:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN `precision` VARCHAR(10) NOT NULL DEFAULT 'fp32'")
+
+
+def _v6_history_metrics(cursor):
+    """Thời gian từng giai đoạn của yêu cầu (JSON) để tính thống kê độ trễ."""
+    if _column_type(cursor, "history", "metrics") is None:
+        cursor.execute("ALTER TABLE history ADD COLUMN metrics TEXT NULL")
+
+
+def _v7_history_fulltext(cursor):
+    """Index FULLTEXT trên history.text cho tìm kiếm lịch sử (db.search_history).
+
+    Với tiếng Việt nên đặt innodb_ft_min_token_size = 1 trên server (mặc định 3 bỏ qua
+    các từ 1-2 ký tự); đổi tham số này thì cần tạo lại index.
+    """
+    if "ft_history_text" not in _index_names(cursor, "history"):
+        cursor.execute("ALTER TABLE history ADD FULLTEXT INDEX ft_history_text (text)")
+
+
+def _v8_documents(cursor):
+    """Tài liệu dài (documents.py): jobs.mode, history.chapters và cột text đủ chứa cả tài liệu."""
+    if _column_type(cursor, "jobs", "mode") is None:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN mode VARCHAR(16) NOT NULL DEFAULT 'text'")
+    if _column_type(cursor, "history", "chapters") is None:
+        cursor.execute("ALTER TABLE history ADD COLUMN chapters TEXT NULL")
+    # TEXT chỉ tới 64 KB, một tài liệu vài chục trang vượt quá
+    if _column_type(cursor, "jobs", "text") == "text":
+        cursor.execute("ALTER TABLE jobs MODIFY COLUMN text MEDIUMTEXT")
+    if _column_type(cursor, "history", "text") == "text":
+        cursor.execute("ALTER TABLE history MODIFY COLUMN text MEDIUMTEXT")
+
+
+def _v9_jobs_postprocess(cursor):
+    """Tuỳ chọn hậu kỳ của job (JSON, postprocess.py)."""
+    if _column_type(cursor, "jobs", "postprocess") is None:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN postprocess TEXT NULL")
+
+
+def _v10_voices_last_used(cursor):
+    """voices.last_used_at: mẫu giọng ref_count = 0 chỉ bị dọn sau một khoảng chờ (db.prune_unused_voices)."""
+    if _column_type(cursor, "voices", "last_used_at") is None:
+        cursor.execute("ALTER TABLE voices ADD COLUMN last_used_at VARCHAR(50)")
+        cursor.execute("UPDATE voices SET last_used_at = created_at")
+    if "idx_voices_unused" not in _index_names(cursor, "voices"):
+        cursor.execute("ALTER TABLE voices ADD INDEX idx_voices_unused (ref_count, last_used_at)")
+
+
+def _v11_output_path_indexes(cursor):
+    """Index trên output_path (history, synthesis_cache) để xoá lịch sử không quét cả bảng."""
+    # đường dẫn file kết quả khác nhau ngay ở tên file (uuid), 255 ký tự đầu là đủ phân biệt
+    if "idx_history_output" not in _index_names(cursor, "history"):
+        cursor.execute("ALTER TABLE history ADD INDEX idx_history_output (output_path(255))")
+    if "idx_cache_output" not in _index_names(cursor, "synthesis_cache"):
+        cursor.execute("ALTER TABLE synthesis_cache ADD INDEX idx_cache_output (output_path(255))")
+
+
+def _v12_history_created_index(cursor):
+    """Index history.created_at cho các truy vấn trên mọi user (db.load_recent_metrics)."""
+    if "idx_history_created" not in _index_names(cursor, "history"):
+        cursor.execute("ALTER TABLE history ADD INDEX idx_history_created (created_at)")
+
+
+MIGRATIONS = [
+    (1, "baseline schema", _v1_baseline),
+    (2, "history.created_at -> DATETIME", _v2_history_created_at_datetime),
+    (3, "history (username, created_at) index, drop duplicate username indexes", _v3_history_indexes),
+    (4, "jobs.device", _v4_jobs_device),
+    (5, "jobs.precision", _v5_jobs_precision),
+    (6, "history.metrics", _v6_history_metrics),
+    (7, "history.text FULLTEXT index", _v7_history_fulltext),
+    (8, "jobs.mode, history.chapters, MEDIUMTEXT text", _v8_documents),
+    (9, "jobs.postprocess", _v9_jobs_postprocess),
+    (10, "voices.last_used_at", _v10_voices_last_used),
+    (11, "history/synthesis_cache output_path indexes", _v11_output_path_indexes),
+    (12, "history.created_at index", _v12_history_created_index),
+]
+
+
+def _sqlite_v1_schema(cursor):
+    """Database SQLite mới: tạo thẳng schema tương đương MySQL sau migration 6."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS history (
+        id TEXT PRIMARY KEY,
+        username TEXT NOT NULL,
+        text TEXT,
+        lang TEXT,
+        voice_path TEXT,
+        voice_id TEXT,
+        output_path TEXT,
+        created_at DATETIME NOT NULL,
+        metrics TEXT
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_user_created ON history (username, created_at)")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS voices (
+        id TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        ext TEXT,
+        size_bytes INTEGER,
+        ref_count INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS synthesis_cache (
+        cache_key TEXT PRIMARY KEY,
+        output_path TEXT NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        username TEXT NOT NULL,
+        text TEXT,
+        lang TEXT,
+        voice_id TEXT,
+        output_format TEXT NOT NULL DEFAULT 'wav',
+        device TEXT NOT NULL DEFAULT 'auto',
+        `precision` TEXT NOT NULL DEFAULT 'fp32',
+        status TEXT NOT NULL DEFAULT 'queued',
+        progress REAL NOT NULL DEFAULT 0,
+        error TEXT,
+        output_path TEXT,
+        history_id TEXT,
+        claim_token TEXT,
+        created_at TEXT,
+        updated_at TEXT
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user_status ON jobs (username, status)")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id TEXT PRIMARY KEY,
+        username TEXT NOT NULL UNIQUE,
+        password TEXT NOT NULL,
+        first_name TEXT,
+        last_name TEXT,
+        email TEXT,
+        created_at TEXT
+    )
+    """)
+
+
+def _sqlite_v2_history_fts(cursor):
+    """Chỉ mục đảo ngược (FTS5) trên history.text, đồng bộ bằng trigger.
+
+    Bảng FTS trỏ tới history theo rowid (external content): VACUUM có thể đánh số lại rowid,
+    khi đó chạy INSERT INTO history_fts(history_fts) VALUES('rebuild').
+    """
+    # remove_diacritics: "xin chao" cũng tìm được "xin chào", như collation mặc định của MySQL
+    cursor.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+        text, content='history', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+    )
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS history_fts_insert AFTER INSERT ON history BEGIN
+        INSERT INTO history_fts (rowid, text) VALUES (new.rowid, new.text);
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS history_fts_delete AFTER DELETE ON history BEGIN
+        INSERT INTO history_fts (history_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS history_fts_update AFTER UPDATE OF text ON history BEGIN
+        INSERT INTO history_fts (history_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+        INSERT INTO history_fts (rowid, text) VALUES (new.rowid, new.text);
+    END
+    """)
+    # các mục lịch sử đã có trước migration
+    cursor.execute("INSERT INTO history_fts (history_fts) VALUES ('rebuild')")
+
+
+def _sqlite_v3_documents(cursor):
+    """Tài liệu dài (documents.py): jobs.mode và history.chapters."""
+    cursor.execute("ALTER TABLE jobs ADD COLUMN mode TEXT NOT NULL DEFAULT 'text'")
+    cursor.execute("ALTER TABLE history ADD COLUMN chapters TEXT")
+
+
+def _sqlite_v4_jobs_postprocess(cursor):
+    """Tuỳ chọn hậu kỳ của job (JSON, postprocess.py)."""
+    cursor.execute("ALTER TABLE jobs ADD COLUMN postprocess TEXT")
+
+
+def _sqlite_v5_voices_last_used(cursor):
+    """voices.last_used_at: mẫu giọng ref_count = 0 chỉ bị dọn sau một khoảng chờ (db.prune_unused_voices)."""
+    cursor.execute("ALTER TABLE voices ADD COLUMN last_used_at TEXT")
+    cursor.execute("UPDATE voices SET last_used_at = created_at")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_voices_unused ON voices (ref_count, last_used_at)")
+
+
+def _sqlite_v6_output_path_indexes(cursor):
+    """Index trên output_path (history, synthesis_cache) để xoá lịch sử không quét cả bảng."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_output ON history (output_path)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cache_output ON synthesis_cache (output_path)")
+
+
+def _sqlite_v7_history_created_index(cursor):
+    """Index history.created_at cho các truy vấn trên mọi user (db.load_recent_metrics)."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_created ON history (created_at)")
+
+
+SQLITE_MIGRATIONS = [
+    (1, "schema", _sqlite_v1_schema),
+    (2, "history_fts (FTS5)", _sqlite_v2_history_fts),
+    (3, "jobs.mode, history.chapters", _sqlite_v3_documents),
+    (4, "jobs.postprocess", _sqlite_v4_jobs_postprocess),
+    (5, "voices.last_used_at", _sqlite_v5_voices_last_used),
+    (6, "history/synthesis_cache output_path indexes", _sqlite_v6_output_path_indexes),
+    (7, "history.created_at index", _sqlite_v7_history_created_index),
+]
+
+
+def current_version(cursor) -> int:
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+
+def _apply(cursor, conn, migrations, commit_each: bool) -> None:
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INT PRIMARY KEY,
+        description VARCHAR(255),
+        applied_at DATETIME NOT NULL
+    )
+    """)
+    version = current_version(cursor)
+    for number, description, apply in migrations:
+        if number <= version:
+            continue
+        print(f"Migration {number}: {description}")
+        apply(cursor)
+        cursor.execute(
+            "INSERT INTO schema_version (version, description, applied_at) VALUES (%s, %s, %s)",
+            (number, description, datetime.datetime.now().replace(microsecond=0)),
+        )
+        if commit_each:
+            conn.commit()
+
+
+def _migrate_sqlite() -> bool:
+    conn = db.get_db_connection()
+    if not conn:
+        return False
+    cursor = conn.cursor()
+    try:
+        # giữ khoá ghi tới khi commit: process khác chờ (busy_timeout) rồi thấy schema đã mới
+        cursor.execute("BEGIN IMMEDIATE")
+        _apply(cursor, conn, SQLITE_MIGRATIONS, commit_each=False)
+        conn.commit()
+        return True
+    except db.DBError as err:
+        print(f"Lỗi khi migrate schema: {err}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def migrate() -> bool:
+    """Áp dụng các migration chưa chạy theo thứ tự. Trả về True nếu schema đã ở bản mới nhất."""
+    if db.backend.name == "sqlite":
+        return _migrate_sqlite()
+    conn = db.get_db_connection()
+    if not conn:
+        return False
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (LOCK_NAME, LOCK_TIMEOUT))
+        if cursor.fetchone()[0] != 1:
+            print("Không lấy được khoá migration, bỏ qua lần này.")
+            return False
+        _apply(cursor, conn, MIGRATIONS, commit_each=True)
+        return True
+    except db.DBError as err:
+        print(f"Lỗi khi migrate schema: {err}")
+        conn.rollback()
+        return False
+    finally:
+        try:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+            cursor.fetchall()
+        except db.DBError:
+            pass
+        cursor.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    print('Đang migrate schema...')
+    if migrate():
+        print('Done.')
@@ -0,0 +1,163 @@
+"""Hậu kỳ waveform trong bộ nhớ trước khi ghi file, không qua ffmpeg hay file tạm.
+
+Các câu XTTS sinh ra được cắt khoảng lặng đầu/cuối, nối lại với khoảng nghỉ đều nhau
+(fade/crossfade ngắn ở mỗi mối nối để không bị "click") vào một buffer cấp phát một lần,
+rồi chuẩn hoá độ to theo kiểu LUFS (ITU-R BS.1770: lọc K-weighting, gating theo khối 400 ms)
+ngay trên buffer đó. Tuỳ chọn được đặt theo từng yêu cầu (dict, xem POSTPROCESS_DEFAULTS).
+"""
+import json
+from functools import lru_cache
+
+import numpy as np
+
+import metrics
+import ref_audio
+from settings import POST_PEAK_DBFS, POST_SILENCE_DB, POSTPROCESS_DEFAULTS
+
+BLOCK_SECONDS = 0.4
+BLOCK_STEP_SECONDS = 0.1
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+
+
+def options(post: dict = None) -> dict:
+    """Tuỳ chọn hậu kỳ đầy đủ: POSTPROCESS_DEFAULTS ghi đè bởi post (bỏ khoá lạ). None nếu post là None."""
+    if post is None:
+        return None
+    merged = dict(POSTPROCESS_DEFAULTS)
+    merged.update({k: v for k, v in post.items() if k in POSTPROCESS_DEFAULTS})
+    return merged
+
+
+def cache_token(post: dict) -> str:
+    """Chuỗi ổn định của tuỳ chọn để đưa vào khoá cache kết quả."""
+    return json.dumps(options(post), sort_keys=True)
+
+
+@lru_cache(maxsize=16)
+def _fade_in(n: int) -> np.ndarray:
+    # nửa chu kỳ cos: 0 -> 1, tổng fade-in + fade-out bằng 1 nên crossfade không đổi độ to
+    ramp = 0.5 - 0.5 * np.cos(np.linspace(0.0, np.pi, n, dtype=np.float32))
+    ramp.setflags(write=False)
+    return ramp
+
+
+def assemble(wavs, sample_rate: int, post: dict, pause_samples: int = 0) -> np.ndarray:
+    """Nối các câu thành một waveform float32 theo tuỳ chọn post.
+
+    trim: cắt khoảng lặng đầu/cuối mỗi câu; gap_ms: khoảng nghỉ giữa các câu (None = pause_samples);
+    crossfade_ms: fade vào/ra ở mỗi mối nối, chồng hai câu lên nhau khi gap_ms = 0;
+    loudness_lufs: độ to đích (None = không chuẩn hoá).
+    """
+    with metrics.span("postprocess"):
+        return _assemble(wavs, sample_rate, options(post), pause_samples)
+
+
+def _assemble(wavs, sample_rate: int, post: dict, pause_samples: int) -> np.ndarray:
+    pieces = [np.asarray(w, dtype=np.float32).reshape(-1) for w in wavs]
+    if post["trim"]:
+        # cắt bằng slicing: chỉ là view, chưa chép dữ liệu
+        pieces = [ref_audio.trim_silence(p, sample_rate, POST_SILENCE_DB) for p in pieces]
+    pieces = [p for p in pieces if len(p)]
+    if not pieces:
+        return np.zeros(0, dtype=np.float32)
+
+    gap = pause_samples if post["gap_ms"] is None else int(post["gap_ms"] * sample_rate / 1000)
+    fade = min(int(post["crossfade_ms"] * sample_rate / 1000), min(len(p) for p in pieces) // 2)
+    overlap = fade if gap == 0 else 0
+    starts = np.cumsum([0] + [len(p) + gap - overlap for p in pieces[:-1]])
+    out = np.zeros(int(starts[-1]) + len(pieces[-1]), dtype=np.float32)
+
+    if fade:
+        ramp = _fade_in(fade)
+        tmp = np.empty(fade, dtype=np.float32)
+    for start, piece in zip(starts, pieces):
+        seg = out[start:start + len(piece)]
+        if fade:
+            # đầu câu cộng vào (phần chồng lên đuôi câu trước khi crossfade), đuôi câu fade-out tại chỗ
+            np.multiply(piece[:fade], ramp, out=tmp)
+            seg[:fade] += tmp
+            seg[fade:] = piece[fade:]
+            seg[-fade:] *= ramp[::-1]
+        else:
+            seg[:] = piece
+
+    if post["loudness_lufs"] is not None:
+        normalize_loudness(out, sample_rate, post["loudness_lufs"])
+    return out
+
+
+def _biquad(b, a):
+    return np.array(b) / a[0], np.array(a) / a[0]
+
+
+@lru_cache(maxsize=8)
+def _k_weighting(sample_rate: int):
+    """Hai bộ lọc biquad của K-weighting (BS.1770) tính cho sample_rate bất kỳ."""
+    # tầng 1: high shelf +4 dB quanh 1.5 kHz (mô phỏng ảnh hưởng của đầu người)
+    A = 10 ** (4.0 / 40)
+    w0 = 2 * np.pi * 1500.0 / sample_rate
+    alpha = np.sin(w0) / (2 / np.sqrt(2))
+    cos = np.cos(w0)
+    shelf = _biquad(
+        [A * ((A + 1) + (A - 1) * cos + 2 * np.sqrt(A) * alpha),
+         -2 * A * ((A - 1) + (A + 1) * cos),
+         A * ((A + 1) + (A - 1) * cos - 2 * np.sqrt(A) * alpha)],
+        [(A + 1) - (A - 1) * cos + 2 * np.sqrt(A) * alpha,
+         2 * ((A - 1) - (A + 1) * cos),
+         (A + 1) - (A - 1) * cos - 2 * np.sqrt(A) * alpha],
+    )
+    # tầng 2: high-pass 38 Hz
+    w0 = 2 * np.pi * 38.0 / sample_rate
+    alpha = np.sin(w0) / (2 * 0.5)
+    cos = np.cos(w0)
+    highpass = _biquad([(1 + cos) / 2, -(1 + cos), (1 + cos) / 2], [1 + alpha, -2 * cos, 1 - alpha])
+    return shelf, highpass
+
+
+def _weighted(wav: np.ndarray, sample_rate: int) -> np.ndarray:
+    """wav qua K-weighting (torchaudio đã có trong requirements.txt cùng torch), float64."""
+    import torch
+    from torchaudio.functional import lfilter
+
+    signal = torch.from_numpy(np.asarray(wav, dtype=np.float64))
+    for b, a in _k_weighting(sample_rate):
+        signal = lfilter(signal, torch.from_numpy(a), torch.from_numpy(b), clamp=False)
+    return signal.numpy()
+
+
+def integrated_loudness(wav: np.ndarray, sample_rate: int) -> float:
+    """Độ to tích hợp (LUFS) của waveform mono; -inf nếu toàn khoảng lặng hoặc quá ngắn."""
+    block = int(BLOCK_SECONDS * sample_rate)
+    step = int(BLOCK_STEP_SECONDS * sample_rate)
+    if len(wav) < block:
+        block = step = len(wav)
+    if block == 0:
+        return float("-inf")
+    weighted = _weighted(wav, sample_rate)
+    # năng lượng trung bình của mọi khối 400 ms (chồng 75%) qua tổng tích luỹ, không lặp từng khối
+    energy = np.concatenate(([0.0], np.cumsum(np.square(weighted, dtype=np.float64))))
+    starts = np.arange(0, len(wav) - block + 1, step)
+    z = (energy[starts + block] - energy[starts]) / block
+    with np.errstate(divide="ignore"):
+        levels = -0.691 + 10 * np.log10(z)
+    z = z[levels > ABSOLUTE_GATE_LUFS]
+    if z.size == 0:
+        return float("-inf")
+    relative_gate = -0.691 + 10 * np.log10(z.mean()) + RELATIVE_GATE_LU
+    z = z[-0.691 + 10 * np.log10(z) > relative_gate]
+    return float(-0.691 + 10 * np.log10(z.mean()))
+
+
+def normalize_loudness(wav: np.ndarray, sample_rate: int, target_lufs: float) -> np.ndarray:
+    """Đưa độ to về target_lufs ngay trên wav (không để đỉnh vượt POST_PEAK_DBFS). Trả về wav."""
+    loudness = integrated_loudness(wav, sample_rate)
+    if not np.isfinite(loudness):
+        return wav
+    gain = 10 ** ((target_lufs - loudness) / 20)
+    peak = max(float(wav.max()), -float(wav.min())) * gain
+    limit = 10 ** (POST_PEAK_DBFS / 20)
+    if peak > limit:
+        gain *= limit / peak
+    wav *= np.float32(gain)
+    return wav
@@ -0,0 +1,150 @@
+"""Tiền xử lý mẫu giọng một lần lúc tải lên, thay vì để XTTS giải mã lại ở mỗi lần tổng hợp.
+
+Các bước: giải mã, trộn về mono, resample về REF_LOAD_SR của XTTS, cắt khoảng lặng đầu/cuối,
+giới hạn độ dài và chuẩn hoá âm lượng. Kết quả lưu cạnh file gốc dạng int16 .npy
+(outputs/voices/<sha256>.ref.npy) và được mở bằng memory-map khi tính latent; mẫu không
+tiền xử lý được thì ghi file đánh dấu .ref.failed để không thử lại ở mỗi lần tổng hợp.
+"""
+import os
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+from settings import REF_MAX_SECONDS, REF_SILENCE_DB, REF_TARGET_DBFS
+
+# XTTS tính conditioning latents trên audio 22.05kHz (synthesis.REF_LOAD_SR)
+SAMPLE_RATE = 22050
+FRAME_SECONDS = 0.02
+# giữ lại một chút khoảng lặng quanh phần có tiếng để không cắt mất phụ âm đầu/cuối
+PAD_SECONDS = 0.1
+PEAK_LIMIT = 0.95
+MAX_GAIN_DB = 30.0
+
+
+def clip_path(voice_path) -> Path:
+    """File audio đã tiền xử lý của một mẫu giọng: cùng tên, đuôi .ref.npy."""
+    voice_path = Path(voice_path)
+    return voice_path.with_name(f"{voice_path.stem}.ref.npy")
+
+
+def failed_path(voice_path) -> Path:
+    """File đánh dấu mẫu giọng đã tiền xử lý lỗi: cùng tên, đuôi .ref.failed."""
+    voice_path = Path(voice_path)
+    return voice_path.with_name(f"{voice_path.stem}.ref.failed")
+
+
+def decode(path, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Giải mã file audio thành waveform float32 mono ở sample_rate (ffmpeg, nếu lỗi thì torchaudio)."""
+    try:
+        import ffmpeg
+    except ImportError:
+        ffmpeg = None
+    if ffmpeg is not None:
+        try:
+            out, _ = (
+                ffmpeg.input(str(path))
+                .output("pipe:", format="f32le", acodec="pcm_f32le", ac=1, ar=sample_rate)
+                .run(capture_stdout=True, quiet=True)
+            )
+            return np.frombuffer(out, dtype=np.float32).copy()
+        except (ffmpeg.Error, OSError):
+            # không có ffmpeg trên máy, hoặc ffmpeg không đọc được file
+            pass
+    # bộ đọc của XTTS (torchaudio), vốn cũng trộn mono và resample
+    from TTS.tts.models.xtts import load_audio
+
+    return load_audio(str(path), sample_rate).numpy().reshape(-1).astype(np.float32)
+
+
+def _frame_db(wav: np.ndarray, frame: int) -> np.ndarray:
+    """Mức RMS (dBFS) của từng khung frame mẫu."""
+    n = len(wav) // frame
+    frames = wav[:n * frame].reshape(n, frame)
+    return 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-12)
+
+
+def trim_silence(wav: np.ndarray, sample_rate: int = SAMPLE_RATE, threshold_db: float = REF_SILENCE_DB) -> np.ndarray:
+    """Bỏ khoảng lặng đầu/cuối: các khung thấp hơn khung to nhất quá threshold_db (số âm)."""
+    frame = int(sample_rate * FRAME_SECONDS)
+    if len(wav) < frame:
+        return wav
+    levels = _frame_db(wav, frame)
+    active = np.flatnonzero(levels > levels.max() + threshold_db)
+    if active.size == 0:
+        return wav
+    pad = int(PAD_SECONDS / FRAME_SECONDS)
+    start = max(0, active[0] - pad) * frame
+    end = min(len(levels), active[-1] + 1 + pad) * frame
+    return wav[start:end]
+
+
+def normalize_loudness(wav: np.ndarray, sample_rate: int = SAMPLE_RATE, target_dbfs: float = REF_TARGET_DBFS,
+                       threshold_db: float = REF_SILENCE_DB) -> np.ndarray:
+    """Đưa mức RMS của các khung có tiếng về target_dbfs, không để đỉnh vượt PEAK_LIMIT."""
+    frame = int(sample_rate * FRAME_SECONDS)
+    if len(wav) < frame:
+        return wav
+    levels = _frame_db(wav, frame)
+    voiced = levels[levels > levels.max() + threshold_db]
+    # trung bình năng lượng (không phải trung bình dB) của các khung có tiếng
+    loudness = 10 * np.log10(np.mean(10 ** (voiced / 10)))
+    gain = 10 ** (min(target_dbfs - loudness, MAX_GAIN_DB) / 20)
+    peak = np.abs(wav).max() * gain
+    if peak > PEAK_LIMIT:
+        gain *= PEAK_LIMIT / peak
+    return (wav * gain).astype(np.float32)
+
+
+def preprocess(path, sample_rate: int = SAMPLE_RATE, max_seconds: float = REF_MAX_SECONDS) -> np.ndarray:
+    wav = decode(path, sample_rate)
+    wav = trim_silence(wav, sample_rate)
+    wav = wav[:int(max_seconds * sample_rate)]
+    return normalize_loudness(wav, sample_rate)
+
+
+def save_clip(voice_path):
+    """Tiền xử lý mẫu giọng và ghi file .ref.npy (int16). Trả về đường dẫn, hoặc None nếu lỗi.
+
+    Khi lỗi thì ghi file đánh dấu (failed_path) để ensure_clip() không thử lại.
+    """
+    dst = clip_path(voice_path)
+    try:
+        wav = preprocess(voice_path)
+        if wav.size == 0:
+            raise ValueError("mẫu giọng không có tiếng")
+        tmp = dst.with_name(f".{uuid.uuid4().hex}.npy")
+        np.save(tmp, (np.clip(wav, -1.0, 1.0) * 32767).astype(np.int16))
+        os.replace(tmp, dst)
+        return dst
+    except Exception as err:
+        print(f"Lỗi khi tiền xử lý mẫu giọng {Path(voice_path).name}: {err}")
+        try:
+            failed_path(voice_path).write_text(str(err), encoding="utf-8")
+        except OSError:
+            pass
+        return None
+
+
+def ensure_clip(voice_path):
+    """Đường dẫn bản đã tiền xử lý, tạo nếu chưa có (mẫu cũ); None nếu lỗi (chỉ thử một lần)."""
+    path = clip_path(voice_path)
+    if path.exists():
+        return path
+    if failed_path(voice_path).exists():
+        return None
+    return save_clip(voice_path)
+
+
+def load_clip(voice_path):
+    """Audio đã tiền xử lý của mẫu giọng (int16, SAMPLE_RATE, memory-map chỉ đọc). None nếu lỗi.
+
+    Mảng trỏ thẳng vào file; chia cho 32767 khi cần float (synthesis chỉ chuyển phần dùng tới).
+    """
+    path = ensure_clip(voice_path)
+    if path is None:
+        return None
+    try:
+        return np.load(path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,153 @@
+"""Lưu kết quả theo từng câu để khi sửa văn bản chỉ tổng hợp lại các câu đã đổi.
+
+Mỗi câu được lưu thành một đoạn audio (int16 .npy) trong outputs/segments, khoá theo
+(câu đã chuẩn hoá, ngôn ngữ, hash mẫu giọng, phiên bản model). Bản thu hoàn chỉnh
+được ghép lại từ các đoạn, kèm manifest JSON liệt kê các đoạn đã dùng.
+"""
+import hashlib
+import json
+import os
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+import batching
+import metrics
+import postprocess
+import synthesis
+from settings import SEGMENT_CACHE_MAX_BYTES, SEGMENTS_DIR
+
+
+def segment_key(sentence: str, language: str, voice_id: str, precision: str = "fp32") -> str:
+    parts = [synthesis.normalize_text(sentence), language, voice_id, synthesis.model_version(precision)]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def _segment_path(key: str) -> Path:
+    return SEGMENTS_DIR / key[:2] / f"{key}.npy"
+
+
+def load_segment(key: str):
+    """Đọc đoạn audio float32 của một câu, hoặc None nếu chưa có."""
+    path = _segment_path(key)
+    try:
+        pcm = np.load(path)
+    except (OSError, ValueError):
+        return None
+    # đánh dấu vừa dùng để prune() giữ lại các đoạn hay dùng
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return pcm.astype(np.float32) / 32767
+
+
+def save_segment(key: str, wav: np.ndarray) -> None:
+    path = _segment_path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{uuid.uuid4().hex}.npy")
+    np.save(tmp, (np.clip(wav, -1.0, 1.0) * 32767).astype(np.int16))
+    os.replace(tmp, path)
+
+
+def manifest_path(output_path) -> Path:
+    """Manifest nằm cạnh file kết quả: cùng tên, đuôi .json."""
+    return Path(output_path).with_suffix(".json")
+
+
+def synthesize(tts, text: str, speaker_wav: str, language: str, voice_id: str, precision: str = "fp32",
+               progress_callback=None, post: dict = None):
+    """Tổng hợp văn bản, dùng lại đoạn audio của các câu đã có.
+
+    Latent giọng chỉ được tính khi có ít nhất một câu phải tổng hợp mới; các câu mới
+    được gửi cùng lúc vào batching.scheduler. Đoạn lưu lại luôn là audio gốc của câu,
+    hậu kỳ (post, xem postprocess.assemble) chỉ áp dụng lúc nối. Trả về (waveform float32, manifest).
+    """
+    sentences = tts.synthesizer.split_into_sentences(text)
+    keys = [segment_key(sen, language, voice_id, precision) for sen in sentences]
+    cached = [load_segment(key) for key in keys]
+
+    futures = {}
+    if any(wav is None for wav in cached):
+        latents = synthesis.get_conditioning_latents(tts, speaker_wav)
+        settings = synthesis._inference_settings(tts)
+        scheduler = batching.scheduler(tts)
+        futures = {i: scheduler.submit(sen, language, latents, settings)
+                   for i, sen in enumerate(sentences) if cached[i] is None}
+
+    wavs = []
+    manifest = {"model": synthesis.model_version(precision), "language": language, "voice_id": voice_id,
+                "sample_rate": tts.synthesizer.output_sample_rate, "postprocess": postprocess.options(post),
+                "segments": []}
+    for i, (sen, key) in enumerate(zip(sentences, keys)):
+        wav = cached[i]
+        reused = wav is not None
+        if not reused:
+            wav = synthesis.sentence_result(futures[i])
+            save_segment(key, wav)
+        wavs.append(wav)
+        manifest["segments"].append({"text": sen, "key": key, "samples": len(wav), "reused": reused})
+        if progress_callback:
+            progress_callback(i + 1, len(sentences))
+
+    if post is not None:
+        wav = postprocess.assemble(wavs, manifest["sample_rate"], post, synthesis.SENTENCE_PAUSE_SAMPLES)
+    elif wavs:
+        pause = np.zeros(synthesis.SENTENCE_PAUSE_SAMPLES, dtype=np.float32)
+        wav = np.concatenate([x for w in wavs for x in (w, pause)])
+    else:
+        wav = np.zeros(0, dtype=np.float32)
+    return wav, manifest
+
+
+def synthesize_to_file(tts, text: str, speaker_wav: str, language: str, voice_id: str, file_path,
+                       precision: str = "fp32", progress_callback=None, post: dict = None):
+    """Như synthesize() rồi ghi WAV và manifest cạnh file. Trả về manifest."""
+    wav, manifest = synthesize(tts, text, speaker_wav, language, voice_id, precision,
+                               progress_callback=progress_callback, post=post)
+    with metrics.span("wav_write"):
+        tts.synthesizer.save_wav(wav=wav, path=str(file_path))
+        write_manifest(file_path, manifest)
+    manifest["audio_seconds"] = len(wav) / manifest["sample_rate"]
+    return manifest
+
+
+def write_manifest(output_path, manifest: dict) -> None:
+    with open(manifest_path(output_path), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+
+def read_manifest(output_path):
+    try:
+        with open(manifest_path(output_path), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def prune(max_bytes: int = SEGMENT_CACHE_MAX_BYTES) -> int:
+    """Xoá các đoạn lâu không dùng nhất cho tới khi tổng dung lượng <= max_bytes. Trả về số file đã xoá."""
+    if not SEGMENTS_DIR.exists():
+        return 0
+    files = []
+    total = 0
+    for sub in os.scandir(SEGMENTS_DIR):
+        if not sub.is_dir():
+            continue
+        for entry in os.scandir(sub.path):
+            if entry.name.endswith(".npy") and not entry.name.startswith("."):
+                st = entry.stat()
+                files.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+    removed = 0
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+        except OSError:
+            pass
+    return removed
@@ -0,0 +1,89 @@
+from pathlib import Path
+
+# Các đường dẫn dùng chung cho app.py và các module tổng hợp giọng nói
+PROJECT_ROOT = Path(__file__).resolve().parent
+MODEL_CACHE_ROOT = PROJECT_ROOT.parent / "xtts_model_cache"
+OUTPUT_DIR = PROJECT_ROOT / "outputs"
+
+# Ngôn ngữ XTTS v2 được hỗ trợ trên giao diện, API và benchmark (mục đầu là mặc định)
+LANGUAGES = ["vi", "en", "ja", "ko", "fr", "de", "es"]
+
+# Cache latent giọng nói (conditioning latents + speaker embedding) trên đĩa
+LATENT_CACHE_DIR = MODEL_CACHE_ROOT / "latents"
+# Số giọng giữ trong bộ nhớ (LRU)
+LATENT_CACHE_MAX_ITEMS = 32
+
+# Kho mẫu giọng theo nội dung: outputs/voices/<sha256>.<ext>
+VOICES_DIR = OUTPUT_DIR / "voices"
+# mẫu giọng không còn job/mục lịch sử nào dùng được giữ thêm chừng này giây rồi mới xoá
+VOICE_GRACE_SECONDS = 60 * 60
+
+# Hàng đợi job tổng hợp (jobs.py)
+JOB_WORKER_THREADS = 1  # các luồng dùng chung một model
+JOB_POLL_INTERVAL = 1.0  # giây giữa các lần kiểm tra hàng đợi khi rảnh
+JOB_STALE_SECONDS = 30 * 60  # job 'running' không cập nhật quá lâu -> coi như worker đã chết
+JOB_RETENTION_SECONDS = 7 * 24 * 60 * 60  # job đã xong/lỗi được giữ lại chừng này giây
+
+# Cache thông tin đăng nhập trong process (credentials.py), giây
+CREDENTIAL_CACHE_TTL = 300
+
+# Model registry (synthesis.get_tts): thiết bị được nạp sẵn + warm-up khi process khởi động
+PRELOAD_DEVICES = ["auto"]
+# Số luồng torch khi chạy trên CPU; None = số nhân CPU
+CPU_INTRA_OP_THREADS = None
+CPU_INTER_OP_THREADS = 1
+# Chế độ CPU nhanh (fast_cpu.py): torch.compile bộ giải mã HiFi-GAN (cần trình biên dịch C++)
+FAST_CPU_COMPILE = False
+# Trọng số model dạng memory-map (weights.py): các process cùng máy dùng chung một bản trong page cache
+WEIGHTS_MMAP = True
+WEIGHTS_MMAP_PATH = MODEL_CACHE_ROOT / "xtts_v2_weights.pt"
+WEIGHTS_LOCK_TIMEOUT = 15 * 60  # giây chờ process khác ghi xong file trọng số
+
+# Đoạn audio theo từng câu (segments.py) để sửa văn bản chỉ tổng hợp lại câu đã đổi
+SEGMENTS_DIR = OUTPUT_DIR / "segments"
+SEGMENT_CACHE_MAX_BYTES = 2 * 1024 ** 3
+SEGMENT_PRUNE_INTERVAL = 10 * 60  # giây
+
+# File database khi chọn backend SQLite (database.backend: sqlite trong config.yaml)
+SQLITE_PATH = OUTPUT_DIR / "tts.sqlite3"
+
+# Tiền xử lý mẫu giọng lúc tải lên (ref_audio.py)
+REF_MAX_SECONDS = 30  # XTTS chỉ dùng tối đa max_ref_len (30s) đầu của mẫu
+REF_SILENCE_DB = -40  # khung thấp hơn khung to nhất quá mức này coi là khoảng lặng
+REF_TARGET_DBFS = -20  # mức RMS sau chuẩn hoá
+
+# Xuất lịch sử ZIP (export.py): UI tạo link ký sẵn tới GET /v1/history/export của api.py
+EXPORT_LINK_TTL = 10 * 60  # giây link tải còn hiệu lực
+EXPORT_LINK_MAX_IDS = 200  # số mục đã chọn tối đa trong một link (giới hạn độ dài URL)
+
+# Gom câu từ các phiên dùng chung model thành batch (batching.py); BATCH_MAX_SIZE = 1 để tắt
+BATCH_MAX_SIZE = 8
+BATCH_WINDOW_SECONDS = 0.02  # thời gian chờ thêm câu sau câu đầu tiên của batch
+
+# HTTP API (api.py)
+API_HOST = "127.0.0.1"
+API_PORT = 8600
+API_SYNTH_THREADS = 4  # số request tổng hợp chạy cùng lúc (model vẫn dùng chung qua batching.py)
+API_MAX_BODY_BYTES = 50 * 1024 * 1024  # đủ cho file mẫu giọng
+API_READ_TIMEOUT = 60  # giây chờ client gửi request (kể cả kết nối keep-alive rảnh)
+API_PUBLIC_URL = f"http://localhost:{API_PORT}"  # địa chỉ API mà trình duyệt của người dùng truy cập được
+
+# Tài liệu dài (documents.py): checkpoint từng đoạn trong outputs/documents/<khoá tài liệu>
+DOCUMENTS_DIR = OUTPUT_DIR / "documents"
+DOC_WORKERS = None  # số process model CPU; None = số nhân / DOC_THREADS_PER_WORKER (mỗi process ~2 GB RAM)
+DOC_THREADS_PER_WORKER = 4
+DOC_POOL_IDLE_SECONDS = 5 * 60  # pool không còn tài liệu nào dùng chừng này giây thì đóng (trả RAM)
+DOC_CHUNK_CHARS = 600  # đoạn văn dài hơn được chia theo câu
+DOC_PARAGRAPH_PAUSE = 0.6  # giây nghỉ giữa các đoạn văn
+DOC_CHAPTER_PAUSE = 1.5  # giây nghỉ trước mỗi chương
+DOC_LOCK_STALE_SECONDS = 5 * 60  # khoá tài liệu không được làm mới chừng này giây -> process giữ khoá đã chết
+
+# Hậu kỳ waveform trước khi ghi file (postprocess.py); mặc định cho các tuỳ chọn theo yêu cầu
+POSTPROCESS_DEFAULTS = {
+    "trim": True,  # cắt khoảng lặng đầu/cuối mỗi câu
+    "gap_ms": 250,  # khoảng nghỉ giữa các câu; None = giữ như XTTS (SENTENCE_PAUSE_SAMPLES)
+    "crossfade_ms": 10,
+    "loudness_lufs": -16.0,  # None = không chuẩn hoá độ to
+}
+POST_SILENCE_DB = -45  # khung thấp hơn khung to nhất của câu quá mức này coi là khoảng lặng
+POST_PEAK_DBFS = -1.0
@@ -0,0 +1,215 @@
+"""Backend lưu trữ cho database.py: MySQL (mặc định) hoặc SQLite nhúng (WAL).
+
+Chọn trong config.yaml:
+
+    database:
+      backend: sqlite            # hoặc mysql (mặc định, dùng mục mysql: như trước)
+      path: outputs/tts.sqlite3  # chỉ với sqlite, tương đối so với thư mục dự án
+
+Các hàm trong database.py viết SQL với placeholder %s; backend cung cấp kết nối có
+cùng giao diện với mysql.connector (cursor(dictionary=True), commit, rollback, close)
+và vài đoạn SQL khác nhau giữa hai hệ quản trị.
+"""
+import datetime
+import re
+import sqlite3
+import threading
+from functools import lru_cache
+from pathlib import Path
+
+from settings import PROJECT_ROOT, SQLITE_PATH
+
+
+class MySQLBackend:
+    name = "mysql"
+    insert_ignore = "INSERT IGNORE"
+    for_update = " FOR UPDATE"
+    char_length = "CHAR_LENGTH"
+
+    def __init__(self, mysql_config: dict):
+        import mysql.connector
+        import mysql.connector.pooling
+
+        self._mysql = mysql.connector
+        self.Error = mysql.connector.Error
+        self.config = mysql_config
+        # số kết nối giữ sẵn trong pool (mysql.pool_size trong config.yaml, tối đa 32)
+        self.pool_size = int(mysql_config.get('pool_size', 5))
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _connect_args(self) -> dict:
+        return dict(
+            host=self.config['host'],
+            user=self.config['user'],
+            password=self.config['password'],
+            database=self.config['database'],
+            # rowcount của UPDATE là số dòng khớp (như SQLite), không phải số dòng thực sự đổi
+            client_flags=[self._mysql.ClientFlag.FOUND_ROWS],
+        )
+
+    def _get_pool(self):
+        """Tạo pool kết nối dùng chung cho cả process (lazy, một lần)."""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = self._mysql.pooling.MySQLConnectionPool(
+                    pool_name="tts_pool",
+                    pool_size=self.pool_size,
+                    pool_reset_session=True,
+                    **self._connect_args()
+                )
+            return self._pool
+
+    def connect(self):
+        """Lấy kết nối từ pool; conn.close() trả kết nối về pool.
+
+        Kết nối được ping trước khi dùng và tự kết nối lại nếu server đã đóng nó.
+        Khi pool đã hết kết nối rảnh thì mở tạm một kết nối riêng.
+        """
+        try:
+            conn = self._get_pool().get_connection()
+        except self._mysql.errors.PoolError:
+            try:
+                return self._mysql.connect(**self._connect_args())
+            except self.Error as err:
+                print(f"Lỗi kết nối MySQL: {err}")
+                return None
+        except self.Error as err:
+            print(f"Lỗi kết nối MySQL: {err}")
+            return None
+        try:
+            conn.ping(reconnect=True, attempts=3, delay=1)
+        except self.Error as err:
+            print(f"Lỗi kết nối MySQL: {err}")
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return None
+        return conn
+
+    def upsert(self, key: str, columns) -> str:
+        """Phần đuôi INSERT để ghi đè các cột khi trùng khoá chính."""
+        return "ON DUPLICATE KEY UPDATE " + ", ".join(f"{c} = VALUES({c})" for c in columns)
+
+
+@lru_cache(maxsize=512)
+def _translate(sql: str) -> str:
+    # placeholder của mysql.connector (%s) -> của sqlite3 (?)
+    return re.sub(r"%s", "?", sql)
+
+
+def _dict_row(cursor, row):
+    return {col[0]: value for col, value in zip(cursor.description, row)}
+
+
+class _SQLiteCursor:
+    """Cursor sqlite3 với giao diện như mysql.connector (placeholder %s, dictionary=True)."""
+
+    def __init__(self, cursor, dictionary: bool):
+        self._cursor = cursor
+        if dictionary:
+            self._cursor.row_factory = _dict_row
+
+    def execute(self, sql: str, params=()):
+        self._cursor.execute(_translate(sql), params)
+
+    def executemany(self, sql: str, seq_of_params):
+        self._cursor.executemany(_translate(sql), seq_of_params)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class _SQLiteConnection:
+    """Kết nối dùng lại trong cùng luồng; close() chỉ huỷ transaction còn dở (như trả về pool)."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, dictionary: bool = False):
+        return _SQLiteCursor(self._conn.cursor(), dictionary)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        if self._conn.in_transaction:
+            self._conn.rollback()
+
+
+class SQLiteBackend:
+    name = "sqlite"
+    insert_ignore = "INSERT OR IGNORE"
+    for_update = ""  # SQLite khoá cả database khi ghi, không có khoá theo dòng
+    char_length = "LENGTH"  # LENGTH của SQLite đếm ký tự với TEXT
+    Error = sqlite3.Error
+
+    # áp dụng cho mỗi kết nối mới
+    PRAGMAS = (
+        "PRAGMA journal_mode = WAL",  # người đọc không chặn người ghi
+        "PRAGMA synchronous = NORMAL",  # đủ an toàn với WAL, không fsync mỗi commit
+        "PRAGMA busy_timeout = 5000",
+        "PRAGMA temp_store = MEMORY",
+        "PRAGMA cache_size = -20000",  # ~20 MB
+        "PRAGMA mmap_size = 268435456",
+        "PRAGMA foreign_keys = OFF",
+    )
+    # số câu lệnh đã biên dịch (prepared) giữ lại trên mỗi kết nối
+    STATEMENT_CACHE_SIZE = 256
+
+    def __init__(self, path):
+        path = Path(path)
+        self.path = path if path.is_absolute() else PROJECT_ROOT / path
+        self._local = threading.local()
+
+    def connect(self):
+        """Kết nối SQLite của luồng hiện tại (mỗi luồng một kết nối, mở ở lần gọi đầu tiên)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                raw = sqlite3.connect(
+                    str(self.path),
+                    detect_types=sqlite3.PARSE_DECLTYPES,
+                    cached_statements=self.STATEMENT_CACHE_SIZE,
+                )
+                for pragma in self.PRAGMAS:
+                    raw.execute(pragma)
+            except (sqlite3.Error, OSError) as err:
+                print(f"Lỗi mở SQLite {self.path}: {err}")
+                return None
+            conn = self._local.conn = _SQLiteConnection(raw)
+        return conn
+
+    def upsert(self, key: str, columns) -> str:
+        return f"ON CONFLICT({key}) DO UPDATE SET " + ", ".join(f"{c} = excluded.{c}" for c in columns)
+
+
+# DATETIME lưu dạng 'YYYY-MM-DD HH:MM:SS' (so sánh chuỗi đúng thứ tự thời gian), đọc ra datetime như MySQL
+sqlite3.register_adapter(datetime.datetime, lambda d: d.isoformat(" "))
+sqlite3.register_converter("DATETIME", lambda b: datetime.datetime.fromisoformat(b.decode()))
+
+
+def from_config(config: dict):
+    """Tạo backend theo mục database: trong config.yaml (mặc định MySQL)."""
+    db_config = config.get('database') or {}
+    backend = db_config.get('backend', 'mysql')
+    if backend == 'sqlite':
+        return SQLiteBackend(db_config.get('path', SQLITE_PATH))
+    if backend == 'mysql':
+        return MySQLBackend(config['mysql'])
+    raise ValueError(f"database.backend không hợp lệ: {backend} (mysql hoặc sqlite)")
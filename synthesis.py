@@ -0,0 +1,377 @@
+import hashlib
+import io
+import os
+import queue
+import re
+import threading
+import time
+import unicodedata
+import wave
+from importlib import metadata
+
+import numpy as np
+
+import batching
+import metrics
+import postprocess
+import ref_audio
+import weights
+from latent_cache import LatentCache
+from settings import (
+    CPU_INTER_OP_THREADS,
+    CPU_INTRA_OP_THREADS,
+    LATENT_CACHE_DIR,
+    LATENT_CACHE_MAX_ITEMS,
+    MODEL_CACHE_ROOT,
+)
+
+MODEL_NAME = "tts_models/multilingual/multi-dataset/xtts_v2"
+# XTTS giải mã audio mẫu ở 22.05kHz khi tính conditioning latents
+REF_LOAD_SR = 22050
+# Synthesizer.tts của Coqui chèn 10000 mẫu im lặng giữa các câu khi split_sentences=True
+SENTENCE_PAUSE_SAMPLES = 10000
+
+# Số token GPT mỗi chunk khi streaming (XTTS inference_stream); nhỏ hơn -> nghe sớm hơn
+STREAM_CHUNK_SIZE = 20
+
+# Đổi khi thay đổi cách tổng hợp làm kết quả khác đi -> vô hiệu cache kết quả cũ
+SYNTHESIS_REVISION = 2
+
+# Dùng chung cho mọi session trong process (module chỉ được import một lần)
+latent_cache = LatentCache(LATENT_CACHE_DIR, max_items=LATENT_CACHE_MAX_ITEMS)
+
+
+# (device, precision) -> model; mỗi cấu hình chỉ tải một lần cho cả process
+_models = {}
+_models_lock = threading.Lock()
+_threads_configured = False
+
+# fp32: model gốc; int8: chế độ CPU nhanh (fast_cpu.py), chỉ chạy trên CPU
+PRECISIONS = ("fp32", "int8")
+
+
+def resolve_device(opt: str = "auto") -> str:
+    """'auto' -> 'cuda' nếu có GPU, ngược lại 'cpu'; các giá trị khác giữ nguyên."""
+    if opt == "auto":
+        try:
+            import torch
+            return "cuda" if torch.cuda.is_available() else "cpu"
+        except Exception:
+            return "cpu"
+    return opt
+
+
+def configure_cpu_threads() -> None:
+    """Đặt số luồng intra-op / inter-op của torch cho suy luận trên CPU (một lần mỗi process)."""
+    global _threads_configured
+    if _threads_configured:
+        return
+    _threads_configured = True
+    import torch
+
+    intra = CPU_INTRA_OP_THREADS or os.cpu_count() or 1
+    torch.set_num_threads(intra)
+    try:
+        # chỉ đặt được trước khi torch chạy việc song song inter-op đầu tiên
+        torch.set_num_interop_threads(CPU_INTER_OP_THREADS)
+    except RuntimeError:
+        pass
+
+
+def load_tts(device: str = "cpu", precision: str = "fp32"):
+    """Tạo model XTTS v2 trên device (tải về MODEL_CACHE_ROOT nếu chưa có)."""
+    if precision not in PRECISIONS:
+        raise ValueError(f"Không hỗ trợ precision {precision!r}")
+    if precision == "int8" and device != "cpu":
+        raise ValueError("Chế độ int8 chỉ hỗ trợ CPU")
+    os.environ["COQUI_TTS_HOME"] = str(MODEL_CACHE_ROOT)
+    if device == "cpu":
+        configure_cpu_threads()
+    from TTS.api import TTS
+    tts = weights.load(lambda: TTS(MODEL_NAME), MODEL_NAME).to(device)
+    metrics.install_vocoder_hooks(tts.synthesizer.tts_model)
+    if precision == "int8":
+        import fast_cpu
+        fast_cpu.optimize(tts)
+    return tts
+
+
+def get_tts(device: str = "auto", precision: str = "fp32"):
+    """Model dùng chung cho cả process (UI, worker job), mỗi (device, precision) chỉ tải một lần."""
+    key = (resolve_device(device), precision)
+    with _models_lock:
+        if key not in _models:
+            with metrics.span("model_load"):
+                _models[key] = load_tts(*key)
+        return _models[key]
+
+
+def warmup(tts) -> None:
+    """Chạy thử một câu ngắn để các kernel/JIT được khởi tạo trước khi có người dùng thật."""
+    xtts = tts.synthesizer.tts_model
+    speakers = getattr(getattr(xtts, "speaker_manager", None), "speakers", None) or {}
+    if not speakers:
+        return
+    # dùng giọng có sẵn của XTTS để khỏi cần file mẫu
+    speaker = next(iter(speakers.values()))
+    with batching.scheduler(tts).lock:
+        xtts.inference("Hello.", "en", speaker["gpt_cond_latent"], speaker["speaker_embedding"],
+                       **_inference_settings(tts))
+
+
+def preload(device: str = "auto", precision: str = "fp32", background: bool = True):
+    """Tải và warm-up model ngay khi process khởi động (mặc định chạy ở luồng nền)."""
+    def _run():
+        try:
+            warmup(get_tts(device, precision))
+        except Exception as err:
+            print(f"Lỗi khi preload model ({device}, {precision}): {err}")
+
+    if not background:
+        _run()
+        return None
+    t = threading.Thread(target=_run, name=f"xtts-preload-{device}", daemon=True)
+    t.start()
+    return t
+
+
+def model_version(precision: str = "fp32") -> str:
+    """Chuỗi định danh model + phiên bản Coqui TTS (+ precision nếu khác fp32), dùng trong khoá cache kết quả."""
+    try:
+        tts_version = metadata.version("TTS")
+    except metadata.PackageNotFoundError:
+        tts_version = "unknown"
+    version = f"{MODEL_NAME}@{tts_version}/r{SYNTHESIS_REVISION}"
+    return version if precision == "fp32" else f"{version}/{precision}"
+
+
+def normalize_text(text: str) -> str:
+    """Chuẩn hoá văn bản để so khớp cache: Unicode NFC, gộp khoảng trắng, bỏ khoảng trắng đầu/cuối."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def result_cache_key(text: str, language: str, voice_id: str, precision: str = "fp32", post: dict = None) -> str:
+    """Khoá cache kết quả cho (văn bản chuẩn hoá, ngôn ngữ, hash mẫu giọng, phiên bản model, hậu kỳ)."""
+    parts = [normalize_text(text), language, voice_id, model_version(precision)]
+    if post is not None:
+        parts.append(postprocess.cache_token(post))
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def _conditioning_settings(tts) -> dict:
+    cfg = tts.synthesizer.tts_config
+    return {
+        "gpt_cond_len": cfg.gpt_cond_len,
+        "gpt_cond_chunk_len": cfg.gpt_cond_chunk_len,
+        "max_ref_length": cfg.max_ref_len,
+        "sound_norm_refs": cfg.sound_norm_refs,
+    }
+
+
+def _inference_settings(tts) -> dict:
+    cfg = tts.synthesizer.tts_config
+    return {
+        "temperature": cfg.temperature,
+        "length_penalty": cfg.length_penalty,
+        "repetition_penalty": cfg.repetition_penalty,
+        "top_k": cfg.top_k,
+        "top_p": cfg.top_p,
+    }
+
+
+def _latents_from_clip(xtts, clip: np.ndarray, settings: dict):
+    """Như xtts.get_conditioning_latents() nhưng từ audio đã tiền xử lý (ref_audio), không giải mã file."""
+    import torch
+
+    # clip là int16 memory-map: chỉ chuyển sang float phần XTTS dùng tới
+    pcm = clip[: REF_LOAD_SR * settings["max_ref_length"]]
+    audio = torch.from_numpy(pcm.astype(np.float32) / 32767).unsqueeze(0).to(xtts.device)
+    # âm lượng đã được chuẩn hoá lúc tải lên nên bỏ qua sound_norm_refs
+    speaker_embedding = xtts.get_speaker_embedding(audio, REF_LOAD_SR)
+    gpt_cond_latent = xtts.get_gpt_cond_latents(
+        audio, REF_LOAD_SR, length=settings["gpt_cond_len"], chunk_length=settings["gpt_cond_chunk_len"]
+    )
+    return gpt_cond_latent, speaker_embedding
+
+
+def get_conditioning_latents(tts, speaker_wav: str):
+    """Lấy (gpt_cond_latent, speaker_embedding) cho file mẫu giọng, ưu tiên từ cache.
+
+    Dùng bản đã tiền xử lý của mẫu giọng (ref_audio.load_clip); nếu không tạo được
+    thì để XTTS tự đọc file như trước.
+    """
+    with metrics.span("latents"):
+        settings = _conditioning_settings(tts)
+        clip = ref_audio.load_clip(speaker_wav)
+        if clip is None:
+            from TTS.tts.models.xtts import load_audio
+
+            audio = load_audio(str(speaker_wav), REF_LOAD_SR).numpy()
+        else:
+            audio = clip
+        key = LatentCache.make_key(audio, settings)
+
+        latents = latent_cache.get(key)
+        if latents is None:
+            xtts = tts.synthesizer.tts_model
+            if clip is None:
+                latents = xtts.get_conditioning_latents(audio_path=[str(speaker_wav)], **settings)
+            else:
+                latents = _latents_from_clip(xtts, clip, settings)
+            latent_cache.put(key, latents)
+    return latents
+
+
+def sentence_result(future) -> np.ndarray:
+    """Chờ kết quả một câu đã gửi vào batching.scheduler; ghi thời gian vào timer hiện tại.
+
+    Thời gian chờ được chia thành queue_wait (câu còn trong hàng đợi hoặc chờ model),
+    gpt_decode và vocoder theo các mốc luồng batching ghi lại khi chạy câu.
+    """
+    waited = time.perf_counter()
+    wav, (submitted, started, vocoder_started, finished) = future.result()
+    timer = metrics.current()
+    if timer is not None:
+        metrics.add_overlap(timer, waited, time.perf_counter(), [
+            ("queue_wait", submitted, started),
+            ("gpt_decode", started, vocoder_started),
+            # phần sau khi xong (chuyển kết quả giữa các luồng) tính vào vocoder
+            ("vocoder", vocoder_started, float("inf")),
+        ])
+    return wav
+
+
+def synthesize(tts, text: str, speaker_wav: str, language: str, split_sentences: bool = True,
+               progress_callback=None, latents=None, post: dict = None) -> np.ndarray:
+    """Tổng hợp văn bản thành waveform float32 (sample rate = tts.synthesizer.output_sample_rate).
+
+    Tương đương tts.tts(...) nhưng chỉ tính latent giọng một lần cho cả đoạn
+    (thay vì mỗi câu) và lấy lại từ cache ở các lần sau.
+    progress_callback(done, total) được gọi sau mỗi câu; latents cho phép
+    truyền sẵn kết quả get_conditioning_latents() khi tổng hợp nhiều đoạn cùng giọng.
+    Các câu được gửi cùng lúc vào batching.scheduler để chạy chung batch.
+    post: tuỳ chọn hậu kỳ (postprocess.assemble) áp dụng khi nối các câu; None = nối như cũ.
+    """
+    latents = latents or get_conditioning_latents(tts, speaker_wav)
+    sentences = tts.synthesizer.split_into_sentences(text) if split_sentences else [text]
+    settings = _inference_settings(tts)
+
+    scheduler = batching.scheduler(tts)
+    futures = [scheduler.submit(sen, language, latents, settings) for sen in sentences]
+    wavs = []
+    for i, future in enumerate(futures):
+        wavs.append(sentence_result(future))
+        if progress_callback:
+            progress_callback(i + 1, len(sentences))
+    if post is not None:
+        return postprocess.assemble(wavs, tts.synthesizer.output_sample_rate, post, SENTENCE_PAUSE_SAMPLES)
+    pause = np.zeros(SENTENCE_PAUSE_SAMPLES, dtype=np.float32)
+    return np.concatenate([x for wav in wavs for x in (wav, pause)]) if wavs else np.zeros(0, dtype=np.float32)
+
+
+def synthesize_to_file(tts, text: str, speaker_wav: str, language: str, file_path: str, split_sentences: bool = True,
+                       progress_callback=None, latents=None, post: dict = None):
+    """Giống tts.tts_to_file(...) nhưng dùng latent cache. Trả về waveform đã ghi."""
+    wav = synthesize(tts, text, speaker_wav, language, split_sentences=split_sentences,
+                     progress_callback=progress_callback, latents=latents, post=post)
+    with metrics.span("wav_write"):
+        tts.synthesizer.save_wav(wav=wav, path=str(file_path))
+    return wav
+
+
+def stream_synthesis(tts, text: str, speaker_wav: str, language: str, split_sentences: bool = True,
+                     stream_chunk_size: int = STREAM_CHUNK_SIZE, latents=None):
+    """Generator trả về từng đoạn waveform float32 ngay khi XTTS giải mã xong (inference_stream).
+
+    Mỗi câu được stream thành nhiều chunk nhỏ, sau mỗi câu là một khoảng lặng
+    giống synthesize(), nên ghép các chunk lại sẽ được bản thu hoàn chỉnh.
+    Một luồng riêng chạy model (chỉ giữ khoá của batching.scheduler trong lúc sinh một câu)
+    và đẩy chunk qua hàng đợi không giới hạn: bên gọi xử lý chunk chậm, hoặc bỏ dở
+    generator, không giữ khoá model của các phiên khác.
+    """
+    xtts = tts.synthesizer.tts_model
+    gpt_cond_latent, speaker_embedding = latents or get_conditioning_latents(tts, speaker_wav)
+    sentences = tts.synthesizer.split_into_sentences(text) if split_sentences else [text]
+    settings = _inference_settings(tts)
+    lock = batching.scheduler(tts).lock
+    chunks = queue.Queue()
+    stopped = threading.Event()
+
+    def produce():
+        try:
+            for sen in sentences:
+                waited = time.perf_counter()
+                # inference_stream giữ prefix của câu trong model suốt lúc sinh: không cho batch chen vào
+                with lock:
+                    # thời gian chờ model (batch hoặc stream khác) tính vào chunk đầu của câu
+                    pending = {"queue_wait": time.perf_counter() - waited}
+                    generator = xtts.inference_stream(sen, language, gpt_cond_latent, speaker_embedding,
+                                                      stream_chunk_size=stream_chunk_size, **settings)
+                    while not stopped.is_set():
+                        # timer riêng cho từng chunk (hook vocoder ghi vào đây), bên gọi cộng vào timer của nó
+                        timer = metrics.RequestTimer()
+                        with timer.activate(), metrics.span("gpt_decode"):
+                            chunk = next(generator, None)
+                        if chunk is None:
+                            break
+                        stages = {**pending, **timer.stages}
+                        pending = {}
+                        chunks.put((np.asarray(chunk.detach().cpu(), dtype=np.float32).reshape(-1), stages))
+                if stopped.is_set():
+                    return
+                chunks.put((np.zeros(SENTENCE_PAUSE_SAMPLES, dtype=np.float32), {}))
+        except Exception as err:
+            chunks.put(err)
+        finally:
+            chunks.put(None)
+
+    threading.Thread(target=produce, name="xtts-stream", daemon=True).start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            wav, stages = item
+            timer = metrics.current()
+            if timer is not None:
+                for stage, seconds in stages.items():
+                    timer.add(stage, seconds)
+            yield wav
+    finally:
+        stopped.set()
+
+
+def _to_pcm16(samples: np.ndarray) -> bytes:
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+def wav_bytes(samples: np.ndarray, sample_rate: int) -> bytes:
+    """Đóng gói waveform float32 thành file WAV PCM 16-bit trong bộ nhớ."""
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(_to_pcm16(samples))
+    return buf.getvalue()
+
+
+def stream_to_file(tts, text: str, speaker_wav: str, language: str, file_path: str, split_sentences: bool = True,
+                   stream_chunk_size: int = STREAM_CHUNK_SIZE, latents=None):
+    """Như stream_synthesis() nhưng đồng thời ghi dần các chunk vào file WAV trên đĩa."""
+    with wave.open(str(file_path), "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(tts.synthesizer.output_sample_rate)
+        chunks = stream_synthesis(tts, text, speaker_wav, language, split_sentences=split_sentences,
+                                  stream_chunk_size=stream_chunk_size, latents=latents)
+        try:
+            for chunk in chunks:
+                with metrics.span("wav_write"):
+                    wf.writeframes(_to_pcm16(chunk))
+                yield chunk
+        finally:
+            # dừng luồng sinh ngay khi bên gọi bỏ dở
+            chunks.close()
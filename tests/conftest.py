@@ -0,0 +1,28 @@
+import importlib
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# các module của app nằm phẳng ở thư mục gốc
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture(scope="session")
+def db(tmp_path_factory):
+    """database.py trên SQLite tạm (database.py đọc config.yaml ở thư mục hiện tại lúc import)."""
+    root = tmp_path_factory.mktemp("db")
+    (root / "config.yaml").write_text(
+        f"database:\n  backend: sqlite\n  path: {root / 'tts.sqlite3'}\n", encoding="utf-8"
+    )
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        sys.modules.pop("database", None)
+        database = importlib.import_module("database")
+    finally:
+        os.chdir(cwd)
+    database.init_db()
+    yield database
+    sys.modules.pop("database", None)
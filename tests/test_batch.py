@@ -0,0 +1,45 @@
+import importlib
+import json
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def batch(db, tmp_path, monkeypatch):
+    # import sau fixture db: batch.py và voice_store.py dùng database.py trên SQLite tạm
+    module = importlib.import_module("batch")
+    voice_store = importlib.import_module("voice_store")
+    monkeypatch.setattr(voice_store, "VOICES_DIR", tmp_path / "voices")
+    monkeypatch.setattr(module, "OUTPUT_DIR", tmp_path)
+    return module
+
+
+def test_voice_survives_prune_until_group_is_committed(batch, db, tmp_path, monkeypatch):
+    src = tmp_path / "giong.wav"
+    src.write_bytes(b"RIFF" + bytes(range(256)))
+    input_path = tmp_path / "input.jsonl"
+    records = [{"username": "hana", "text": f"câu số {i}", "lang": "vi", "voice": str(src)} for i in range(3)]
+    input_path.write_text("\n".join(json.dumps(r, ensure_ascii=False) for r in records), encoding="utf-8")
+
+    def synthesize_to_file(tts, text, speaker_wav, language, file_path, latents=None):
+        # nhóm chạy lâu hơn thời gian chờ: worker của app dọn mẫu giọng giữa chừng
+        db.prune_unused_voices(-5)
+        with open(file_path, "wb") as f:
+            f.write(b"RIFF")
+        return np.zeros(24000, dtype=np.float32)
+
+    tts = type("Tts", (), {"synthesizer": type("Synth", (), {"output_sample_rate": 24000})})()
+    monkeypatch.setattr(batch.synthesis, "get_tts", lambda *args: tts)
+    monkeypatch.setattr(batch.synthesis, "get_conditioning_latents", lambda tts, path: (None, None))
+    monkeypatch.setattr(batch.synthesis, "synthesize_to_file", synthesize_to_file)
+
+    stats = batch.run(input_path, tmp_path / "input.checkpoint", window_size=10, commit_every=10,
+                      output_format="wav")
+
+    assert len(stats) == 3
+    history = db.load_history("hana")
+    assert len(history) == 3
+    voice = db.get_voice(history[0]["voice_id"])
+    # tham chiếu của nhóm đã được bỏ, chỉ còn tham chiếu của các mục lịch sử
+    assert voice is not None and voice["ref_count"] == 3
@@ -0,0 +1,107 @@
+"""database.py trên backend SQLite (config.yaml tạm, database.py đọc config.yaml ở thư mục hiện tại)."""
+import os
+
+import pytest
+
+
+@pytest.fixture
+def voice(db, tmp_path):
+    path = tmp_path / "voice.wav"
+    path.write_bytes(b"RIFF")
+    voice_id = os.urandom(16).hex()
+    assert db.add_voice(voice_id, str(path), "wav", 4)
+    return voice_id
+
+
+def test_init_db_is_idempotent(db):
+    db.init_db()
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    tables = {row[0] for row in cursor.fetchall()}
+    cursor.close()
+    conn.close()
+    assert {"users", "history", "voices", "jobs", "synthesis_cache"} <= tables
+
+
+def test_history_add_load_page_search(db, voice, tmp_path):
+    ids = [db.add_history_item("alice", f"xin chào số {i}", "vi", voice, str(tmp_path / f"{i}.wav"))
+           for i in range(5)]
+    db.add_history_item("bob", "xin chào của bob", "vi", voice, str(tmp_path / "bob.wav"))
+
+    assert {item["id"] for item in db.load_history("alice")} == set(ids)
+
+    page, before = db.load_history_page("alice", page_size=3)
+    assert len(page) == 3 and before is not None
+    rest, before = db.load_history_page("alice", page_size=3, before=before)
+    assert before is None
+    assert {item["id"] for item in page + rest} == set(ids)
+
+    items, has_more = db.search_history("alice", "chào")
+    assert not has_more and {item["id"] for item in items} == set(ids)
+    items, _ = db.search_history("alice", "số 3")
+    assert [item["id"] for item in items] == [ids[3]]
+    assert db.search_history("alice", "chào", lang="en")[0] == []
+
+
+def test_delete_history_keeps_shared_outputs(db, voice, tmp_path):
+    shared = str(tmp_path / "shared.wav")
+    first = db.add_history_item("carol", "một", "vi", voice, shared)
+    second = db.add_history_item("carol", "một", "vi", voice, shared)
+
+    # mục của user khác không bị xoá
+    assert db.delete_history_items("dave", [first]) == (0, [], [])
+    assert db.delete_history_items("carol", [first]) == (1, [], [])
+    assert db.get_history_item(first) is None
+    assert db.delete_history_items("carol", [second]) == (1, [shared], [])
+    assert db.delete_history_items("carol", []) == (0, [], [])
+
+
+def test_enqueue_and_claim_jobs(db, voice):
+    job_ids = {db.enqueue_job("erin", f"câu {i}", "vi", voice) for i in range(2)}
+    assert None not in job_ids
+
+    claimed = [db.claim_next_job(), db.claim_next_job()]
+    assert {job["id"] for job in claimed} == job_ids
+    assert all(job["status"] == "running" for job in claimed)
+    assert db.claim_next_job() is None
+
+    assert db.enqueue_job("erin", "không có giọng", "vi", "missing-voice") is None
+
+
+def test_update_job_requires_current_claim(db, voice):
+    job_id = db.enqueue_job("gina", "câu", "vi", voice)
+    while (stale := db.claim_next_job())["id"] != job_id:
+        pass
+    assert db.update_job(job_id, stale["claim_token"], progress=0.5)
+
+    # worker cũ bị coi là đã chết: job về hàng đợi và được nhận lại với mã khác
+    assert db.requeue_stale_jobs(-5) >= 1
+    while (current := db.claim_next_job())["id"] != job_id:
+        pass
+    assert current["claim_token"] != stale["claim_token"]
+    assert not db.update_job(job_id, stale["claim_token"], status="done")
+    assert db.update_job(job_id, current["claim_token"], status="done")
+    assert db.get_job(job_id)["status"] == "done"
+
+
+def test_voice_ref_counting(db, voice, tmp_path):
+    def ref_count():
+        return db.get_voice(voice)["ref_count"]
+
+    job_id = db.enqueue_job("frank", "câu", "vi", voice)
+    item_id = db.add_history_item("frank", "câu", "vi", voice, str(tmp_path / "out.wav"))
+    assert ref_count() == 2
+
+    # job xong thì worker (jobs.py) bỏ tham chiếu
+    assert db.update_job(job_id, status="done")
+    assert db.release_voice(voice)
+    assert ref_count() == 1
+    db.delete_history_items("frank", [item_id])
+    assert ref_count() == 0
+
+    # còn trong thời gian chờ thì không bị dọn; hết thời gian chờ thì trả về đường dẫn để xoá file
+    path = db.get_voice(voice)["path"]
+    assert path not in db.prune_unused_voices()
+    assert path in db.prune_unused_voices(-5)
+    assert db.get_voice(voice) is None
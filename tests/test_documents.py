@@ -0,0 +1,43 @@
+import documents
+
+DOC = """Lời nói đầu không có tiêu đề.
+
+# Chương 1: **Mở đầu**
+Đây là đoạn một, có [một link](http://example.com) và *nhấn mạnh*.
+Dòng thứ hai của cùng đoạn.
+
+- mục một
+
+```
+print("code không được đọc")
+```
+
+## Chương 2
+"""
+
+
+def test_plan_chunks_chapters_and_markdown():
+    chunks, chapters = documents.plan_chunks(DOC)
+    assert [c["text"] for c in chunks] == [
+        "Lời nói đầu không có tiêu đề.",
+        "Đây là đoạn một, có một link và nhấn mạnh. Dòng thứ hai của cùng đoạn.",
+        "mục một",
+    ]
+    assert [c["chapter"] for c in chunks] == [0, 1, 1]
+    assert all(c["paragraph_start"] for c in chunks)
+    # chương không có đoạn văn nào thì không có mốc
+    assert chapters == [{"title": "", "chunk": 0}, {"title": "Chương 1: Mở đầu", "chunk": 1}]
+
+
+def test_plan_chunks_splits_long_paragraph_by_sentence():
+    sentences = [f"Câu số {i} của đoạn rất dài." for i in range(40)]
+    chunks, chapters = documents.plan_chunks(" ".join(sentences), max_chars=100)
+    assert len(chunks) > 1
+    assert all(len(c["text"]) <= 100 for c in chunks)
+    assert [c["paragraph_start"] for c in chunks] == [True] + [False] * (len(chunks) - 1)
+    assert " ".join(c["text"] for c in chunks) == " ".join(sentences)
+    assert chapters == [{"title": "", "chunk": 0}]
+
+
+def test_plan_chunks_empty():
+    assert documents.plan_chunks("") == ([], [])
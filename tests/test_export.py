@@ -0,0 +1,40 @@
+import datetime
+import io
+import json
+import zipfile
+
+import export
+
+
+def test_iter_zip(tmp_path):
+    audio = tmp_path / "a.opus"
+    audio.write_bytes(b"\x01" * (export.CHUNK_SIZE + 10))
+    created_at = datetime.datetime(2024, 5, 6, 7, 8, 9)
+    items = [
+        {"id": "aaaaaaaa-1", "text": "xin chào", "lang": "vi", "created_at": created_at, "output_path": str(audio)},
+        {"id": "bbbbbbbb-2", "text": "mất file", "lang": "en", "created_at": created_at,
+         "output_path": str(tmp_path / "missing.wav")},
+    ]
+    data = b"".join(export.iter_zip(items))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.read("audio/20240506-070809_aaaaaaaa.opus") == audio.read_bytes()
+        manifest = json.loads(zf.read("manifest.json"))
+    assert [row["file"] for row in manifest] == ["audio/20240506-070809_aaaaaaaa.opus", ""]
+    assert manifest[0]["text"] == "xin chào"
+
+
+def test_iter_zip_csv_manifest():
+    data = b"".join(export.iter_zip([], manifest_format="csv"))
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.namelist() == ["manifest.csv"]
+        assert zf.read("manifest.csv").decode("utf-8-sig").splitlines() == [",".join(export.MANIFEST_FIELDS)]
+
+
+def test_link_token():
+    token = export.link_token("người dùng", "secret")
+    assert export.verify_link_token(token, "secret") == "người dùng"
+    assert export.verify_link_token(token, "other") is None
+    assert export.verify_link_token(token.replace(".", ".9", 1), "secret") is None
+    assert export.verify_link_token(export.link_token("alice", "secret", ttl=-1), "secret") is None
+    assert export.verify_link_token("garbage", "secret") is None
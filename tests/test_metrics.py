@@ -0,0 +1,17 @@
+import pytest
+
+import metrics
+
+
+def test_add_overlap_counts_only_time_waited():
+    timer = metrics.RequestTimer()
+    phases = [("queue_wait", 0.0, 2.0), ("gpt_decode", 2.0, 5.0), ("vocoder", 5.0, 6.0)]
+    # bên gọi bắt đầu chờ giữa lúc GPT đang chạy (câu trước của cùng yêu cầu đã chiếm phần đầu)
+    metrics.add_overlap(timer, 3.0, 6.5, phases)
+    assert timer.stages == pytest.approx({"gpt_decode": 2.0, "vocoder": 1.0})
+
+
+def test_add_overlap_ignores_disjoint_phases():
+    timer = metrics.RequestTimer()
+    metrics.add_overlap(timer, 10.0, 11.0, [("queue_wait", 0.0, 1.0)])
+    assert timer.stages == {}
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+import postprocess
+
+SR = 24000
+
+
+def sine(seconds: float, amplitude: float = 0.5, freq: float = 1000.0) -> np.ndarray:
+    t = np.arange(int(seconds * SR)) / SR
+    return (amplitude * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+
+
+def test_integrated_loudness_of_sine():
+    pytest.importorskip("torchaudio")
+    # BS.1770: sine 997 Hz ở 0 dBFS đo được -3.01 LUFS (K-weighting gần như không đổi quanh 1 kHz)
+    assert postprocess.integrated_loudness(sine(3, 1.0, freq=997.0), SR) == pytest.approx(-3.01, abs=0.1)
+    # giảm một nửa biên độ: nhỏ hơn 6 dB
+    difference = postprocess.integrated_loudness(sine(3, 1.0), SR) - postprocess.integrated_loudness(sine(3, 0.5), SR)
+    assert difference == pytest.approx(20 * np.log10(2), abs=0.01)
+
+
+def test_integrated_loudness_of_silence_and_empty():
+    pytest.importorskip("torchaudio")
+    assert postprocess.integrated_loudness(np.zeros(SR, dtype=np.float32), SR) == float("-inf")
+    assert postprocess.integrated_loudness(np.zeros(0, dtype=np.float32), SR) == float("-inf")
+
+
+def test_assemble_inserts_gaps():
+    a, b = sine(0.5), sine(0.3)
+    post = {"trim": False, "gap_ms": 100, "crossfade_ms": 0, "loudness_lufs": None}
+    out = postprocess.assemble([a, b], SR, post)
+    gap = int(0.1 * SR)
+    assert out.dtype == np.float32
+    assert len(out) == len(a) + gap + len(b)
+    np.testing.assert_array_equal(out[:len(a)], a)
+    assert not out[len(a):len(a) + gap].any()
+    np.testing.assert_array_equal(out[len(a) + gap:], b)
+
+
+def test_assemble_crossfades_without_gap():
+    a, b = sine(0.5), sine(0.5)
+    post = {"trim": False, "gap_ms": 0, "crossfade_ms": 10, "loudness_lufs": None}
+    out = postprocess.assemble([a, b], SR, post)
+    assert len(out) == len(a) + len(b) - int(0.01 * SR)
+    assert out[0] == 0.0 and out[-1] == 0.0
+
+
+def test_assemble_trims_silence_and_normalizes():
+    pytest.importorskip("torchaudio")
+    padded = np.concatenate([np.zeros(SR // 2, dtype=np.float32), sine(1.0, 0.05), np.zeros(SR // 2, dtype=np.float32)])
+    post = {"trim": True, "gap_ms": 0, "crossfade_ms": 0, "loudness_lufs": -20.0}
+    out = postprocess.assemble([padded], SR, post)
+    assert len(out) < len(padded) - SR // 2
+    assert postprocess.integrated_loudness(out, SR) == pytest.approx(-20.0, abs=0.1)
+
+
+def test_assemble_empty():
+    assert len(postprocess.assemble([], SR, {})) == 0
@@ -0,0 +1,66 @@
+import hashlib
+import os
+import uuid
+from pathlib import Path
+
+import database as db
+import ref_audio
+from settings import VOICES_DIR
+
+
+def save_voice(data: bytes, ext: str):
+    """Lưu mẫu giọng theo nội dung (SHA-256) và trả về voice_id.
+
+    Cùng một file tải lên nhiều lần chỉ được ghi ra đĩa một lần; số job và mục lịch sử
+    dùng mẫu giọng được đếm trong cột voices.ref_count. Bản đã tiền xử lý
+    (ref_audio) được tạo cạnh file gốc. Mẫu giọng không được job/mục lịch sử nào dùng
+    tới sẽ bị prune() xoá sau VOICE_GRACE_SECONDS.
+    """
+    data = bytes(data)
+    voice_id = hashlib.sha256(data).hexdigest()
+    ext = ext.lower().lstrip(".")
+
+    existing = db.get_voice(voice_id)
+    if existing and Path(existing["path"]).exists():
+        ref_audio.ensure_clip(existing["path"])
+        # cập nhật last_used_at để prune() không xoá trước khi job kịp giữ tham chiếu
+        if not db.add_voice(voice_id, existing["path"], existing["ext"], existing["size_bytes"]):
+            return None
+        return voice_id
+
+    path = VOICES_DIR / f"{voice_id}.{ext}"
+
+    if not path.exists():
+        VOICES_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as vf:
+            vf.write(data)
+        os.replace(tmp_path, path)
+    # giải mã + chuẩn hoá một lần ngay lúc tải lên; lỗi thì lúc tổng hợp sẽ đọc file gốc
+    ref_audio.ensure_clip(path)
+
+    if not db.add_voice(voice_id, str(path), ext, len(data)):
+        return None
+    return voice_id
+
+
+def voice_path(voice_id: str):
+    """Trả về Path của mẫu giọng theo voice_id, hoặc None nếu không còn."""
+    voice = db.get_voice(voice_id)
+    if not voice:
+        return None
+    path = Path(voice["path"])
+    return path if path.exists() else None
+
+
+def prune() -> int:
+    """Xoá các mẫu giọng không còn được dùng (db.prune_unused_voices) cùng bản đã tiền xử lý."""
+    removed = 0
+    for path in db.prune_unused_voices():
+        for fp in (Path(path), ref_audio.clip_path(path), ref_audio.failed_path(path)):
+            try:
+                fp.unlink(missing_ok=True)
+            except OSError:
+                pass
+        removed += 1
+    return removed
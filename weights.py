@@ -0,0 +1,195 @@
+"""Trọng số XTTS dạng memory-map, dùng chung giữa các process qua page cache của hệ điều hành.
+
+Checkpoint gốc (model.pth trong MODEL_CACHE_ROOT) là pickle kèm các khoá thừa: mỗi process
+phải giải nén toàn bộ vào bộ nhớ riêng. Lần nạp đầu tiên ghi lại state dict của model đã nạp
+thành WEIGHTS_MMAP_PATH (chỉ tensor, định dạng zip của torch.save); các lần sau file này được
+mở bằng torch.load(mmap=True) và gán thẳng vào model (load_state_dict(assign=True)), nên tensor
+trên CPU vẫn trỏ vào file đã map: các process Streamlit/worker cùng đọc một bản trong page cache.
+
+Cạnh file trọng số là dấu vân tay của checkpoint gốc (phiên bản TTS/torch, kích thước và mtime
+của model.pth): model được tải lại hoặc nâng cấp thì file cũ bị bỏ qua và được ghi lại. Chỉ một
+process ghi (giữ file khoá), các process khác chờ rồi map file vừa ghi.
+
+Chuyển đổi trước (vd. khi triển khai), không cần chờ lần chạy đầu:
+
+    python weights.py
+"""
+import argparse
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from importlib import metadata
+from pathlib import Path
+
+from settings import WEIGHTS_LOCK_TIMEOUT, WEIGHTS_MMAP, WEIGHTS_MMAP_PATH
+
+FINGERPRINT_PATH = WEIGHTS_MMAP_PATH.with_name(WEIGHTS_MMAP_PATH.name + ".json")
+LOCK_PATH = WEIGHTS_MMAP_PATH.with_name(WEIGHTS_MMAP_PATH.name + ".lock")
+LOCK_POLL_SECONDS = 1.0
+
+
+def checkpoint_path(model_name: str) -> Path:
+    """model.pth của model_name trong thư mục model của TTS (ModelManager đặt tên như vậy)."""
+    from TTS.utils.generic_utils import get_user_data_dir
+
+    return Path(get_user_data_dir("tts")) / model_name.replace("/", "--") / "model.pth"
+
+
+def fingerprint(model_name: str) -> dict:
+    """Dấu vân tay của checkpoint gốc; None nếu chưa tải model về."""
+    try:
+        stat = checkpoint_path(model_name).stat()
+        versions = {name: metadata.version(name) for name in ("TTS", "torch")}
+    except (ImportError, OSError, metadata.PackageNotFoundError):
+        return None
+    return {"model": model_name, **versions, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def is_current(model_name: str) -> bool:
+    """File trọng số memory-map có và được ghi từ đúng checkpoint gốc hiện tại."""
+    if not (WEIGHTS_MMAP and WEIGHTS_MMAP_PATH.is_file()):
+        return False
+    try:
+        stored = json.loads(FINGERPRINT_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return False
+    current = fingerprint(model_name)
+    return current is not None and stored == current
+
+
+def _acquire_lock(timeout: float = WEIGHTS_LOCK_TIMEOUT) -> bool:
+    """Tạo file khoá (O_EXCL, dùng được trên mọi hệ điều hành); chờ tối đa timeout giây.
+
+    File khoá cũ hơn timeout coi như của process đã chết giữa chừng và bị bỏ.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            LOCK_PATH.parent.mkdir(parents=True, exist_ok=True)
+            os.close(os.open(LOCK_PATH, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - LOCK_PATH.stat().st_mtime > timeout:
+                    LOCK_PATH.unlink(missing_ok=True)
+                    continue
+            except FileNotFoundError:
+                continue
+        except OSError as err:
+            print(f"Lỗi khi tạo file khoá {LOCK_PATH}: {err}")
+            return False
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(LOCK_POLL_SECONDS)
+
+
+def save(xtts, model_name: str) -> bool:
+    """Ghi state dict của model XTTS vừa nạp (còn fp32, chưa chuyển device) ra WEIGHTS_MMAP_PATH."""
+    import torch
+
+    current = fingerprint(model_name)
+    if current is None:
+        print("Lỗi khi ghi trọng số memory-map: không tìm thấy checkpoint gốc")
+        return False
+    WEIGHTS_MMAP_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = WEIGHTS_MMAP_PATH.with_name(f".{uuid.uuid4().hex}.tmp")
+    try:
+        # bỏ dấu vân tay trước: không process nào map file đang được thay
+        FINGERPRINT_PATH.unlink(missing_ok=True)
+        state = {k: v.detach().cpu() for k, v in xtts.state_dict().items()}
+        # tensor dùng chung (vd. embedding của GPT) chỉ được ghi một lần
+        torch.save(state, tmp)
+        os.replace(tmp, WEIGHTS_MMAP_PATH)
+        tmp.write_text(json.dumps(current), encoding="utf-8")
+        os.replace(tmp, FINGERPRINT_PATH)
+        return True
+    except Exception as err:
+        print(f"Lỗi khi ghi trọng số memory-map: {err}")
+        return False
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+@contextmanager
+def _mmap_checkpoint(path):
+    """Trong khối with, Xtts.load_checkpoint đọc tensor từ path (mmap) và gán thay vì chép vào model."""
+    import torch
+    from TTS.tts.models.xtts import Xtts
+
+    def get_compatible_checkpoint_state_dict(self, model_path):
+        return torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+
+    def load_state_dict(self, state_dict, strict=True, assign=False):
+        return torch.nn.Module.load_state_dict(self, state_dict, strict=strict, assign=True)
+
+    patched = {
+        "get_compatible_checkpoint_state_dict": get_compatible_checkpoint_state_dict,
+        "load_state_dict": load_state_dict,
+    }
+    originals = {name: Xtts.__dict__.get(name) for name in patched}
+    for name, func in patched.items():
+        setattr(Xtts, name, func)
+    try:
+        yield
+    finally:
+        for name, func in originals.items():
+            if func is None:
+                delattr(Xtts, name)
+            else:
+                setattr(Xtts, name, func)
+
+
+def load(factory, model_name: str):
+    """Tạo model TTS model_name bằng factory() (vd. lambda: TTS(model_name)).
+
+    File trọng số memory-map còn đúng với checkpoint gốc thì nạp từ đó. Nếu chưa có (hoặc đã cũ),
+    một process nạp từ checkpoint gốc và ghi file dưới file khoá; các process khác chờ khoá rồi map
+    file vừa ghi. Gọi dưới một khoá trong process (synthesis.get_tts) vì Xtts bị vá tạm thời khi nạp.
+    """
+    if not WEIGHTS_MMAP:
+        return factory()
+    if not is_current(model_name):
+        if _acquire_lock():
+            try:
+                # process khác có thể vừa ghi xong trong lúc chờ khoá
+                if not is_current(model_name):
+                    tts = factory()
+                    save(tts.synthesizer.tts_model, model_name)
+                    return tts
+            finally:
+                LOCK_PATH.unlink(missing_ok=True)
+        else:
+            print(f"Lỗi khi chờ file khoá {LOCK_PATH}: quá {WEIGHTS_LOCK_TIMEOUT}s, nạp từ checkpoint gốc.")
+    if is_current(model_name):
+        try:
+            with _mmap_checkpoint(WEIGHTS_MMAP_PATH):
+                return factory()
+        except Exception as err:
+            print(f"Lỗi khi nạp trọng số memory-map {WEIGHTS_MMAP_PATH}: {err}; nạp lại từ checkpoint gốc.")
+    return factory()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chuyển checkpoint XTTS sang trọng số memory-map")
+    parser.add_argument("--force", action="store_true", help="ghi lại kể cả khi đã có file")
+    args = parser.parse_args()
+    if not WEIGHTS_MMAP:
+        print("WEIGHTS_MMAP đang tắt trong settings.py.")
+        return
+    if args.force:
+        FINGERPRINT_PATH.unlink(missing_ok=True)
+
+    import synthesis
+
+    started = time.perf_counter()
+    synthesis.load_tts("cpu")
+    if is_current(synthesis.MODEL_NAME):
+        size = WEIGHTS_MMAP_PATH.stat().st_size / 1024 ** 3
+        print(f"Trọng số memory-map: {WEIGHTS_MMAP_PATH} ({size:.2f} GB, {time.perf_counter() - started:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()